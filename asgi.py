@@ -0,0 +1,162 @@
+"""
+ASGI application serving the FastAPI routers
+
+    WEB_CONCURRENCY=4 uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+WEB_CONCURRENCY rather than --workers, so that each worker's inference pool
+gets its share of the CPUs (see services/inference_pool.py).
+
+Handlers await the database through a pooled async engine (the async driver
+for DATABASE_URL, or ASYNC_DATABASE_URL) and run decoding, inference and
+gallery matching in threads or the inference pool, so one worker keeps
+serving while a frame is being recognised. The pages and the WebSocket
+stream are still served by the Flask app in main.py.
+"""
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+
+import models
+from database import SessionLocal, call_with_session, engine, get_async_engine
+from routes import attendance, course, student
+from routes.uploads import image_upload
+from services import metrics
+from services.face_recognition_service import detect_faces, get_inference_pool, use_inference_pool
+from services.frame_cache import frame_cache
+from services.image_payload import ImagePayload
+from services.inference_pool import InferenceOverloaded, create_inference_pool
+from services.startup import load_worker_state
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from services.write_behind import start_write_behind, stop_write_behind
+
+    # Create missing tables, as app.py does for the Flask app
+    await run_in_threadpool(models.db.metadata.create_all, engine)
+
+    # Run dlib detection/encoding in a per-worker process pool
+    use_inference_pool(create_inference_pool())
+    await run_in_threadpool(call_with_session, load_worker_state)
+
+    # Count and time SQL statements per request (METRICS_ENABLED=1)
+    async_engine = get_async_engine()
+    metrics.instrument_engine(engine)
+    metrics.instrument_engine(async_engine.sync_engine)
+
+    # Durable write-behind for attendance marks (ATTENDANCE_WRITE_BEHIND=1)
+    await run_in_threadpool(start_write_behind, SessionLocal)
+    try:
+        yield
+    finally:
+        await run_in_threadpool(stop_write_behind)
+        pool = get_inference_pool()
+        if pool is not None:
+            pool.shutdown()
+        await async_engine.dispose()
+
+
+class ServerTimingMiddleware:
+    """
+    Collect per-stage timings for each HTTP request and send them in a
+    Server-Timing header (METRICS_ENABLED=1)
+
+    The header goes out with the response start; the request's histograms
+    are recorded once the handler has returned.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                server_timing = metrics.current_server_timing()
+                if server_timing:
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", server_timing.encode("latin-1"))]}
+            await send(message)
+
+        token = metrics.begin_request()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = scope.get("route")
+            metrics.end_request(token, getattr(route, "path", "unmatched"))
+
+
+app = FastAPI(title="Biometric Attendance", lifespan=lifespan)
+app.add_middleware(ServerTimingMiddleware)
+app.include_router(student.router)
+app.include_router(attendance.router)
+app.include_router(course.router)
+
+
+@app.exception_handler(InferenceOverloaded)
+async def inference_overloaded(request: Request, e: InferenceOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "message": str(e)},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        return JSONResponse(status_code=404, content={"error": "Metrics are disabled, set METRICS_ENABLED=1"})
+    return Response(metrics.render_metrics(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+@app.post("/api/detect-faces")
+async def detect_faces_endpoint(upload: ImagePayload = Depends(image_upload)):
+    """Face boxes in a frame, and a handle to mark or register from it without resending the image"""
+    image_data = upload.image_data
+    try:
+        # Detect faces, or follow them with a tracker for clients that opted in
+        client_id = upload.fields.get("client_id")
+        if client_id:
+            from services.face_tracking import tracking_sessions
+            face_locations = await run_in_threadpool(tracking_sessions.get(str(client_id)).process, image_data)
+        else:
+            _, face_locations = await run_in_threadpool(detect_faces, image_data, draw=False)
+
+        # Keep the frame so a mark/register call on it can skip full-frame detection
+        frame_handle = frame_cache.put(image_data, face_locations) if face_locations else None
+        return {
+            "success": True,
+            "faces": face_locations,
+            "frame_handle": frame_handle,
+        }
+    except InferenceOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error detecting faces: {str(e)}")
+        return {
+            "success": False,
+            "message": str(e)
+        }
+
+
+@app.get("/api/inference/stats")
+async def inference_stats():
+    from services.frame_quality import quality_stats
+    from services.micro_batcher import recognition_batcher
+    from services.roster_cache import roster_cache
+
+    pool = get_inference_pool()
+    stats = pool.stats() if pool is not None else {"enabled": False}
+    stats["microbatch"] = recognition_batcher.stats() if recognition_batcher is not None else {"enabled": False}
+    stats["frame_cache"] = frame_cache.stats()
+    stats["quality"] = quality_stats.stats()
+    stats["roster"] = roster_cache.stats()
+    return stats
@@ -0,0 +1,69 @@
+"""
+Recall and latency of the IVF index against exact search.
+
+    python benchmarks/ann_recall.py --sizes 10000 100000 --nprobe 1 4 8 16 32
+
+For each synthetic gallery size the exact FaceGallery scan is timed first,
+then one IVF index is built and searched at every nprobe setting. Recall@1
+is the fraction of probes whose nearest neighbour matches the exact
+search; recall@k compares the whole top-k set.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common import print_table, summarize, synthetic_gallery, synthetic_probes, time_calls
+from services.ann_index import IVFIndex
+from services.face_gallery import FaceGallery
+
+
+def run(size: int, nprobes, n_lists: int, queries: int, k: int):
+    encodings = synthetic_gallery(size)
+    ids = np.arange(1, size + 1)
+    probes, _ = synthetic_probes(encodings, queries)
+
+    gallery = FaceGallery(ids, encodings)
+    exact = [gallery.match(probe, k=k).candidates for probe in probes]
+    exact_ms = summarize(time_calls(lambda p: gallery.match(p, k=k), list(probes)))
+
+    rows = [{"size": size, "search": "exact", "recall@1": 1.0, f"recall@{k}": 1.0, **exact_ms, "speedup": 1.0}]
+
+    start = time.perf_counter()
+    index = IVFIndex.build(ids, encodings, n_lists=n_lists or None)
+    build_s = time.perf_counter() - start
+    print(f"size={size}: built {index.n_lists} lists in {build_s:.2f}s")
+
+    for nprobe in nprobes:
+        hits_at_1 = 0
+        hits_at_k = 0
+        for probe, truth in zip(probes, exact):
+            found, _ = index.search(probe, k=k, nprobe=nprobe)
+            hits_at_1 += int(len(found) > 0 and found[0] == truth[0][0])
+            hits_at_k += len(set(found.tolist()) & {i for i, _ in truth})
+        latency = summarize(time_calls(lambda p: index.search(p, k=k, nprobe=nprobe), list(probes)))
+        rows.append({
+            "size": size,
+            "search": f"ivf nprobe={nprobe}",
+            "recall@1": hits_at_1 / len(probes),
+            f"recall@{k}": hits_at_k / (len(probes) * k),
+            **latency,
+            "speedup": exact_ms["mean_ms"] / latency["mean_ms"],
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF recall/latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--lists", type=int, default=0, help="Number of partitions, 0 for sqrt(N)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.extend(run(size, args.nprobe, args.lists, args.queries, args.k))
+
+    print_table(results, ["size", "search", "recall@1", f"recall@{args.k}", "mean_ms", "p95_ms", "speedup"])
@@ -0,0 +1,144 @@
+"""Shared helpers for the offline benchmarks."""
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Allow running the benchmarks as scripts from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENCODING_DIM = 128
+
+
+def synthetic_gallery(n: int, seed: int = 0) -> np.ndarray:
+    """
+    Random 128-d encodings with roughly the geometry of dlib face encodings:
+    different people sit about 0.9-1.0 apart, well outside the 0.6 tolerance.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.normal(0.0, 0.08, size=(n, ENCODING_DIM))
+
+
+def synthetic_probes(gallery: np.ndarray, n: int, noise: float = 0.025, seed: int = 1):
+    """
+    Noisy re-captures of randomly chosen gallery rows
+
+    Returns:
+        Tuple of (probes, index of the gallery row each probe came from).
+        The default noise puts a probe about 0.3 from its source, a typical
+        same-person distance.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(gallery), size=n)
+    probes = gallery[rows] + rng.normal(0.0, noise, size=(n, gallery.shape[1]))
+    return probes, rows
+
+
+def synthetic_frame(width: int = 640, height: int = 480, quality: int = 90, seed: int = 0) -> bytes:
+    """
+    A kiosk-sized JPEG with smooth gradients and sensor-like noise, close to
+    a real capture in file size and decode cost. It contains no face.
+    """
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255.0 / width, y * 255.0 / height, (x + y) * 127.0 / (width + height)], axis=-1)
+    img = np.clip(base + rng.normal(0.0, 12.0, size=base.shape), 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def seed_attendance(session, models, students: int, days: int, end_day: date,
+                    encodings: Optional[np.ndarray] = None, absence_rate: float = 0.1, seed: int = 0) -> int:
+    """
+    Insert students and an attendance history into empty tables
+
+    Every student gets one check-in/check-out pair per weekday of the
+    ``days`` days ending at ``end_day``, except on a random ``absence_rate``
+    of days. Rows are inserted with executemany in chunks; the caller
+    creates the tables.
+
+    Args:
+        encodings: Optional (students, 128) array stored as face encodings
+
+    Returns:
+        Number of attendance records
+    """
+    from services.encoding_codec import pack_encoding
+
+    for start in range(0, students, 10000):
+        session.execute(models.Student.__table__.insert(), [
+            {
+                "id": i, "student_id": f"S{i:06d}", "name": f"Student {i}", "email": f"s{i}@example.com",
+                "face_encoding": pack_encoding(encodings[i - 1]) if encodings is not None else None,
+            }
+            for i in range(start + 1, min(start + 10000, students) + 1)
+        ])
+
+    rng = random.Random(seed)
+    records = 0
+    rows = []
+    for offset in range(days):
+        day = end_day - timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for student_id in range(1, students + 1):
+            if rng.random() < absence_rate:
+                continue
+            minutes = rng.randrange(90)
+            check_in = datetime.combine(day, datetime.min.time()) + timedelta(hours=8, minutes=minutes)
+            rows.append({
+                "student_id": student_id,
+                "check_in": check_in,
+                "check_out": check_in + timedelta(hours=6),
+                "status": "late" if minutes >= 60 else "present",
+            })
+            if len(rows) >= 50000:
+                session.execute(models.Attendance.__table__.insert(), rows)
+                records += len(rows)
+                rows = []
+    if rows:
+        session.execute(models.Attendance.__table__.insert(), rows)
+        records += len(rows)
+    session.commit()
+    return records
+
+
+def time_calls(fn: Callable, args: Sequence, warmup: int = 3) -> List[float]:
+    """Call ``fn`` once per element of ``args`` and return latencies in ms"""
+    for arg in args[:warmup]:
+        fn(arg)
+    latencies = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def summarize(latencies_ms: Sequence[float]) -> Dict[str, float]:
+    values = np.asarray(latencies_ms)
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def print_table(rows: List[Dict], columns: Sequence[str]):
+    """Print result rows as an aligned plain-text table"""
+    def fmt(value):
+        if isinstance(value, float):
+            return f"{value:.3f}"
+        return str(value)
+
+    widths = [max(len(col), *(len(fmt(row.get(col, ""))) for row in rows)) for col in columns]
+    print("  ".join(col.rjust(width) for col, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(fmt(row.get(col, "")).rjust(width) for col, width in zip(columns, widths)))
@@ -0,0 +1,94 @@
+"""
+Daily report latency on a seeded SQLite database.
+
+    python benchmarks/daily_report.py --students 1000 --days 365
+
+Seeds one attendance record per student per weekday for the past year,
+then times the original per-student report (one func.date() query per
+student) against the single LEFT JOIN report, with and without the
+(student_id, check_in) index. The range report is timed over --range-days.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from common import print_table, seed_attendance, summarize
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "attendance_report_bench.sqlite")
+
+
+def per_student_report(db, models, day: date):
+    """The report as originally written: one query per student"""
+    report = []
+    for student in db.session.query(models.Student).all():
+        attendance = db.session.query(models.Attendance).filter(
+            models.Attendance.student_id == student.id,
+            db.func.date(models.Attendance.check_in) == day,
+        ).first()
+        report.append((student.id, attendance.status if attendance else "absent"))
+    return report
+
+
+def timed(fn, repeats: int):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--range-days", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+    os.environ.setdefault("ATTENDANCE_TIMEZONE", "UTC")
+
+    from app import app, db
+    import models
+    from services.report_service import daily_report
+
+    end_day = date.today()
+    day = end_day - timedelta(days=(end_day.weekday() + 3) % 7 or 7)  # a recent weekday
+    range_start = day - timedelta(days=args.range_days - 1)
+
+    with app.app_context():
+        start = time.perf_counter()
+        db.drop_all()
+        db.create_all()
+        records = seed_attendance(db.session, models, args.students, args.days, end_day)
+        print(f"Seeded {args.students} students, {records} attendance records in {time.perf_counter() - start:.1f}s")
+
+        session = db.session
+        rows = [
+            {"report": "per-student (original)", "index": "yes",
+             **timed(lambda: per_student_report(db, models, day), max(1, args.repeats // 2))},
+            {"report": "single join, 1 day", "index": "yes",
+             **timed(lambda: daily_report(session, day), args.repeats)},
+            {"report": f"single join, {args.range_days} days", "index": "yes",
+             **timed(lambda: daily_report(session, range_start, day), args.repeats)},
+        ]
+
+        session.execute(db.text("DROP INDEX ix_attendances_student_check_in"))
+        session.commit()
+        rows += [
+            {"report": "single join, 1 day", "index": "no",
+             **timed(lambda: daily_report(session, day), args.repeats)},
+            {"report": f"single join, {args.range_days} days", "index": "no",
+             **timed(lambda: daily_report(session, range_start, day), args.repeats)},
+        ]
+
+    print_table(rows, ["report", "index", "mean_ms", "p50_ms", "p95_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Latency and detection rate of HOG detection at different scales.
+
+    python benchmarks/detection_scale.py --images path/to/frames --scales 1.0 0.5 0.33 0.25
+
+Every image is resized to the kiosk frame size (640x480 by default) and run
+through locate_faces() at each scale. The reference is detection at scale
+1.0: "detection rate" is the fraction of frames where at least one face was
+found, and "box recall" the fraction of reference boxes matched by a box
+at the given scale with IoU >= 0.5. Use a folder of real kiosk captures;
+synthetic images contain no faces.
+"""
+import argparse
+import glob
+import os
+
+import cv2
+
+from common import print_table, summarize, time_calls
+from services.face_recognition_service import locate_faces
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def iou(a, b) -> float:
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - inter
+    return inter / union if union else 0.0
+
+
+def load_frames(folder: str, width: int, height: int):
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(folder, pattern)))
+    frames = []
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        frames.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detection scale benchmark")
+    parser.add_argument("--images", required=True, help="Folder of frames containing faces")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.33, 0.25])
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    frames = load_frames(args.images, args.width, args.height)
+    if not frames:
+        parser.error(f"No images found in {args.images}")
+
+    reference = [locate_faces(frame, 1.0) for frame in frames]
+    reference_boxes = sum(len(boxes) for boxes in reference)
+
+    rows = []
+    for scale in args.scales:
+        found = [locate_faces(frame, scale) for frame in frames]
+        matched = sum(
+            sum(1 for ref in ref_boxes if any(iou(ref, box) >= 0.5 for box in boxes))
+            for ref_boxes, boxes in zip(reference, found)
+        )
+        latency = summarize(time_calls(lambda frame: locate_faces(frame, scale), frames, warmup=1))
+        rows.append({
+            "scale": scale,
+            "frames": len(frames),
+            "detection_rate": sum(1 for boxes in found if boxes) / len(frames),
+            "box_recall": matched / reference_boxes if reference_boxes else 0.0,
+            **latency,
+        })
+
+    print_table(rows, ["scale", "frames", "detection_rate", "box_recall", "mean_ms", "p50_ms", "p95_ms"])
@@ -0,0 +1,232 @@
+"""
+Concurrent load test of the Flask and ASGI serving paths.
+
+    python benchmarks/serving.py
+    python benchmarks/serving.py --concurrency 1 16 64 --requests 1000 --workers 2
+    python benchmarks/serving.py --endpoints mark --images path/to/frames --output serving.json
+
+Seeds a SQLite database (or uses --database-url as is), then starts each
+server on a free port with the same number of worker processes: gunicorn
+with threaded workers on main:app, and uvicorn on asgi:app. Every endpoint
+is driven by --concurrency clients at a time, each sending its next request
+as soon as the last one returns, and the table shows throughput, latency
+percentiles and non-2xx responses per server, endpoint and concurrency.
+
+Endpoints:
+    students  GET /api/students/?limit=50
+    report    GET /api/attendance/report/daily for a seeded weekday
+    summary   GET /api/attendance/report/summary over the seeded range
+    mark      POST /api/attendance/mark with JPEG frames from --images; marks
+              need face_recognition and frames with an enrolled face, and are
+              skipped without them
+
+Pass the same --database-url (e.g. MySQL) the deployment uses to compare
+with a real connection pool; SQLite serialises writers and favours neither
+server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from common import print_table, seed_attendance, summarize, synthetic_gallery
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("students", "report", "summary", "mark")
+COLUMNS = ["server", "endpoint", "concurrency", "n", "rps", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(server: str, port: int, workers: int, threads: int):
+    if server == "flask":
+        return [sys.executable, "-m", "gunicorn", "main:app", "--workers", str(workers), "--worker-class", "gthread",
+                "--threads", str(threads), "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    return [sys.executable, "-m", "uvicorn", "asgi:app", "--workers", str(workers), "--host", "127.0.0.1",
+            "--port", str(port), "--log-level", "warning", "--no-access-log"]
+
+
+def start_server(server: str, env, log_path: str, workers: int, threads: int, timeout: float = 120.0):
+    """Start a server and wait until it answers; returns (process, base URL)"""
+    import httpx
+
+    port = free_port()
+    log = open(log_path, "wb")
+    # uvicorn's --workers is not visible to the app; WEB_CONCURRENCY sizes the inference pools
+    env = {**env, "WEB_CONCURRENCY": str(workers)}
+    process = subprocess.Popen(server_command(server, port, workers, threads), cwd=ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} exited with status {process.returncode}, see {log_path}")
+        try:
+            if httpx.get(f"{base_url}/api/students/?limit=1", timeout=2.0).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    stop_server(process)
+    raise RuntimeError(f"{server} did not start within {timeout:.0f}s, see {log_path}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def drive(base_url: str, make_request, total: int, concurrency: int):
+    """
+    Send ``total`` requests from ``concurrency`` clients
+
+    Returns:
+        (latencies in ms, non-2xx count, wall time in s)
+    """
+    import httpx
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        async def run_client():
+            nonlocal errors
+            for i in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await make_request(client, i)
+                    ok = response.is_success
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append((time.perf_counter() - start) * 1000.0)
+                errors += not ok
+
+        # Warm connections and caches before timing
+        await asyncio.gather(*(make_request(client, i) for i in range(min(concurrency, 8))))
+        start = time.perf_counter()
+        await asyncio.gather(*(run_client() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - start
+
+
+def request_makers(day: date, start_day: date, frames):
+    makers = {
+        "students": lambda client, i: client.get("/api/students/", params={"limit": 50}),
+        "report": lambda client, i: client.get("/api/attendance/report/daily", params={"date": day.isoformat()}),
+        "summary": lambda client, i: client.get("/api/attendance/report/summary", params={
+            "start_date": start_day.isoformat(), "end_date": day.isoformat()}),
+    }
+    if frames:
+        makers["mark"] = lambda client, i: client.post(
+            "/api/attendance/mark", content=frames[i % len(frames)], headers={"Content-Type": "image/jpeg"})
+    return makers
+
+
+def load_frames(folder: str):
+    if not folder:
+        return []
+    try:
+        import face_recognition  # noqa: F401
+    except ImportError:
+        print("  mark: skipped (face_recognition is not installed)")
+        return []
+    frames = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith((".jpg", ".jpeg")):
+            with open(os.path.join(folder, name), "rb") as image:
+                frames.append(image.read())
+    return frames
+
+
+def seed_database(url: str, students: int, days: int, end_day: date):
+    os.environ["DATABASE_URL"] = url
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    import models
+    from app import db
+
+    engine = create_engine(url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        records = seed_attendance(session, models, students, days, end_day, encodings=synthetic_gallery(students))
+    engine.dispose()
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--servers", nargs="+", choices=("flask", "asgi"), default=["flask", "asgi"])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=["students", "report", "summary"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400, help="Requests per endpoint and concurrency")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes per server")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--images", help="Folder of JPEG frames with enrolled faces, for the mark endpoint")
+    parser.add_argument("--database-url", help="Use this database as is instead of seeding SQLite")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="serving-bench-")
+    end_day = date.today()
+    day = end_day - timedelta(days=(end_day.weekday() + 3) % 7 or 7)  # a recent weekday
+    start_day = end_day - timedelta(days=args.history_days - 1)
+
+    url = args.database_url
+    if url is None:
+        url = f"sqlite:///{os.path.join(workdir, 'serving.sqlite')}"
+        start = time.perf_counter()
+        records = seed_database(url, args.students, args.history_days, end_day)
+        print(f"Seeded {args.students} students, {records} attendance records in {time.perf_counter() - start:.1f}s")
+
+    env = {**os.environ, "DATABASE_URL": url, "PYTHONPATH": os.pathsep.join(
+        [ROOT, *filter(None, [os.environ.get("PYTHONPATH")])])}
+    makers = request_makers(day, start_day, load_frames(args.images) if "mark" in args.endpoints else [])
+
+    rows = []
+    for server in args.servers:
+        log_path = os.path.join(workdir, f"{server}.log")
+        process, base_url = start_server(server, env, log_path, args.workers, args.threads)
+        try:
+            for endpoint in args.endpoints:
+                if endpoint not in makers:
+                    continue
+                for concurrency in args.concurrency:
+                    latencies, errors, elapsed = asyncio.run(
+                        drive(base_url, makers[endpoint], args.requests, concurrency))
+                    rows.append({
+                        "server": server, "endpoint": endpoint, "concurrency": concurrency, "n": len(latencies),
+                        "rps": len(latencies) / elapsed, "errors": errors, **summarize(latencies),
+                    })
+                    print(f"  {server} {endpoint} x{concurrency}: {rows[-1]['rps']:.0f} req/s")
+        finally:
+            stop_server(process)
+
+    print_table(rows, COLUMNS)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"workers": args.workers, "threads": args.threads, "students": args.students,
+                       "results": rows}, output, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
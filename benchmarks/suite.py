@@ -0,0 +1,251 @@
+"""
+Micro-benchmark suite for the recognition and reporting hot paths.
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --sizes 1000 10000 --images path/to/frames --output after.json
+    python benchmarks/suite.py --compare before.json after.json
+
+Runs offline on CPU. The image stages (decode, detect, encode) run on a
+synthetic kiosk-sized JPEG, or on the frames in --images; the synthetic
+frame has no face, so encode then runs on a fixed box. Detect and encode
+need face_recognition and are reported as skipped without it.
+
+For every gallery size, random 128-d encodings are enrolled in a seeded
+SQLite database with --history-days of attendance, then the suite times
+loading the gallery, matching noisy probes (FaceGallery and the brute-force
+face_distance computation it replaced), marking attendance (toggle and
+commit) and the daily and summary reports.
+
+Results are written as JSON; --compare prints the p50 change of every stage
+between two result files and exits with status 1 if any stage got slower
+than --threshold percent.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from common import print_table, seed_attendance, summarize, synthetic_frame, synthetic_gallery, synthetic_probes, time_calls
+
+IMAGE_PATTERNS = (".jpg", ".jpeg", ".png")
+STAGE_COLUMNS = ["stage", "size", "n", "mean_ms", "p50_ms", "p95_ms", "p99_ms"]
+
+
+def result(stage: str, size, latencies_ms) -> dict:
+    return {"stage": stage, "size": size, "n": len(latencies_ms), **summarize(latencies_ms)}
+
+
+def skipped(stage: str, size, reason: str) -> dict:
+    print(f"  {stage}: skipped ({reason})")
+    return {"stage": stage, "size": size, "skipped": reason}
+
+
+def load_frames(folder: str):
+    if not folder:
+        return [synthetic_frame(seed=seed) for seed in range(10)]
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_PATTERNS)
+    )
+    frames = []
+    for path in paths:
+        with open(path, "rb") as image:
+            frames.append(image.read())
+    return frames
+
+
+def image_stages(frames, repeats: int):
+    """decode, detect and encode, independent of the gallery"""
+    import cv2
+
+    data_urls = ["data:image/jpeg;base64," + base64.b64encode(frame).decode() for frame in frames]
+    calls = (data_urls * repeats)[:max(repeats, len(data_urls))]
+
+    def decode(data_url):
+        image_data = base64.b64decode(data_url.split(",")[1])
+        return cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+
+    results = [result("decode", None, time_calls(decode, calls))]
+    rgb_frames = [cv2.cvtColor(decode(data_url), cv2.COLOR_BGR2RGB) for data_url in data_urls]
+
+    try:
+        import face_recognition
+        from services.face_recognition_service import RECOGNITION_DETECTION_SCALE, locate_faces
+    except ImportError as e:
+        reason = f"face_recognition not available: {e}"
+        return results + [skipped("detect", None, reason), skipped("encode", None, reason)]
+
+    rgb_calls = (rgb_frames * repeats)[:max(repeats, len(rgb_frames))]
+    results.append(result("detect", None, time_calls(lambda rgb: locate_faces(rgb, RECOGNITION_DETECTION_SCALE), rgb_calls)))
+
+    def box(rgb):
+        found = locate_faces(rgb, RECOGNITION_DETECTION_SCALE)
+        if found:
+            return found[0]
+        height, width = rgb.shape[:2]
+        return (height // 4, width * 3 // 4, height * 3 // 4, width // 4)
+
+    boxed = [(rgb, box(rgb)) for rgb in rgb_frames]
+    boxed_calls = (boxed * repeats)[:max(repeats, len(boxed))]
+    results.append(result(
+        "encode", None,
+        time_calls(lambda item: face_recognition.face_encodings(item[0], known_face_locations=[item[1]]), boxed_calls),
+    ))
+    return results
+
+
+def gallery_stages(size: int, args, workdir: str):
+    """Stages that depend on the number of enrolled students"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    import models
+    from app import db
+    from services.attendance_service import toggle_attendance
+    from services.attendance_sessions import AttendanceSessions
+    from services.face_gallery import FaceGallery
+    from services.gallery_cache import encoding_rows
+    from services.report_service import daily_report
+    from services.rollup_service import attendance_summary, rebuild_rollups
+
+    path = os.path.join(workdir, f"suite_{size}.sqlite")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    end_day = date.today()
+    day = end_day - timedelta(days=(end_day.weekday() + 3) % 7 or 7)  # a recent weekday
+    encodings = synthetic_gallery(size)
+    start = time.perf_counter()
+    records = seed_attendance(session, models, size, args.history_days, end_day, encodings=encodings)
+    rebuild_rollups(session)
+    session.commit()
+    print(f"size={size}: seeded {records} attendance records in {time.perf_counter() - start:.1f}s")
+
+    results = [result("gallery_load", size, time_calls(
+        lambda _: FaceGallery.from_rows(encoding_rows(session)), range(args.report_repeats), warmup=1
+    ))]
+
+    gallery = FaceGallery.from_rows(encoding_rows(session))
+    probes, _ = synthetic_probes(encodings, args.probes)
+    probes = list(probes)
+    results.append(result("match", size, time_calls(gallery.match, probes)))
+    # What face_recognition.face_distance/compare_faces computed per request
+    results.append(result("match_bruteforce", size, time_calls(
+        lambda probe: int(np.argmin(np.linalg.norm(encodings - probe, axis=1))), probes
+    )))
+
+    # Each mark writes: no cooldown, alternating check-ins and check-outs
+    sessions = AttendanceSessions(cooldown_seconds=0)
+    rng = np.random.default_rng(2)
+    marked_at = datetime.combine(end_day, datetime.min.time()).replace(hour=10)
+    marks = [(int(student_id), marked_at + timedelta(seconds=i)) for i, student_id in enumerate(
+        rng.integers(1, size + 1, size=args.marks)
+    )]
+
+    def mark(item):
+        toggle_attendance(session, [item[0]], item[1], sessions)
+        session.commit()
+
+    results.append(result("mark", size, time_calls(mark, marks)))
+    results.append(result("report_daily", size, time_calls(
+        lambda _: daily_report(session, day), range(args.report_repeats), warmup=1
+    )))
+    results.append(result("report_summary", size, time_calls(
+        lambda _: attendance_summary(session, day - timedelta(days=29), day), range(args.report_repeats), warmup=1
+    )))
+
+    session.close()
+    engine.dispose()
+    if not args.keep_databases:
+        os.remove(path)
+    return results
+
+
+def run(args):
+    os.environ.setdefault("ATTENDANCE_TIMEZONE", "UTC")
+    workdir = args.workdir or tempfile.gettempdir()
+    # app.py creates its tables on import; point it at a scratch database
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'suite_app.sqlite')}"
+
+    results = image_stages(load_frames(args.images), args.image_repeats)
+    for size in args.sizes:
+        results += gallery_stages(size, args, workdir)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "images": args.images or "synthetic",
+            "history_days": args.history_days,
+        },
+        "results": results,
+    }
+    print_table([{**row, "size": row["size"] or "-"} for row in results if "skipped" not in row], STAGE_COLUMNS)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Wrote {args.output}")
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """Print the p50 change per stage; returns the number of regressions"""
+    with open(baseline_path) as baseline_file, open(current_path) as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+
+    before = {(row["stage"], row["size"]): row for row in baseline["results"] if "skipped" not in row}
+    rows = []
+    regressions = 0
+    for row in current["results"]:
+        key = (row["stage"], row["size"])
+        if "skipped" in row or key not in before:
+            continue
+        base_ms, p50_ms = before[key]["p50_ms"], row["p50_ms"]
+        change = 100.0 * (p50_ms - base_ms) / base_ms if base_ms else 0.0
+        verdict = "slower" if change > threshold else "faster" if change < -threshold else ""
+        regressions += verdict == "slower"
+        rows.append({
+            "stage": row["stage"], "size": row["size"] or "-",
+            "before_p50_ms": base_ms, "after_p50_ms": p50_ms, "change_%": change, "verdict": verdict,
+        })
+
+    print_table(rows, ["stage", "size", "before_p50_ms", "after_p50_ms", "change_%", "verdict"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--history-days", type=int, default=30, help="Days of attendance seeded per gallery")
+    parser.add_argument("--images", help="Folder of frames for the image stages (default: synthetic)")
+    parser.add_argument("--image-repeats", type=int, default=30)
+    parser.add_argument("--probes", type=int, default=300)
+    parser.add_argument("--marks", type=int, default=200)
+    parser.add_argument("--report-repeats", type=int, default=5)
+    parser.add_argument("--workdir", help="Directory for the SQLite databases (default: temp dir)")
+    parser.add_argument("--keep-databases", action="store_true")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=10.0, help="p50 change in %% counted as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
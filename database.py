@@ -1,17 +1,50 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # Get database URL from environment variable
 DATABASE_URL = os.environ.get("DATABASE_URL", "mysql+pymysql://root:@localhost/attendance_system")
 
+# Async drivers for the ASGI app, by the sync driver they stand in for
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# Connection pool of the async engine, per ASGI worker
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "300"))
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its driver swapped for the async one of the same database"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend}, set ASYNC_DATABASE_URL")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+# ASYNC_DATABASE_URL overrides the derived URL, e.g. for another async driver
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")
+
 # Create SQLAlchemy engine
 engine = create_engine(DATABASE_URL)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async sessions keep loaded attributes after commit: response models are
+# built after the handler returns, where an expired attribute cannot load
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+_async_engine = None
+
 # Create Base class
 Base = declarative_base()
 
@@ -22,3 +55,42 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_async_engine():
+    """
+    The pooled async engine, created on first use so that the Flask app
+    does not need the async driver installed
+    """
+    global _async_engine
+    if _async_engine is None:
+        url = ASYNC_DATABASE_URL or async_database_url(DATABASE_URL)
+        options = {}
+        if make_url(url).get_backend_name() == "sqlite":
+            # aiosqlite otherwise opens a connection (and its thread) per checkout
+            options["poolclass"] = AsyncAdaptedQueuePool
+        _async_engine = create_async_engine(
+            url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True, **options
+        )
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+# Dependency to get an async DB session
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def call_with_session(fn, *args, **kwargs):
+    """
+    ``fn(session, *args, **kwargs)`` in a sync session of its own
+
+    For sync code run off the event loop that must not share the request's
+    async session, such as the gallery cache, which holds a lock across
+    its queries.
+    """
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
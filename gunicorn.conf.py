@@ -0,0 +1,18 @@
+"""
+gunicorn settings, read from the working directory by ``gunicorn main:app``
+
+Command-line flags still override these.
+"""
+import os
+
+# Each live overlay stream (/ws/detect-faces) keeps a worker thread for as
+# long as its camera is connected, so a worker needs one thread per kiosk
+# plus a few for ordinary requests; 32 covers ~25 cameras per worker
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+
+def post_worker_init(worker):
+    # Start the inference pool, caches and write-behind flusher in each worker
+    # once main:app is loaded, rather than as a side effect of importing it
+    from main import start_services
+    start_services(web_workers=worker.cfg.workers)
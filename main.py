@@ -1,16 +1,110 @@
 from app import app
-from flask import render_template, jsonify, request, redirect, url_for
+from flask import render_template, jsonify, request, redirect, url_for, g
+from flask_sock import Sock
 import logging
-import base64
-import json
 from datetime import datetime
-import pytz
-from services.face_recognition_service import detect_faces
+from services.face_recognition_service import detect_faces, use_inference_pool, get_inference_pool
+from services.inference_pool import InferenceOverloaded, create_inference_pool
+from services.duplicate_faces import DuplicateFace
+from services.frame_quality import FrameRejected
+from services.image_payload import ImagePayloadError
+from services import metrics
+from services.metrics import stage
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# WebSocket support for the live face-detection stream
+sock = Sock(app)
+
+_started = False
+
+def start_services(web_workers=None):
+    """
+    Start this worker's inference pool, caches and write-behind flusher
+
+    Called once per serving process, by gunicorn's post_worker_init hook
+    (gunicorn.conf.py) or under ``python main.py``, and never on import: a
+    spawned inference worker re-imports the main module and must not start
+    a pool, replay the write-behind log or warm caches of its own.
+    ``web_workers`` is the server's worker count: the inference pool's
+    default size divides the CPUs among them, and write-behind requires it
+    to be 1 (see services/write_behind.py).
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+    
+    import atexit
+    from sqlalchemy.orm import sessionmaker
+    from app import db
+    from services.startup import load_worker_state
+    from services.write_behind import start_write_behind, stop_write_behind
+    
+    # Run dlib detection/encoding in a per-worker process pool
+    use_inference_pool(create_inference_pool(web_workers=web_workers))
+    
+    with app.app_context():
+        # Warm the face gallery and other caches so the first recognition is fast
+        load_worker_state(db.session)
+        
+        # Count and time SQL statements per request (METRICS_ENABLED=1)
+        metrics.instrument_engine(db.engine)
+        
+        # Durable write-behind for attendance marks (ATTENDANCE_WRITE_BEHIND=1); replays
+        # events a previous process logged but did not apply before starting the flusher
+        if start_write_behind(sessionmaker(bind=db.engine), web_workers) is not None:
+            atexit.register(stop_write_behind)
+
+@app.before_request
+def begin_request_timing():
+    g.metrics_token = metrics.begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    token = g.pop("metrics_token", None)
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    server_timing = metrics.end_request(token, endpoint)
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
+@app.teardown_request
+def end_request_timing(exc):
+    # after_request is skipped when a response could not be built
+    token = g.pop("metrics_token", None)
+    if token is not None:
+        metrics.end_request(token, "error")
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled, set METRICS_ENABLED=1"}), 404
+    return metrics.render_metrics(), 200, {"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE}
+
+@app.errorhandler(InferenceOverloaded)
+def inference_overloaded(e):
+    response = jsonify({"success": False, "message": str(e)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.errorhandler(ImagePayloadError)
+def image_payload_error(e):
+    return jsonify({"success": False, "message": str(e)}), e.status_code
+
+@app.errorhandler(FrameRejected)
+def frame_rejected(e):
+    return jsonify(e.as_json()), 422
+
+@app.errorhandler(DuplicateFace)
+def duplicate_face(e):
+    from app import db
+    db.session.rollback()
+    return jsonify({"success": False, "message": str(e), "duplicates": e.duplicates}), 409
+
 # Routes
 @app.route("/")
 def home():
@@ -38,13 +132,8 @@ def admin_panel_page():
     return render_template("admin_panel.html", now=now)
 
 # API Routes for Students
-@app.route("/api/students/", methods=["GET"])
-def get_all_students():
-    from models import Student
-    from app import db
-    
-    students = db.session.query(Student).all()
-    return jsonify([{
+def _student_json(student):
+    return {
         "id": student.id,
         "student_id": student.student_id,
         "name": student.name,
@@ -52,7 +141,73 @@ def get_all_students():
         "face_encoding": bool(student.face_encoding),  # Convert to boolean
         "created_at": student.created_at.isoformat() if student.created_at else None,
         "updated_at": student.updated_at.isoformat() if student.updated_at else None,
-    } for student in students])
+    }
+
+def _list_response(query, serialize, orders, default_order):
+    """
+    Plain JSON array, a keyset page (``limit``/``cursor``) or a streamed
+    array (``stream=1``), depending on the request parameters
+    """
+    from flask import Response, stream_with_context
+    from services.pagination import keyset_page, parse_limit, sort_columns, stream_json_array
+    
+    try:
+        order = request.args.get("order", default_order)
+        columns, descending = sort_columns(order, orders)
+        
+        if request.args.get("stream") == "1":
+            query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+            return Response(stream_with_context(stream_json_array(query, serialize)), mimetype="application/json")
+        
+        if "limit" in request.args or "cursor" in request.args:
+            rows, next_cursor = keyset_page(
+                query, order, columns, request.args.get("cursor"), parse_limit(request.args.get("limit")), descending
+            )
+            return jsonify({"items": [serialize(row) for row in rows], "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify([serialize(row) for row in query.all()])
+
+def _request_image():
+    """
+    Image and other fields of a face request: a raw ``image/*`` body (fields
+    in the query string), a multipart upload with an ``image`` file, or JSON
+    with a base64 ``image_data`` data URI. A ``frame_handle`` from
+    /api/detect-faces or /ws/detect-faces, in any of these or the query
+    string, stands in for the image
+    
+    Raises:
+        ImagePayloadError: No usable image in the request
+    """
+    from services.image_payload import (
+        FRAME_HANDLE_FIELD, IMAGE_FIELD, MAX_IMAGE_BYTES, decode_data_uri, is_multipart, is_raw_image,
+        resolve_payload,
+    )
+    
+    if request.content_length and request.content_length > MAX_IMAGE_BYTES:
+        raise ImagePayloadError(f"Image larger than {MAX_IMAGE_BYTES} bytes", status_code=413)
+    
+    with stage("payload"):
+        if is_raw_image(request.content_type):
+            image_data, fields = request.get_data(cache=False), request.args
+        elif is_multipart(request.content_type):
+            upload = request.files.get(IMAGE_FIELD)
+            image_data, fields = (upload.read() if upload is not None else None), request.form
+        else:
+            fields = request.get_json(silent=True)
+            if not isinstance(fields, dict):
+                fields = {}
+            image_data = decode_data_uri(fields["image_data"]) if fields.get("image_data") else None
+        frame_handle = fields.get(FRAME_HANDLE_FIELD) or request.args.get(FRAME_HANDLE_FIELD)
+        return resolve_payload(image_data, fields, frame_handle)
+
+@app.route("/api/students/", methods=["GET"])
+def get_all_students():
+    from models import Student
+    from app import db
+    
+    return _list_response(db.session.query(Student), _student_json, {"id": [Student.id]}, "id")
 
 @app.route("/api/students/", methods=["POST"])
 def create_student():
@@ -82,15 +237,19 @@ def create_student():
 def register_face():
     from models import Student
     from app import db
-    from services.face_recognition_service import encode_face
+    from services.face_recognition_service import encode_face, ENROLMENT_DETECTION_SCALE
+    from services.encoding_codec import pack_encoding
+    from services.gallery_cache import bump_gallery_version
+    from services.duplicate_faces import check_enrolment
+    
+    upload = _request_image()
+    student_id = upload.fields.get("student_id")
     
     try:
-        data = request.json
-        student_id = data.get("student_id")
-        image_data = base64.b64decode(data.get("image_data").split(',')[1])
-        
-        # Get real face encoding
-        face_encoding = encode_face(image_data)
+        # Get real face encoding, at the faces of a frame handle if one was sent
+        face_encoding = encode_face(
+            upload.image_data, detection_scale=ENROLMENT_DETECTION_SCALE, face_locations=upload.face_locations
+        )
         if face_encoding is None:
             return jsonify({"success": False, "message": "No face detected in image"})
             
@@ -99,20 +258,167 @@ def register_face():
         if not student:
             return jsonify({"success": False, "message": "Student not found"}), 404
         
-        # Convert numpy array to list for JSON serialization
-        student.face_encoding = json.dumps(face_encoding.tolist())
-        db.session.commit()
+        # Refuse or flag a face already enrolled under another student
+        with stage("duplicate_check"):
+            duplicates = check_enrolment(db.session, face_encoding, student.id)
         
-        return jsonify({"success": True, "message": "Face registered successfully"})
+        # Store the encoding in the compact binary format
+        student.face_encoding = pack_encoding(face_encoding)
+        bump_gallery_version(db.session, [student.id])
+        with stage("commit"):
+            db.session.commit()
+        
+        return jsonify({"success": True, "message": "Face registered successfully", "duplicates": duplicates})
         
+    except (InferenceOverloaded, FrameRejected, DuplicateFace):
+        raise
     except Exception as e:
         logger.error(f"Error registering face: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route("/api/students/<int:student_id>/templates", methods=["GET"])
+def list_face_templates(student_id):
+    from models import FaceTemplate, Student
+    from app import db
+    from services.template_service import template_json
+    
+    student = db.session.get(Student, student_id)
+    if not student:
+        return jsonify({"error": "Student not found"}), 404
+    
+    templates = db.session.query(FaceTemplate).filter(FaceTemplate.student_id == student_id).order_by(FaceTemplate.id)
+    return jsonify({
+        "student_id": student_id,
+        "primary": bool(student.face_encoding),
+        "templates": [template_json(template) for template in templates],
+    })
+
+@app.route("/api/students/<int:student_id>/templates", methods=["POST"])
+def add_face_template(student_id):
+    from models import Student
+    from app import db
+    from services.face_recognition_service import encode_face, ENROLMENT_DETECTION_SCALE
+    from services.template_service import add_template, template_json
+    from services.duplicate_faces import check_enrolment
+    
+    student = db.session.get(Student, student_id)
+    if not student:
+        return jsonify({"success": False, "message": "Student not found"}), 404
+    
+    upload = _request_image()
+    
+    try:
+        face_encoding = encode_face(
+            upload.image_data, detection_scale=ENROLMENT_DETECTION_SCALE, face_locations=upload.face_locations
+        )
+        if face_encoding is None:
+            return jsonify({"success": False, "message": "No face detected in image"})
+        
+        duplicates = check_enrolment(db.session, face_encoding, student.id)
+        template = add_template(db.session, student, face_encoding, upload.fields.get("label"))
+        db.session.commit()
+        return jsonify({"success": True, "template": template_json(template), "duplicates": duplicates}), 201
+    
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 400
+    except (InferenceOverloaded, FrameRejected, DuplicateFace):
+        raise
+    except Exception as e:
+        logger.error(f"Error adding face template: {str(e)}")
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/students/<int:student_id>/templates/<int:template_id>", methods=["PUT"])
+def replace_face_template(student_id, template_id):
+    from app import db
+    from services.face_recognition_service import encode_face, ENROLMENT_DETECTION_SCALE
+    from services.template_service import get_template, replace_template, template_json
+    from services.duplicate_faces import check_enrolment
+    
+    template = get_template(db.session, student_id, template_id)
+    if not template:
+        return jsonify({"success": False, "message": "Face template not found"}), 404
+    
+    upload = _request_image()
+    
+    try:
+        face_encoding = encode_face(
+            upload.image_data, detection_scale=ENROLMENT_DETECTION_SCALE, face_locations=upload.face_locations
+        )
+        if face_encoding is None:
+            return jsonify({"success": False, "message": "No face detected in image"})
+        
+        duplicates = check_enrolment(db.session, face_encoding, student_id)
+        replace_template(db.session, template, face_encoding, upload.fields.get("label"))
+        db.session.commit()
+        return jsonify({"success": True, "template": template_json(template), "duplicates": duplicates})
+    
+    except (InferenceOverloaded, FrameRejected, DuplicateFace):
+        raise
+    except Exception as e:
+        logger.error(f"Error replacing face template: {str(e)}")
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/students/<int:student_id>/templates/<int:template_id>", methods=["DELETE"])
+def delete_face_template(student_id, template_id):
+    from app import db
+    from services.template_service import get_template, remove_template
+    
+    template = get_template(db.session, student_id, template_id)
+    if not template:
+        return jsonify({"success": False, "message": "Face template not found"}), 404
+    
+    remove_template(db.session, template)
+    db.session.commit()
+    return jsonify({"success": True, "message": "Face template removed"})
+
+@app.route("/api/students/import", methods=["POST"])
+def import_students():
+    from app import db
+    from sqlalchemy.orm import sessionmaker
+    from services.bulk_import import create_import_job, parse_student_csv, save_archive, start_import
+    
+    students_file = request.files.get("students")
+    photos_file = request.files.get("photos")
+    if students_file is None or photos_file is None:
+        return jsonify({"error": "Upload a 'students' CSV and a 'photos' zip archive"}), 400
+    
+    try:
+        rows = parse_student_csv(students_file.read())
+        archive_path = save_archive(photos_file.stream)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    job = create_import_job(db.session, rows)
+    db.session.commit()
+    
+    # Encoding and inserts run in the background; poll the status URL
+    start_import(job.id, rows, archive_path, sessionmaker(bind=db.engine))
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "status_url": url_for("import_status", job_id=job.id),
+    }), 202
+
+@app.route("/api/students/import/<int:job_id>", methods=["GET"])
+def import_status(job_id):
+    from models import ImportJob
+    from app import db
+    from services.bulk_import import job_status
+    
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify({"error": "Import job not found"}), 404
+    return jsonify(job_status(job))
+
 @app.route("/api/students/<int:student_id>", methods=["DELETE"])
 def delete_student(student_id):
     from models import Student
     from app import db
+    from services.gallery_cache import bump_gallery_version
     
     try:
         # Find the student
@@ -122,6 +428,7 @@ def delete_student(student_id):
             
         # Delete the student
         db.session.delete(student)
+        bump_gallery_version(db.session, [student_id])
         db.session.commit()
         
         return jsonify({
@@ -137,86 +444,262 @@ def delete_student(student_id):
             "message": f"Error deleting student: {str(e)}"
         }), 500
 
+# API Routes for Courses
+@app.route("/api/courses/", methods=["GET"])
+def get_all_courses():
+    from models import Course
+    from app import db
+    from services.course_service import course_json
+    
+    return jsonify([course_json(course) for course in db.session.query(Course).order_by(Course.code)])
+
+@app.route("/api/courses/", methods=["POST"])
+def create_course_endpoint():
+    from app import db
+    from services.course_service import course_json, create_course
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        course = create_course(db.session, data.get("code"), data.get("name"))
+        db.session.commit()
+        return jsonify(course_json(course)), 201
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/courses/<int:course_id>/sessions", methods=["GET"])
+def list_class_sessions(course_id):
+    from models import ClassSession, Course
+    from app import db
+    from services.course_service import class_session_json
+    
+    if not db.session.get(Course, course_id):
+        return jsonify({"error": "Course not found"}), 404
+    sessions = db.session.query(ClassSession).filter(ClassSession.course_id == course_id).order_by(ClassSession.starts_at)
+    return jsonify([class_session_json(class_session) for class_session in sessions])
+
+@app.route("/api/courses/<int:course_id>/sessions", methods=["POST"])
+def add_class_session_endpoint(course_id):
+    from models import Course
+    from app import db
+    from services.course_service import add_class_session, class_session_json
+    
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({"error": "Course not found"}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        class_session = add_class_session(db.session, course, data.get("room"), data.get("starts_at"), data.get("ends_at"))
+        db.session.commit()
+        return jsonify(class_session_json(class_session)), 201
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/courses/<int:course_id>/sessions/<int:session_id>", methods=["DELETE"])
+def delete_class_session(course_id, session_id):
+    from app import db
+    from services.course_service import get_class_session, remove_class_session
+    
+    class_session = get_class_session(db.session, course_id, session_id)
+    if not class_session:
+        return jsonify({"error": "Class session not found"}), 404
+    remove_class_session(db.session, class_session)
+    db.session.commit()
+    return jsonify({"success": True, "message": "Class session removed"})
+
+@app.route("/api/courses/<int:course_id>/enrolments", methods=["GET"])
+def list_enrolments(course_id):
+    from models import Course
+    from app import db
+    from services.course_service import enrolled_student_ids
+    
+    if not db.session.get(Course, course_id):
+        return jsonify({"error": "Course not found"}), 404
+    return jsonify({"course_id": course_id, "student_ids": enrolled_student_ids(db.session, course_id)})
+
+@app.route("/api/courses/<int:course_id>/enrolments", methods=["POST"])
+def enrol_students_endpoint(course_id):
+    from models import Course
+    from app import db
+    from services.course_service import enrol_students
+    
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({"error": "Course not found"}), 404
+    
+    data = request.get_json(silent=True) or {}
+    student_ids = data.get("student_ids")
+    if not isinstance(student_ids, list):
+        return jsonify({"error": "student_ids must be a list"}), 400
+    try:
+        added = enrol_students(db.session, course, student_ids)
+        db.session.commit()
+        return jsonify({"course_id": course_id, "enrolled": added})
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/courses/<int:course_id>/enrolments/<int:student_id>", methods=["DELETE"])
+def delete_enrolment(course_id, student_id):
+    from app import db
+    from services.course_service import unenrol_student
+    
+    if not unenrol_student(db.session, course_id, student_id):
+        return jsonify({"error": "Enrolment not found"}), 404
+    db.session.commit()
+    return jsonify({"success": True, "message": "Student unenrolled"})
+
 # API Routes for Attendance
 @app.route("/api/attendance/mark", methods=["POST"])
 def mark_attendance():
-    from models import Student, Attendance
+    from models import Student
     from app import db
-    from services.face_recognition_service import encode_face, compare_faces
-    import json
+    from services.face_recognition_service import encode_face, RECOGNITION_DECODE_SCALE
+    from services.gallery_cache import gallery_cache
+    from services.roster_cache import roster_cache
+    from services.attendance_service import attendance_message
+    from services.write_behind import record_attendance
+    from services.micro_batcher import recognition_batcher
+    
+    upload = _request_image()
     
     try:
-        data = request.json
-        image_data = base64.b64decode(data.get("image_data").split(',')[1])
+        # The roster of the class session under way at the kiosk's room, if any,
+        # backed by the global gallery
+        with stage("gallery"):
+            gallery = roster_cache.get(db.session, gallery_cache.get(db.session), upload.fields.get("room"))
+        
+        if recognition_batcher is not None and not upload.face_locations:
+            # Encode and match together with concurrent requests
+            with stage("recognize"):
+                face_encoding, match = recognition_batcher.recognize(upload.image_data, gallery)
+        else:
+            # Get face encoding from captured image, or from the faces of a frame handle
+            face_encoding = encode_face(
+                upload.image_data, decode_scale=RECOGNITION_DECODE_SCALE, face_locations=upload.face_locations
+            )
+            # Match against the roster, then all stored face encodings on a miss
+            with stage("match"):
+                match = gallery.match(face_encoding) if face_encoding is not None else None
         
-        # Get face encoding from captured image
-        face_encoding = encode_face(image_data)
         if face_encoding is None:
             return jsonify({"success": False, "message": "No face detected in image"})
         
-        # Get all students
-        students = db.session.query(Student).all()
-        matched_student = None
-        
-        # Compare with stored face encodings
-        for student in students:
-            if not student.face_encoding:
-                continue
-                
-            stored_encoding = json.loads(student.face_encoding)
-            if compare_faces(face_encoding, stored_encoding):
-                matched_student = student
-                break
-        
-        if not matched_student:
+        metrics.observe_match_distance(match.distance)
+        if match.student_id is None:
             return jsonify({"success": False, "message": "Face not recognized"})
         
-        # Mark attendance for matched student
-        today = datetime.now().date()
-        current_time = datetime.now(pytz.UTC)
-        
-        open_attendance = db.session.query(Attendance).filter(
-            Attendance.student_id == matched_student.id,
-            db.func.date(Attendance.check_in) == today,
-            Attendance.check_out == None
-        ).first()
+        matched_student = db.session.get(Student, match.student_id)
+        if matched_student is None:
+            # Deleted since this worker's gallery snapshot was taken
+            gallery_cache.invalidate()
+            return jsonify({"success": False, "message": "Face not recognized"})
         
-        if open_attendance:
-            # Check out
-            open_attendance.check_out = current_time
-            db.session.commit()
-            return jsonify({
-                "success": True,
-                "student_id": matched_student.id,
-                "name": matched_student.name,
-                "message": f"Attendance check-out marked for {matched_student.name}"
-            })
-        else:
-            # Check in
-            new_attendance = Attendance(
-                student_id=matched_student.id,
-                check_in=current_time,
-                status="present"
-            )
-            db.session.add(new_attendance)
-            db.session.commit()
-            return jsonify({
-                "success": True,
-                "student_id": matched_student.id,
-                "name": matched_student.name,
-                "message": f"Attendance check-in marked for {matched_student.name}"
-            })
+        # Check in, or check out if there is an open record for today
+        action = record_attendance(db.session, [matched_student.id])[matched_student.id]
+        return jsonify({
+            "success": True,
+            "student_id": matched_student.id,
+            "name": matched_student.name,
+            "message": attendance_message(action, matched_student.name)
+        })
             
+    except (InferenceOverloaded, FrameRejected):
+        raise
     except Exception as e:
         logger.error(f"Error marking attendance: {str(e)}")
         return jsonify({"success": False, "message": f"Error processing attendance: {str(e)}"})
 
+@app.route("/api/attendance/mark-group", methods=["POST"])
+def mark_group_attendance():
+    from models import Student
+    from app import db
+    from services.face_recognition_service import encode_faces
+    from services.gallery_cache import gallery_cache
+    from services.roster_cache import roster_cache
+    from services.attendance_service import attendance_message
+    from services.write_behind import record_attendance
+    
+    upload = _request_image()
+    
+    try:
+        # Encode every face in the frame
+        faces = encode_faces(upload.image_data, face_locations=upload.face_locations)
+        if not faces:
+            return jsonify({"success": False, "faces": [], "message": "No face detected in image"})
+        
+        # Match all faces against the room's roster, then the gallery, in one pass each
+        with stage("gallery"):
+            gallery = roster_cache.get(db.session, gallery_cache.get(db.session), upload.fields.get("room"))
+        with stage("match"):
+            matches = gallery.match_many([encoding for _, encoding in faces])
+        for match in matches:
+            metrics.observe_match_distance(match.distance)
+        matched_ids = [match.student_id for match in matches if match.student_id is not None]
+        names = dict(
+            db.session.query(Student.id, Student.name).filter(Student.id.in_(matched_ids))
+        ) if matched_ids else {}
+        if len(names) < len(set(matched_ids)):
+            # Some were deleted since this worker's gallery snapshot was taken
+            gallery_cache.invalidate()
+        
+        # Mark everyone recognised in a single transaction
+        actions = record_attendance(db.session, names.keys())
+        
+        results = []
+        for (location, _), match in zip(faces, matches):
+            student_id = match.student_id if match.student_id in names else None
+            results.append({
+                "box": list(location),
+                "recognized": student_id is not None,
+                "student_id": student_id,
+                "name": names.get(student_id),
+                "distance": match.distance,
+                "action": actions.get(student_id),
+                "message": attendance_message(actions[student_id], names[student_id])
+                if student_id is not None else "Face not recognized"
+            })
+        
+        return jsonify({
+            "success": bool(actions),
+            "faces": results,
+            "message": f"Marked attendance for {len(actions)} of {len(faces)} faces"
+        })
+        
+    except (InferenceOverloaded, FrameRejected):
+        raise
+    except Exception as e:
+        logger.error(f"Error marking group attendance: {str(e)}")
+        db.session.rollback()
+        return jsonify({"success": False, "faces": [], "message": f"Error processing attendance: {str(e)}"})
+
+def _attendance_json(attendance):
+    return {
+        "id": attendance.id,
+        "student_id": attendance.student_id,
+        "check_in": attendance.check_in.isoformat() if attendance.check_in else None,
+        "check_out": attendance.check_out.isoformat() if attendance.check_out else None,
+        "status": attendance.status,
+        "created_at": attendance.created_at.isoformat() if attendance.created_at else None,
+        "updated_at": attendance.updated_at.isoformat() if attendance.updated_at else None,
+        "student": {
+            "id": attendance.student.id,
+            "student_id": attendance.student.student_id,
+            "name": attendance.student.name,
+            "email": attendance.student.email
+        }
+    }
+
 @app.route("/api/attendance/", methods=["GET"])
 def get_all_attendance():
-    from models import Attendance, Student
+    from models import Attendance
     from app import db
     from sqlalchemy.orm import joinedload
     
+    from services.report_service import day_bounds, parse_date_range
+    
     date_str = request.args.get("date")
     student_id = request.args.get("student_id")
     
@@ -224,81 +707,84 @@ def get_all_attendance():
     
     if date_str:
         try:
-            filter_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            query = query.filter(db.func.date(Attendance.check_in) == filter_date)
-        except ValueError:
-            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+            filter_date, _ = parse_date_range(date_str)
+            # Range predicate on the raw column so the check_in index is usable
+            day_start, day_end = day_bounds(filter_date, tz_name=request.args.get("tz"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query = query.filter(Attendance.check_in >= day_start, Attendance.check_in < day_end)
     
     if student_id:
         query = query.filter(Attendance.student_id == student_id)
     
-    attendances = query.all()
+    if request.args.get("status"):
+        query = query.filter(Attendance.status == request.args.get("status"))
     
-    return jsonify([{
-        "id": attendance.id,
-        "student_id": attendance.student_id,
-        "check_in": attendance.check_in.isoformat() if attendance.check_in else None,
-        "check_out": attendance.check_out.isoformat() if attendance.check_out else None,
-        "status": attendance.status,
-        "created_at": attendance.created_at.isoformat() if attendance.created_at else None,
-        "updated_at": attendance.updated_at.isoformat() if attendance.updated_at else None,
-        "student": {
-            "id": attendance.student.id,
-            "student_id": attendance.student.student_id,
-            "name": attendance.student.name,
-            "email": attendance.student.email
-        }
-    } for attendance in attendances])
+    orders = {"id": [Attendance.id], "check_in": [Attendance.check_in, Attendance.id]}
+    if request.args.get("order", "id").lstrip("-") == "check_in":
+        # Keyset order needs a non-null sort key
+        query = query.filter(Attendance.check_in.isnot(None))
+    
+    return _list_response(query, _attendance_json, orders, "id")
 
 @app.route("/api/attendance/report/daily", methods=["GET"])
 def get_daily_report():
-    from models import Attendance, Student
     from app import db
+    from services.report_service import daily_report, parse_date_range
     
-    date_str = request.args.get("date")
-    if not date_str:
-        return jsonify({"error": "Date parameter is required"}), 400
-    
+    student_id = request.args.get("student_id", type=int)
     try:
-        filter_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-    except ValueError:
-        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
-    
-    # Get all students
-    students = db.session.query(Student).all()
-    
-    report = []
-    for student in students:
-        # Find attendance for this student on the specified date
-        attendance = db.session.query(Attendance).filter(
-            Attendance.student_id == student.id,
-            db.func.date(Attendance.check_in) == filter_date
-        ).first()
-        
-        report.append({
-            "student_id": student.id,
-            "name": student.name,
-            "email": student.email,
-            "status": attendance.status if attendance else "absent",
-            "check_in": attendance.check_in.isoformat() if attendance and attendance.check_in else None,
-            "check_out": attendance.check_out.isoformat() if attendance and attendance.check_out else None
-        })
+        start_day, end_day = parse_date_range(
+            request.args.get("date"), request.args.get("start_date"), request.args.get("end_date")
+        )
+        report = daily_report(db.session, start_day, end_day, request.args.get("tz"), student_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     return jsonify(report)
 
+@app.route("/api/attendance/report/summary", methods=["GET"])
+def get_attendance_summary():
+    from app import db
+    from services.report_service import parse_date_range
+    from services.rollup_service import attendance_summary
+    
+    student_id = request.args.get("student_id", type=int)
+    try:
+        start_day, end_day = parse_date_range(
+            start_str=request.args.get("start_date"), end_str=request.args.get("end_date")
+        )
+        summary = attendance_summary(db.session, start_day, end_day, student_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(summary)
+
 @app.route("/api/detect-faces", methods=["POST"])
 def detect_faces_endpoint():
+    from services.frame_cache import frame_cache
+    
+    upload = _request_image()
+    image_data = upload.image_data
+    
     try:
-        data = request.json
-        image_data = base64.b64decode(data.get("image_data").split(',')[1])
-        
-        # Detect faces
-        _, face_locations = detect_faces(image_data)
+        # Detect faces, or follow them with a tracker for clients that opted in
+        client_id = upload.fields.get("client_id")
+        if client_id:
+            from services.face_tracking import tracking_sessions
+            face_locations = tracking_sessions.get(str(client_id)).process(image_data)
+        else:
+            _, face_locations = detect_faces(image_data, draw=False)
         
+        # Keep the frame so a mark/register call on it can skip full-frame detection
+        frame_handle = frame_cache.put(image_data, face_locations) if face_locations else None
         return jsonify({
             "success": True,
-            "faces": face_locations
+            "faces": face_locations,
+            "frame_handle": frame_handle,
         })
+    except InferenceOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error detecting faces: {str(e)}")
         return jsonify({
@@ -306,5 +792,36 @@ def detect_faces_endpoint():
             "message": str(e)
         })
 
+@app.route("/api/inference/stats", methods=["GET"])
+def inference_stats():
+    from services.micro_batcher import recognition_batcher
+    from services.frame_cache import frame_cache
+    from services.frame_quality import quality_stats
+    from services.roster_cache import roster_cache
+    
+    pool = get_inference_pool()
+    stats = pool.stats() if pool is not None else {"enabled": False}
+    stats["microbatch"] = recognition_batcher.stats() if recognition_batcher is not None else {"enabled": False}
+    stats["frame_cache"] = frame_cache.stats()
+    stats["quality"] = quality_stats.stats()
+    stats["roster"] = roster_cache.stats()
+    return jsonify(stats)
+
+@sock.route("/ws/detect-faces")
+def detect_faces_stream(ws):
+    from services.frame_stream import serve_detection_stream
+    from services.face_tracking import FaceTrackingSession
+    
+    # Binary frames in, face boxes out; see services/frame_stream.py
+    if request.args.get("mode") == "track":
+        # Detect every few frames and track faces in between
+        serve_detection_stream(ws, FaceTrackingSession().process)
+    else:
+        serve_detection_stream(ws, lambda image_data: detect_faces(image_data, draw=False)[1])
+
 if __name__ == "__main__":
+    import os
+    # Only the debug reloader's child process serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
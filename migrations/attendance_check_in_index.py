@@ -0,0 +1,39 @@
+"""
+Add the composite (student_id, check_in) index to attendances.
+
+New databases get the index from db.create_all(); run this once against an
+existing database:
+
+    python -m migrations.attendance_check_in_index
+
+The script does nothing if the index is already there.
+"""
+import logging
+
+from sqlalchemy import inspect
+
+from app import app, db
+import models
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "ix_attendances_student_check_in"
+
+
+def migrate() -> bool:
+    """Create the index if missing; returns True if it was created"""
+    existing = {index["name"] for index in inspect(db.engine).get_indexes("attendances")}
+    if INDEX_NAME in existing:
+        logger.info(f"{INDEX_NAME} already exists, nothing to do")
+        return False
+
+    index = next(index for index in models.Attendance.__table__.indexes if index.name == INDEX_NAME)
+    index.create(db.engine)
+    logger.info(f"Created {INDEX_NAME}")
+    return True
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate()
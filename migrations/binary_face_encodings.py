@@ -0,0 +1,91 @@
+"""
+Convert students.face_encoding from JSON text to the packed binary format.
+
+Run once against an existing database:
+
+    python -m migrations.binary_face_encodings
+
+The encodings are copied into a new binary column in batches, then the old
+text column is dropped and the new one renamed into its place. The script
+can be re-run safely if it is interrupted part way, including between the
+drop and the rename, which MySQL does not run in one transaction.
+"""
+import argparse
+import logging
+
+from sqlalchemy import LargeBinary, inspect, text
+
+from app import app, db
+from services.encoding_codec import is_packed, pack_encoding, unpack_encoding
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEMP_COLUMN = "face_encoding_bin"
+
+
+def _columns(connection):
+    return {column["name"]: column for column in inspect(connection).get_columns("students")}
+
+
+def migrate(batch_size: int = 1000) -> int:
+    """Convert all JSON face encodings; returns the number of rows converted"""
+    binary_type = LargeBinary().compile(dialect=db.engine.dialect)
+
+    with db.engine.begin() as connection:
+        columns = _columns(connection)
+        if TEMP_COLUMN in columns and "face_encoding" not in columns:
+            # Stopped after dropping the text column: only the rename is left
+            connection.execute(text(f"ALTER TABLE students RENAME COLUMN {TEMP_COLUMN} TO face_encoding"))
+            logger.info("Migration finished, renamed the converted column into place")
+            return 0
+        if TEMP_COLUMN not in columns:
+            if isinstance(columns["face_encoding"]["type"], LargeBinary):
+                logger.info("students.face_encoding is already binary, nothing to do")
+                return 0
+            connection.execute(text(f"ALTER TABLE students ADD COLUMN {TEMP_COLUMN} {binary_type}"))
+
+    converted = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(
+                text(
+                    f"SELECT id, face_encoding FROM students "
+                    f"WHERE id > :last_id AND face_encoding IS NOT NULL AND {TEMP_COLUMN} IS NULL "
+                    f"ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+            if not rows:
+                break
+
+            params = []
+            for student_id, face_encoding in rows:
+                if isinstance(face_encoding, (bytes, bytearray)) and not is_packed(face_encoding):
+                    face_encoding = face_encoding.decode("utf-8")
+                params.append({"id": student_id, "data": pack_encoding(unpack_encoding(face_encoding))})
+
+            connection.execute(
+                text(f"UPDATE students SET {TEMP_COLUMN} = :data WHERE id = :id"),
+                params,
+            )
+            converted += len(params)
+            last_id = rows[-1][0]
+            logger.info(f"Converted {converted} face encodings")
+
+    with db.engine.begin() as connection:
+        connection.execute(text("ALTER TABLE students DROP COLUMN face_encoding"))
+        connection.execute(text(f"ALTER TABLE students RENAME COLUMN {TEMP_COLUMN} TO face_encoding"))
+
+    logger.info(f"Migration finished, {converted} face encodings converted")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate(batch_size=args.batch_size)
@@ -0,0 +1,41 @@
+"""
+Rebuild the attendance_daily rollup from the attendance history.
+
+Backfill after upgrading, or repair a range after editing records directly
+in the database:
+
+    python -m migrations.rebuild_attendance_rollup
+    python -m migrations.rebuild_attendance_rollup --start-date 2024-09-01 --end-date 2024-12-20
+
+Rollup rows in the range are deleted and recomputed in one transaction.
+"""
+import argparse
+import logging
+
+from app import app, db
+from services.report_service import parse_date_range
+from services.rollup_service import rebuild_rollups
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate(start_date: str = None, end_date: str = None, students_per_batch: int = 200) -> int:
+    """Rebuild the rollup for the given range (all history by default)"""
+    start_day = parse_date_range(start_date)[0] if start_date else None
+    end_day = parse_date_range(end_date)[0] if end_date else None
+
+    written = rebuild_rollups(db.session, start_day, end_day, students_per_batch=students_per_batch)
+    db.session.commit()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--start-date", help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="Last day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--students-per-batch", type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate(args.start_date, args.end_date, args.students_per_batch)
@@ -1,5 +1,5 @@
 from app import db
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, func
+from sqlalchemy import event, Column, Integer, BigInteger, String, Date, DateTime, ForeignKey, LargeBinary, Text, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -10,16 +10,88 @@ class Student(db.Model):
     student_id = Column(String(20), unique=True, index=True, nullable=False)
     name = Column(String(100), nullable=False)
     email = Column(String(100), unique=True, index=True, nullable=False)
-    face_encoding = Column(Text, nullable=True)  # Store as a serialized string
+    face_encoding = Column(LargeBinary, nullable=True)  # Packed by services.encoding_codec
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Update relationship to include cascade delete
     attendances = relationship("Attendance", back_populates="student", cascade="all, delete-orphan")
+    daily_attendance = relationship("AttendanceDaily", back_populates="student", cascade="all, delete-orphan")
+    face_templates = relationship("FaceTemplate", back_populates="student", cascade="all, delete-orphan")
+    enrolments = relationship("Enrolment", back_populates="student", cascade="all, delete-orphan")
     
     def __repr__(self):
         return f"<Student {self.name}>"
 
+class FaceTemplate(db.Model):
+    """Additional face encoding of a student, e.g. under different lighting"""
+    __tablename__ = "face_templates"
+    
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
+    encoding = Column(LargeBinary, nullable=False)  # Packed by services.encoding_codec
+    label = Column(String(50), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    student = relationship("Student", back_populates="face_templates")
+    
+    def __repr__(self):
+        return f"<FaceTemplate {self.id} student={self.student_id}>"
+
+class Course(db.Model):
+    __tablename__ = "courses"
+    
+    id = Column(Integer, primary_key=True)
+    code = Column(String(20), unique=True, index=True, nullable=False)
+    name = Column(String(100), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    sessions = relationship("ClassSession", back_populates="course", cascade="all, delete-orphan")
+    enrolments = relationship("Enrolment", back_populates="course", cascade="all, delete-orphan")
+    
+    def __repr__(self):
+        return f"<Course {self.code}>"
+
+class ClassSession(db.Model):
+    """One meeting of a course in a room; kiosks in that room match its roster first"""
+    __tablename__ = "class_sessions"
+    
+    id = Column(Integer, primary_key=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False, index=True)
+    room = Column(String(50), nullable=False)
+    starts_at = Column(DateTime(timezone=True), nullable=False)  # Naive UTC, like check-in times
+    ends_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    course = relationship("Course", back_populates="sessions")
+    
+    # Serves the per-day schedule load of services.roster_cache
+    __table_args__ = (
+        Index("ix_class_sessions_starts_at_room", "starts_at", "room"),
+    )
+    
+    def __repr__(self):
+        return f"<ClassSession {self.course_id} {self.room} {self.starts_at}>"
+
+class Enrolment(db.Model):
+    __tablename__ = "enrolments"
+    
+    id = Column(Integer, primary_key=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    course = relationship("Course", back_populates="enrolments")
+    student = relationship("Student", back_populates="enrolments")
+    
+    __table_args__ = (
+        UniqueConstraint("course_id", "student_id", name="uq_enrolments_course_student"),
+    )
+    
+    def __repr__(self):
+        return f"<Enrolment {self.course_id} student={self.student_id}>"
+
 class Attendance(db.Model):
     __tablename__ = "attendances"
     
@@ -33,5 +105,98 @@ class Attendance(db.Model):
     
     student = relationship("Student", back_populates="attendances")
     
+    # Serves per-student lookups and check-in range scans (reports, open records)
+    __table_args__ = (
+        Index("ix_attendances_student_check_in", "student_id", "check_in"),
+    )
+    
+    def __repr__(self):
+        return f"<Attendance {self.student_id} - {self.check_in}>"
+
+class AttendanceDaily(db.Model):
+    """One row per student per local day, maintained by services.rollup_service"""
+    __tablename__ = "attendance_daily"
+    
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    day = Column(Date, nullable=False, index=True)  # Local day in ATTENDANCE_TIMEZONE
+    first_check_in = Column(DateTime(timezone=True), nullable=True)
+    last_check_out = Column(DateTime(timezone=True), nullable=True)
+    minutes_present = Column(Integer, nullable=False, default=0)  # Sum over closed check-in/check-out pairs
+    status = Column(String(20), nullable=False, default="present")  # Status of the first check-in
+    
+    student = relationship("Student", back_populates="daily_attendance")
+    
+    __table_args__ = (
+        UniqueConstraint("student_id", "day", name="uq_attendance_daily_student_day"),
+    )
+    
+    def __repr__(self):
+        return f"<AttendanceDaily {self.student_id} - {self.day}>"
+
+class GalleryState(db.Model):
+    __tablename__ = "gallery_state"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)  # Bumped by every enrolment mutation
+    
+    def __repr__(self):
+        return f"<GalleryState v{self.version}>"
+
+class RosterState(db.Model):
+    __tablename__ = "roster_state"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)  # Bumped by every course, session or enrolment change
+    
+    def __repr__(self):
+        return f"<RosterState v{self.version}>"
+
+def _seed_version_row(table, connection, **kw):
+    # The single row that bump_gallery_version/bump_roster_version update; it
+    # exists from the start, so concurrent first bumps never race to insert it
+    connection.execute(table.insert().values(id=1, version=0))
+
+event.listen(GalleryState.__table__, "after_create", _seed_version_row)
+event.listen(RosterState.__table__, "after_create", _seed_version_row)
+
+class GalleryChange(db.Model):
+    __tablename__ = "gallery_changes"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, index=True)
+    student_id = Column(Integer, nullable=False)  # No foreign key, deleted students are recorded too
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<GalleryChange v{self.version} student={self.student_id}>"
+
+class ImportJob(db.Model):
+    """Bulk enrolment job, run in the background by services.bulk_import"""
+    __tablename__ = "import_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    total_rows = Column(Integer, nullable=False, default=0)
+    processed_rows = Column(Integer, nullable=False, default=0)
+    created_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=True)  # JSON list of per-row failures
+    message = Column(String(255), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    def __repr__(self):
+        return f"<ImportJob {self.id} {self.status}>"
+
+class EventLogCheckpoint(db.Model):
+    """Last attendance event of a write-behind log segment applied to the database"""
+    __tablename__ = "event_log_checkpoints"
+    
+    segment = Column(String(255), primary_key=True)  # Log file name
+    applied_seq = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
     def __repr__(self):
-        return f"<Attendance {self.student_id} - {self.check_in}>"
\ No newline at end of file
+        return f"<EventLogCheckpoint {self.segment} @{self.applied_seq}>"
@@ -1,87 +1,80 @@
 import logging
 from fastapi import APIRouter, Depends, HTTPException, Request, Body
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
-import json
-import base64
-from datetime import datetime
-import pytz
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from typing import List, Optional, Union
 
-from database import get_db
+from database import call_with_session, get_async_db
 import models
 import schemas
-from services.face_recognition_service import compare_faces, encode_face
+from routes.uploads import image_upload
+from services.face_recognition_service import RECOGNITION_DECODE_SCALE, encode_face, encode_faces
+from services.frame_quality import FrameRejected
+from services.image_payload import ImagePayload
+from services.gallery_cache import gallery_cache
+from services.roster_cache import roster_cache
+from services.attendance_service import attendance_message
+from services.attendance_sessions import attendance_sessions
+from services.inference_pool import InferenceOverloaded
+from services.metrics import observe_match_distance, stage
+from services.micro_batcher import recognition_batcher
+from services.report_service import daily_report, day_bounds, parse_date_range
+from services.pagination import keyset_page_async, parse_limit, sort_columns, stream_json_array_async
+from services.rollup_service import attendance_summary, local_day, refresh_rollup
+from services.write_behind import record_attendance_async
 
 router = APIRouter(prefix="/api/attendance", tags=["attendance"])
 logger = logging.getLogger(__name__)
 
 @router.post("/mark", response_model=schemas.FaceRecognitionResponse)
 async def mark_attendance(
-    face_data: schemas.FaceData,
-    db: Session = Depends(get_db)
+    upload: ImagePayload = Depends(image_upload),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Mark attendance using face recognition"""
+    """Mark attendance using face recognition; takes a JPEG body, a multipart upload or a data URI"""
+    image_data = upload.image_data
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(face_data.image_data.split(',')[1])
+        # The roster of the class session under way at the kiosk's room, if any,
+        # backed by the global gallery
+        with stage("gallery"):
+            gallery = await _gallery(upload.fields.get("room"))
+        
+        if recognition_batcher is not None and not upload.face_locations:
+            # Encode and match together with concurrent requests
+            with stage("recognize"):
+                face_encoding, match = await run_in_threadpool(recognition_batcher.recognize, image_data, gallery)
+        else:
+            # Generate face encoding for the captured image, or for the faces of a frame handle
+            face_encoding = await run_in_threadpool(
+                encode_face, image_data, decode_scale=RECOGNITION_DECODE_SCALE, face_locations=upload.face_locations
+            )
+            # Match against the roster, then all stored face encodings on a miss
+            with stage("match"):
+                match = await run_in_threadpool(gallery.match, face_encoding) if face_encoding is not None else None
         
-        # Generate face encoding for the captured image
-        face_encoding = encode_face(image_data)
         if face_encoding is None:
             return {
                 "success": False,
                 "message": "No face detected in the image"
             }
         
-        # Get all students from the database
-        students = db.query(models.Student).all()
-        
-        # Find matching student
-        for student in students:
-            if not student.face_encoding:
-                continue
-            
-            # Parse stored face encoding from JSON string to list
-            stored_encoding = json.loads(student.face_encoding)
-            
-            # Compare faces
-            if compare_faces(face_encoding, stored_encoding):
-                # Check if there's an open attendance record (with check_in but no check_out)
-                today = datetime.now().date()
-                open_attendance = db.query(models.Attendance).filter(
-                    models.Attendance.student_id == student.id,
-                    models.Attendance.check_in >= today,
-                    models.Attendance.check_out.is_(None)
-                ).first()
-                
-                current_time = datetime.now(pytz.UTC)
-                
-                if open_attendance:
-                    # Check out
-                    open_attendance.check_out = current_time
-                    db.commit()
-                    return {
-                        "success": True,
-                        "student_id": student.id,
-                        "name": student.name,
-                        "message": f"Attendance check-out marked for {student.name}"
-                    }
-                else:
-                    # Check in
-                    new_attendance = models.Attendance(
-                        student_id=student.id,
-                        check_in=current_time,
-                        status="present"
-                    )
-                    db.add(new_attendance)
-                    db.commit()
-                    return {
-                        "success": True,
-                        "student_id": student.id,
-                        "name": student.name,
-                        "message": f"Attendance check-in marked for {student.name}"
-                    }
+        observe_match_distance(match.distance)
+        student = await db.get(models.Student, match.student_id) if match.student_id is not None else None
+        if match.student_id is not None and student is None:
+            # Deleted since this worker's gallery snapshot was taken
+            gallery_cache.invalidate()
+        if student is not None:
+            # Check in, or check out if there is an open record for today
+            action = (await record_attendance_async(db, [student.id]))[student.id]
+            return {
+                "success": True,
+                "student_id": student.id,
+                "name": student.name,
+                "message": attendance_message(action, student.name)
+            }
         
         # No matching student found
         return {
@@ -89,6 +82,10 @@ async def mark_attendance(
             "message": "Face not recognized. Please register first."
         }
     
+    except InferenceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except FrameRejected as e:
+        return JSONResponse(status_code=422, content=e.as_json())
     except Exception as e:
         logger.error(f"Error marking attendance: {str(e)}")
         return {
@@ -96,32 +93,138 @@ async def mark_attendance(
             "message": f"Error processing attendance: {str(e)}"
         }
 
-@router.get("/", response_model=List[schemas.AttendanceResponse])
+@router.post("/mark-group", response_model=schemas.GroupRecognitionResponse)
+async def mark_group_attendance(
+    upload: ImagePayload = Depends(image_upload),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Mark attendance for every recognised face in one frame"""
+    image_data = upload.image_data
+    try:
+        # Encode every face in the frame
+        faces = await run_in_threadpool(encode_faces, image_data, face_locations=upload.face_locations)
+        if not faces:
+            return {
+                "success": False,
+                "faces": [],
+                "message": "No face detected in the image"
+            }
+        
+        # Match all faces against the room's roster, then the gallery, in one pass each
+        with stage("gallery"):
+            gallery = await _gallery(upload.fields.get("room"))
+        with stage("match"):
+            matches = await run_in_threadpool(gallery.match_many, [encoding for _, encoding in faces])
+        for match in matches:
+            observe_match_distance(match.distance)
+        matched_ids = [match.student_id for match in matches if match.student_id is not None]
+        names = dict((await db.execute(
+            select(models.Student.id, models.Student.name).filter(models.Student.id.in_(matched_ids))
+        )).all()) if matched_ids else {}
+        if len(names) < len(set(matched_ids)):
+            # Some were deleted since this worker's gallery snapshot was taken
+            gallery_cache.invalidate()
+        
+        # Mark everyone recognised in a single transaction
+        actions = await record_attendance_async(db, names.keys())
+        
+        results = []
+        for (location, _), match in zip(faces, matches):
+            student_id = match.student_id if match.student_id in names else None
+            results.append({
+                "box": list(location),
+                "recognized": student_id is not None,
+                "student_id": student_id,
+                "name": names.get(student_id),
+                "distance": match.distance,
+                "action": actions.get(student_id),
+                "message": attendance_message(actions[student_id], names[student_id])
+                if student_id is not None else "Face not recognized"
+            })
+        
+        return {
+            "success": bool(actions),
+            "faces": results,
+            "message": f"Marked attendance for {len(actions)} of {len(faces)} faces"
+        }
+    
+    except InferenceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except FrameRejected as e:
+        return JSONResponse(status_code=422, content=e.as_json())
+    except Exception as e:
+        logger.error(f"Error marking group attendance: {str(e)}")
+        await db.rollback()
+        return {
+            "success": False,
+            "faces": [],
+            "message": f"Error processing attendance: {str(e)}"
+        }
+
+@router.get("/", response_model=Union[List[schemas.AttendanceResponse], schemas.AttendancePage])
 async def get_all_attendance(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     date: Optional[str] = None,
-    student_id: Optional[int] = None
+    student_id: Optional[int] = None,
+    status: Optional[str] = None,
+    tz: Optional[str] = None,
+    order: str = "id",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False
 ):
-    """Get all attendance records with optional date and student filter"""
-    query = db.query(models.Attendance)
+    """
+    Get attendance records with optional date, student and status filter,
+    optionally a page at a time or as a streamed array
+    """
+    query = select(models.Attendance).options(joinedload(models.Attendance.student))
     
     if date:
         try:
-            filter_date = datetime.strptime(date, "%Y-%m-%d").date()
-            query = query.filter(db.func.date(models.Attendance.check_in) == filter_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+            filter_date, _ = parse_date_range(date)
+            # Range predicate on the raw column so the check_in index is usable
+            day_start, day_end = day_bounds(filter_date, tz_name=tz)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.filter(models.Attendance.check_in >= day_start, models.Attendance.check_in < day_end)
     
     if student_id:
         query = query.filter(models.Attendance.student_id == student_id)
     
-    attendances = query.all()
-    return attendances
+    if status:
+        query = query.filter(models.Attendance.status == status)
+    
+    try:
+        columns, descending = sort_columns(order, {
+            "id": [models.Attendance.id],
+            "check_in": [models.Attendance.check_in, models.Attendance.id],
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if order.lstrip("-") == "check_in":
+        # Keyset order needs a non-null sort key
+        query = query.filter(models.Attendance.check_in.isnot(None))
+    
+    if stream:
+        query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+        return StreamingResponse(stream_json_array_async(query, _attendance_json), media_type="application/json")
+    
+    if limit is not None or cursor is not None:
+        try:
+            attendances, next_cursor = await keyset_page_async(db, query, order, columns, cursor, parse_limit(limit), descending)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"items": attendances, "next_cursor": next_cursor}
+    
+    return (await db.scalars(query)).all()
+
+def _attendance_json(attendance):
+    return schemas.AttendanceResponse.model_validate(attendance, from_attributes=True).model_dump(mode="json")
 
 @router.get("/{attendance_id}", response_model=schemas.AttendanceResponse)
-async def get_attendance(attendance_id: int, db: Session = Depends(get_db)):
+async def get_attendance(attendance_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get an attendance record by ID"""
-    attendance = db.query(models.Attendance).filter(models.Attendance.id == attendance_id).first()
+    attendance = await _get_attendance(db, attendance_id)
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
     return attendance
@@ -130,10 +233,10 @@ async def get_attendance(attendance_id: int, db: Session = Depends(get_db)):
 async def update_attendance(
     attendance_id: int,
     attendance_update: schemas.AttendanceUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update an attendance record"""
-    attendance = db.query(models.Attendance).filter(models.Attendance.id == attendance_id).first()
+    attendance = await _get_attendance(db, attendance_id)
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
     
@@ -142,47 +245,74 @@ async def update_attendance(
     if attendance_update.check_out is not None:
         attendance.check_out = attendance_update.check_out
     
-    db.commit()
-    db.refresh(attendance)
-    return attendance
+    # Edits cannot be folded in incrementally; recompute that day's rollup
+    if attendance.check_in is not None:
+        await db.run_sync(refresh_rollup, attendance.student_id, local_day(attendance.check_in))
+    await db.commit()
+    attendance_sessions.forget([attendance.student_id])
+    # Reload with the student for the response model
+    return await _get_attendance(db, attendance_id, populate_existing=True)
 
 @router.delete("/{attendance_id}")
-async def delete_attendance(attendance_id: int, db: Session = Depends(get_db)):
+async def delete_attendance(attendance_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete an attendance record"""
-    attendance = db.query(models.Attendance).filter(models.Attendance.id == attendance_id).first()
+    attendance = await db.get(models.Attendance, attendance_id)
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
     
-    db.delete(attendance)
-    db.commit()
+    await db.delete(attendance)
+    if attendance.check_in is not None:
+        await db.run_sync(refresh_rollup, attendance.student_id, local_day(attendance.check_in))
+    await db.commit()
+    attendance_sessions.forget([attendance.student_id])
     return {"message": "Attendance record deleted successfully"}
 
 @router.get("/report/daily", response_model=List[dict])
-async def get_daily_report(date: str, db: Session = Depends(get_db)):
-    """Get daily attendance report for a specific date"""
+async def get_daily_report(
+    date: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    tz: Optional[str] = None,
+    student_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get the attendance report for a day, or for each day in a range"""
     try:
-        filter_date = datetime.strptime(date, "%Y-%m-%d").date()
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    
-    # Get all students
-    students = db.query(models.Student).all()
-    
-    report = []
-    for student in students:
-        # Find attendance for this student on the specified date
-        attendance = db.query(models.Attendance).filter(
-            models.Attendance.student_id == student.id,
-            db.func.date(models.Attendance.check_in) == filter_date
-        ).first()
-        
-        report.append({
-            "student_id": student.id,
-            "name": student.name,
-            "email": student.email,
-            "status": attendance.status if attendance else "absent",
-            "check_in": attendance.check_in if attendance else None,
-            "check_out": attendance.check_out if attendance else None
-        })
-    
-    return report
+        start_day, end_day = parse_date_range(date, start_date, end_date)
+        return await db.run_sync(daily_report, start_day, end_day, tz, student_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/report/summary", response_model=dict)
+async def get_attendance_summary(
+    start_date: str,
+    end_date: Optional[str] = None,
+    student_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Per-student attendance totals and percentages over a date range"""
+    try:
+        start_day, end_day = parse_date_range(start_str=start_date, end_str=end_date)
+        return await db.run_sync(attendance_summary, start_day, end_day, student_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _gallery(room: Optional[str] = None):
+    """
+    The cached gallery, scoped to the roster of the session active in
+    ``room`` if any, loaded in a thread with a session of its own: the
+    caches hold a lock across a reload, which must not block the event loop
+    """
+    return await run_in_threadpool(call_with_session, _scoped_gallery, room)
+
+def _scoped_gallery(session, room: Optional[str]):
+    return roster_cache.get(session, gallery_cache.get(session), room)
+
+async def _get_attendance(db: AsyncSession, attendance_id: int, populate_existing: bool = False):
+    """An attendance record with its student loaded, None if it does not exist"""
+    statement = select(models.Attendance).options(joinedload(models.Attendance.student)).filter(
+        models.Attendance.id == attendance_id
+    )
+    if populate_existing:
+        statement = statement.execution_options(populate_existing=True)
+    return (await db.scalars(statement)).first()
@@ -0,0 +1,105 @@
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Body
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+
+from database import get_async_db
+import models
+import schemas
+from services.course_service import (
+    add_class_session, create_course, enrol_students, enrolled_student_ids, get_class_session, remove_class_session,
+    unenrol_student,
+)
+
+router = APIRouter(prefix="/api/courses", tags=["courses"])
+logger = logging.getLogger(__name__)
+
+@router.get("/", response_model=List[schemas.CourseResponse])
+async def get_all_courses(db: AsyncSession = Depends(get_async_db)):
+    """List courses by code"""
+    return (await db.scalars(select(models.Course).order_by(models.Course.code))).all()
+
+@router.post("/", response_model=schemas.CourseResponse, status_code=201)
+async def create_course_endpoint(course: schemas.CourseCreate = Body(...), db: AsyncSession = Depends(get_async_db)):
+    """Create a course"""
+    try:
+        db_course = await db.run_sync(create_course, course.code, course.name)
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    await db.refresh(db_course)
+    return db_course
+
+@router.get("/{course_id}/sessions", response_model=List[schemas.ClassSessionResponse])
+async def list_class_sessions(course_id: int, db: AsyncSession = Depends(get_async_db)):
+    """List a course's sessions by start time"""
+    await _get_course(db, course_id)
+    return (await db.scalars(
+        select(models.ClassSession).filter(models.ClassSession.course_id == course_id).order_by(models.ClassSession.starts_at)
+    )).all()
+
+@router.post("/{course_id}/sessions", response_model=schemas.ClassSessionResponse, status_code=201)
+async def add_class_session_endpoint(
+    course_id: int,
+    class_session: schemas.ClassSessionCreate = Body(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Schedule a session of a course in a room; kiosks in that room match its roster first"""
+    course = await _get_course(db, course_id)
+    try:
+        db_session = await db.run_sync(
+            add_class_session, course, class_session.room, class_session.starts_at, class_session.ends_at
+        )
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    return db_session
+
+@router.delete("/{course_id}/sessions/{session_id}")
+async def delete_class_session(course_id: int, session_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Remove one session"""
+    class_session = await db.run_sync(get_class_session, course_id, session_id)
+    if not class_session:
+        raise HTTPException(status_code=404, detail="Class session not found")
+    await db.run_sync(remove_class_session, class_session)
+    await db.commit()
+    return {"message": "Class session removed successfully"}
+
+@router.get("/{course_id}/enrolments")
+async def list_enrolments(course_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Ids of the students enrolled in a course"""
+    await _get_course(db, course_id)
+    return {"course_id": course_id, "student_ids": await db.run_sync(enrolled_student_ids, course_id)}
+
+@router.post("/{course_id}/enrolments")
+async def enrol_students_endpoint(
+    course_id: int,
+    enrolment: schemas.EnrolmentCreate = Body(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Enrol students in a course; students already enrolled are left as they are"""
+    course = await _get_course(db, course_id)
+    try:
+        added = await db.run_sync(enrol_students, course, enrolment.student_ids)
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    return {"course_id": course_id, "enrolled": added}
+
+@router.delete("/{course_id}/enrolments/{student_id}")
+async def delete_enrolment(course_id: int, student_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Unenrol one student"""
+    if not await db.run_sync(unenrol_student, course_id, student_id):
+        raise HTTPException(status_code=404, detail="Enrolment not found")
+    await db.commit()
+    return {"message": "Student unenrolled successfully"}
+
+async def _get_course(db: AsyncSession, course_id: int) -> models.Course:
+    course = await db.get(models.Course, course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return course
@@ -1,16 +1,27 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Request, Body, Form, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Body, Form, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from typing import List, Optional
-import json
-import base64
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Union
 
-from database import get_db
+from database import SessionLocal, call_with_session, get_async_db
 import models
 import schemas
-from services.face_recognition_service import encode_face, compare_faces
+from routes.uploads import image_upload
+from services.face_recognition_service import encode_face, ENROLMENT_DETECTION_SCALE
+from services.encoding_codec import pack_encoding, unpack_encoding
+from services.duplicate_faces import DuplicateFace, check_enrolment
+from services.gallery_cache import bump_gallery_version
+from services.frame_quality import FrameRejected
+from services.image_payload import ImagePayload
+from services.inference_pool import InferenceOverloaded
+from services.metrics import stage
+from services.pagination import keyset_page_async, parse_limit, stream_json_array_async
+from services.template_service import add_template, get_template, remove_template, replace_template
+from services.bulk_import import create_import_job, job_status, parse_student_csv, save_archive, start_import
 
 router = APIRouter(prefix="/api/students", tags=["students"])
 templates = Jinja2Templates(directory="templates")
@@ -18,10 +29,14 @@ logger = logging.getLogger(__name__)
 
 @router.post("/", response_model=schemas.StudentResponse)
 async def create_student(
+    response: Response,
     student: schemas.StudentCreate = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new student with face encoding"""
+    if student.face_encoding is not None:
+        await _check_duplicates(response, unpack_encoding(student.face_encoding))
+    
     db_student = models.Student(
         student_id=student.student_id,
         name=student.name,
@@ -30,40 +45,66 @@ async def create_student(
     )
     
     db.add(db_student)
-    db.commit()
-    db.refresh(db_student)
+    if db_student.face_encoding is not None:
+        await db.flush()
+        await db.run_sync(bump_gallery_version, [db_student.id])
+    await db.commit()
+    await db.refresh(db_student)
     return db_student
 
 @router.post("/register-face")
 async def register_face(
-    face_data: schemas.FaceData,
-    student_id: int = Form(...),
-    db: Session = Depends(get_db)
+    upload: ImagePayload = Depends(image_upload),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Register a face for a student"""
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    """
+    Register a face for a student
+
+    Takes a JPEG body with ``?student_id=``, a multipart upload with
+    ``image`` and ``student_id`` fields, or JSON with ``image_data``
+    and ``student_id``
+    """
+    try:
+        student_id = int(upload.fields.get("student_id"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="student_id is required")
+    student = await db.get(models.Student, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(face_data.image_data.split(',')[1])
-        
         # Generate face encoding
-        face_encoding = encode_face(image_data)
+        face_encoding = await run_in_threadpool(
+            encode_face, upload.image_data, detection_scale=ENROLMENT_DETECTION_SCALE, face_locations=upload.face_locations
+        )
         if face_encoding is None:
             return JSONResponse(
                 status_code=400,
                 content={"success": False, "message": "No face detected in the image"}
             )
         
+        # Refuse or flag a face already enrolled under another student
+        with stage("duplicate_check"):
+            duplicates = await run_in_threadpool(call_with_session, check_enrolment, face_encoding, student.id)
+        
         # Store face encoding in the database
-        student.face_encoding = json.dumps(face_encoding.tolist())
-        db.commit()
+        student.face_encoding = pack_encoding(face_encoding)
+        await db.run_sync(bump_gallery_version, [student.id])
+        with stage("commit"):
+            await db.commit()
         
         return JSONResponse(
-            content={"success": True, "message": "Face registered successfully"}
+            content={"success": True, "message": "Face registered successfully", "duplicates": duplicates}
+        )
+    except DuplicateFace as e:
+        return JSONResponse(
+            status_code=409,
+            content={"success": False, "message": str(e), "duplicates": e.duplicates}
         )
+    except InferenceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except FrameRejected as e:
+        return JSONResponse(status_code=422, content=e.as_json())
     except Exception as e:
         logger.error(f"Error registering face: {str(e)}")
         return JSONResponse(
@@ -71,16 +112,72 @@ async def register_face(
             content={"success": False, "message": f"Error registering face: {str(e)}"}
         )
 
-@router.get("/", response_model=List[schemas.StudentResponse])
-async def get_all_students(db: Session = Depends(get_db)):
-    """Get all students"""
-    students = db.query(models.Student).all()
-    return students
+@router.get("/", response_model=Union[List[schemas.StudentResponse], schemas.StudentPage])
+async def get_all_students(
+    db: AsyncSession = Depends(get_async_db),
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False
+):
+    """Get all students, optionally a page at a time or as a streamed array"""
+    statement = select(models.Student)
+    columns = [models.Student.id]
+    
+    if stream:
+        return StreamingResponse(
+            stream_json_array_async(statement.order_by(models.Student.id), _student_json),
+            media_type="application/json"
+        )
+    
+    if limit is not None or cursor is not None:
+        try:
+            students, next_cursor = await keyset_page_async(db, statement, "id", columns, cursor, parse_limit(limit))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"items": students, "next_cursor": next_cursor}
+    
+    return (await db.scalars(statement)).all()
+
+def _student_json(student):
+    return schemas.StudentResponse.model_validate(student, from_attributes=True).model_dump(mode="json")
+
+@router.post("/import", status_code=202)
+async def import_students(
+    students: UploadFile = File(...),
+    photos: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Start a bulk enrolment job from a student CSV and a zip of photos"""
+    try:
+        rows = parse_student_csv(await students.read())
+        archive_path = await run_in_threadpool(save_archive, photos.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job = await db.run_sync(create_import_job, rows)
+    await db.commit()
+    
+    # Encoding and inserts run in the background; poll the status URL
+    start_import(job.id, rows, archive_path, SessionLocal)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "status_url": f"/api/students/import/{job.id}"
+    }
+
+@router.get("/import/{job_id}")
+async def import_status(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Progress and per-row failures of a bulk enrolment job"""
+    job = await db.get(models.ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job_status(job)
 
 @router.get("/{student_id}", response_model=schemas.StudentResponse)
-async def get_student(student_id: int, db: Session = Depends(get_db)):
+async def get_student(student_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a student by ID"""
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    student = await db.get(models.Student, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     return student
@@ -89,10 +186,11 @@ async def get_student(student_id: int, db: Session = Depends(get_db)):
 async def update_student(
     student_id: int,
     student_update: schemas.StudentUpdate,
-    db: Session = Depends(get_db)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update a student"""
-    db_student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    db_student = await db.get(models.Student, student_id)
     if not db_student:
         raise HTTPException(status_code=404, detail="Student not found")
     
@@ -104,19 +202,113 @@ async def update_student(
     if student_update.email is not None:
         db_student.email = student_update.email
     if student_update.face_encoding is not None:
+        await _check_duplicates(response, unpack_encoding(student_update.face_encoding), db_student.id)
         db_student.face_encoding = student_update.face_encoding
+        await db.run_sync(bump_gallery_version, [db_student.id])
     
-    db.commit()
-    db.refresh(db_student)
+    await db.commit()
+    await db.refresh(db_student)
     return db_student
 
 @router.delete("/{student_id}")
-async def delete_student(student_id: int, db: Session = Depends(get_db)):
+async def delete_student(student_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete a student"""
-    db_student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    db_student = await db.get(models.Student, student_id)
     if not db_student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    db.delete(db_student)
-    db.commit()
+    await db.delete(db_student)
+    await db.run_sync(bump_gallery_version, [student_id])
+    await db.commit()
     return {"message": "Student deleted successfully"}
+
+@router.get("/{student_id}/templates", response_model=List[schemas.FaceTemplateResponse])
+async def list_face_templates(student_id: int, db: AsyncSession = Depends(get_async_db)):
+    """List a student's additional face templates"""
+    if not await db.get(models.Student, student_id):
+        raise HTTPException(status_code=404, detail="Student not found")
+    return (await db.scalars(
+        select(models.FaceTemplate).filter(models.FaceTemplate.student_id == student_id).order_by(models.FaceTemplate.id)
+    )).all()
+
+@router.post("/{student_id}/templates", response_model=schemas.FaceTemplateResponse, status_code=201)
+async def add_face_template(
+    student_id: int,
+    response: Response,
+    upload: ImagePayload = Depends(image_upload),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Add one face template without touching the student's other templates"""
+    student = await db.get(models.Student, student_id)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    face_encoding = await _encode_template(upload)
+    await _check_duplicates(response, face_encoding, student.id)
+    try:
+        template = await db.run_sync(add_template, student, face_encoding, upload.fields.get("label"))
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    await db.refresh(template)
+    return template
+
+@router.put("/{student_id}/templates/{template_id}", response_model=schemas.FaceTemplateResponse)
+async def replace_face_template(
+    student_id: int,
+    template_id: int,
+    response: Response,
+    upload: ImagePayload = Depends(image_upload),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Replace the encoding of one face template"""
+    template = await db.run_sync(get_template, student_id, template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Face template not found")
+    
+    face_encoding = await _encode_template(upload)
+    await _check_duplicates(response, face_encoding, student_id)
+    await db.run_sync(replace_template, template, face_encoding, upload.fields.get("label"))
+    await db.commit()
+    await db.refresh(template)
+    return template
+
+@router.delete("/{student_id}/templates/{template_id}")
+async def delete_face_template(student_id: int, template_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Remove one face template"""
+    template = await db.run_sync(get_template, student_id, template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Face template not found")
+    
+    await db.run_sync(remove_template, template)
+    await db.commit()
+    return {"message": "Face template removed successfully"}
+
+async def _encode_template(upload: ImagePayload):
+    try:
+        face_encoding = await run_in_threadpool(
+            encode_face, upload.image_data, detection_scale=ENROLMENT_DETECTION_SCALE, face_locations=upload.face_locations
+        )
+    except InferenceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except FrameRejected as e:
+        raise HTTPException(status_code=422, detail=e.as_json())
+    if face_encoding is None:
+        raise HTTPException(status_code=400, detail="No face detected in the image")
+    return face_encoding
+
+async def _check_duplicates(response: Response, face_encoding, student_id: Optional[int] = None):
+    """
+    Apply the duplicate-face policy for endpoints that return a model:
+    409 on reject, otherwise the conflicting ids in X-Duplicate-Students
+    """
+    try:
+        with stage("duplicate_check"):
+            # The gallery cache locks across its reload, so it runs in a thread with its own session
+            duplicates = await run_in_threadpool(call_with_session, check_enrolment, face_encoding, student_id)
+    except DuplicateFace as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "duplicates": e.duplicates})
+    if duplicates:
+        response.headers["X-Duplicate-Students"] = ",".join(str(duplicate["student_id"]) for duplicate in duplicates)
+    return duplicates
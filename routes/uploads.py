@@ -0,0 +1,43 @@
+from fastapi import HTTPException, Request
+from starlette.datastructures import UploadFile
+
+from services.image_payload import (
+    FRAME_HANDLE_FIELD, IMAGE_FIELD, MAX_IMAGE_BYTES, ImagePayload, ImagePayloadError, decode_data_uri, is_multipart,
+    is_raw_image, resolve_payload,
+)
+from services.metrics import stage
+
+
+async def image_upload(request: Request) -> ImagePayload:
+    """
+    Dependency reading the image of a face request: a raw ``image/*`` body
+    (fields in the query string), a multipart upload with an ``image`` file,
+    or JSON with a base64 ``image_data`` data URI. A ``frame_handle`` from
+    /api/detect-faces or /ws/detect-faces, in any of these or the query
+    string, stands in for the image
+    """
+    content_type = request.headers.get("content-type")
+    content_length = request.headers.get("content-length")
+    try:
+        if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+            raise ImagePayloadError(f"Image larger than {MAX_IMAGE_BYTES} bytes", status_code=413)
+
+        if is_raw_image(content_type):
+            image_data, fields = await request.body(), request.query_params
+        elif is_multipart(content_type):
+            fields = await request.form()
+            upload = fields.get(IMAGE_FIELD)
+            image_data = await upload.read() if isinstance(upload, UploadFile) else None
+        else:
+            try:
+                fields = await request.json()
+            except ValueError:
+                fields = None
+            if not isinstance(fields, dict):
+                fields = {}
+            with stage("payload"):
+                image_data = decode_data_uri(fields["image_data"]) if fields.get("image_data") else None
+        frame_handle = fields.get(FRAME_HANDLE_FIELD) or request.query_params.get(FRAME_HANDLE_FIELD)
+        return resolve_payload(image_data, fields, frame_handle)
+    except ImagePayloadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
@@ -1,6 +1,45 @@
-from typing import List, Optional
+from typing import List, Optional, Union
 from datetime import datetime
-from pydantic import BaseModel, EmailStr
+import base64
+import binascii
+import numpy as np
+from pydantic import BaseModel, EmailStr, field_validator
+
+from services.encoding_codec import ENCODING_SIZE, is_packed, pack_encoding, unpack_encoding
+
+
+def _coerce_face_encoding(value):
+    """
+    Accept a face encoding as a list of floats, a base64 string of the
+    packed binary format, legacy JSON text or raw packed bytes, and
+    normalise it to packed bytes for storage. Anything but
+    ENCODING_SIZE values is rejected, as the gallery could not stack it.
+    """
+    if value is None:
+        return value
+    packed = None
+    if is_packed(value):
+        packed = value
+    elif isinstance(value, (list, tuple)):
+        pass
+    elif isinstance(value, str):
+        if value.lstrip().startswith("["):
+            value = unpack_encoding(value)
+        else:
+            try:
+                packed = base64.b64decode(value, validate=True)
+            except binascii.Error:
+                raise ValueError("face_encoding must be a list of floats or base64-encoded packed bytes")
+    else:
+        raise ValueError("Unsupported face_encoding value")
+
+    try:
+        encoding = np.asarray(unpack_encoding(packed) if packed is not None else value, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("face_encoding must be a list of floats or base64-encoded packed bytes")
+    if encoding.shape != (ENCODING_SIZE,):
+        raise ValueError(f"face_encoding must have {ENCODING_SIZE} values, got {encoding.size}")
+    return packed if packed is not None else pack_encoding(encoding)
 
 # Student schemas
 class StudentBase(BaseModel):
@@ -9,15 +48,22 @@ class StudentBase(BaseModel):
     email: EmailStr
 
 class StudentCreate(StudentBase):
-    face_encoding: Optional[str] = None
+    face_encoding: Optional[Union[bytes, List[float]]] = None
+
+    _normalise_face_encoding = field_validator("face_encoding", mode="before")(_coerce_face_encoding)
 
 class StudentUpdate(BaseModel):
     student_id: Optional[str] = None
     name: Optional[str] = None
     email: Optional[EmailStr] = None
-    face_encoding: Optional[str] = None
+    face_encoding: Optional[Union[bytes, List[float]]] = None
+
+    _normalise_face_encoding = field_validator("face_encoding", mode="before")(_coerce_face_encoding)
 
 class StudentResponse(StudentBase):
+    # Stored emails were validated on the way in; re-validating them
+    # (IDNA and all) on every row listed dominated the list endpoints
+    email: str
     id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -25,6 +71,51 @@ class StudentResponse(StudentBase):
     class Config:
         orm_mode = True
 
+class StudentPage(BaseModel):
+    items: List[StudentResponse]
+    next_cursor: Optional[str] = None  # None on the last page
+
+class FaceTemplateCreate(BaseModel):
+    image_data: str  # Base64 encoded image
+    label: Optional[str] = None  # e.g. "glasses", "low light"
+
+class FaceTemplateResponse(BaseModel):
+    id: int
+    student_id: int
+    label: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+# Course schemas
+class CourseCreate(BaseModel):
+    code: str
+    name: str
+
+class CourseResponse(CourseCreate):
+    id: int
+    created_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class ClassSessionCreate(BaseModel):
+    room: str
+    starts_at: datetime  # Without an offset, local to ATTENDANCE_TIMEZONE
+    ends_at: datetime
+
+class ClassSessionResponse(ClassSessionCreate):
+    id: int
+    course_id: int
+
+    class Config:
+        orm_mode = True
+
+class EnrolmentCreate(BaseModel):
+    student_ids: List[int]
+
 # Attendance schemas
 class AttendanceBase(BaseModel):
     student_id: int
@@ -49,6 +140,10 @@ class AttendanceResponse(AttendanceBase):
     class Config:
         orm_mode = True
 
+class AttendancePage(BaseModel):
+    items: List[AttendanceResponse]
+    next_cursor: Optional[str] = None  # None on the last page
+
 # Face recognition schemas
 class FaceData(BaseModel):
     image_data: str  # Base64 encoded image
@@ -58,3 +153,17 @@ class FaceRecognitionResponse(BaseModel):
     student_id: Optional[int] = None
     name: Optional[str] = None
     message: str
+
+class GroupFaceResult(BaseModel):
+    box: List[int]  # top, right, bottom, left
+    recognized: bool
+    student_id: Optional[int] = None
+    name: Optional[str] = None
+    distance: Optional[float] = None
+    action: Optional[str] = None  # check-in or check-out
+    message: str
+
+class GroupRecognitionResponse(BaseModel):
+    success: bool
+    faces: List[GroupFaceResult]
+    message: str
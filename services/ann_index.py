@@ -0,0 +1,220 @@
+import logging
+import threading
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _squared_distances(vectors: np.ndarray, sq_norms: np.ndarray, probe: np.ndarray) -> np.ndarray:
+    sq = sq_norms + probe.dot(probe) - 2.0 * vectors.dot(probe)
+    np.maximum(sq, 0.0, out=sq)
+    return sq
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid for every row of ``vectors``"""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    # |v|^2 is the same for every centroid so it does not affect the argmin
+    scores = centroid_norms[None, :] - 2.0 * vectors.dot(centroids.T)
+    return np.argmin(scores, axis=1)
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Plain Lloyd's k-means, returns the cluster centroids
+
+    Args:
+        vectors: Training vectors, one per row
+        n_clusters: Number of centroids
+        n_iter: Number of assignment/update rounds
+        seed: Seed for picking the initial centroids
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = _assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.column_stack([
+            np.bincount(labels, weights=vectors[:, j], minlength=n_clusters)
+            for j in range(vectors.shape[1])
+        ])
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters from random points so no partition is wasted
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index
+
+    The gallery is partitioned by k-means into ``n_lists`` cells. A search
+    ranks the cells by centroid distance and scans only the ``nprobe``
+    closest ones, so its cost is roughly ``n_lists + nprobe * N / n_lists``
+    distance computations instead of ``N``. Larger ``nprobe`` trades speed
+    for recall; ``nprobe == n_lists`` is an exact search.
+
+    Inserts and deletes replace the affected cell's arrays with new ones,
+    so searches running concurrently always see a consistent cell.
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = 8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float64)
+        self.nprobe = nprobe
+        self._centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        dim = self.centroids.shape[1]
+        empty = (np.empty(0, dtype=np.int64), np.empty((0, dim)), np.empty(0))
+        self._lists = [empty] * len(self.centroids)
+        self._list_of = {}  # id -> cell number
+        self._lock = threading.Lock()
+        self.trained_size = 0
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self._list_of)
+
+    @classmethod
+    def build(
+        cls,
+        ids: Sequence[int],
+        encodings: np.ndarray,
+        n_lists: Optional[int] = None,
+        nprobe: int = 8,
+        train_size: Optional[int] = None,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        Train centroids on (a sample of) the encodings and add them all
+
+        Args:
+            ids: Student ids, one per row of ``encodings``
+            encodings: Gallery encodings
+            n_lists: Number of partitions, defaults to sqrt(N)
+            nprobe: Default number of partitions scanned per search
+            train_size: Maximum number of vectors used to train k-means,
+                defaults to 64 per partition
+        """
+        encodings = np.asarray(encodings, dtype=np.float64)
+        if n_lists is None or n_lists <= 0:
+            n_lists = max(1, int(np.sqrt(len(encodings))))
+
+        train_size = train_size or 64 * n_lists
+
+        rng = np.random.default_rng(seed)
+        sample = encodings
+        if len(encodings) > train_size:
+            sample = encodings[rng.choice(len(encodings), train_size, replace=False)]
+
+        index = cls(kmeans(sample, n_lists, seed=seed), nprobe=nprobe)
+        index.add(ids, encodings)
+        index.trained_size = len(encodings)
+        logger.info(f"Built IVF index over {len(encodings)} encodings with {index.n_lists} lists")
+        return index
+
+    def copy(self) -> "IVFIndex":
+        """
+        An independent index with the same centroids and contents
+
+        The cell arrays are shared, which is safe because add and remove
+        replace them rather than write to them; only the cell list and the
+        id map are copied. Update the copy for a new gallery snapshot so
+        that readers of the old snapshot keep searching the old cells.
+        """
+        with self._lock:
+            index = IVFIndex.__new__(IVFIndex)
+            index.centroids = self.centroids
+            index.nprobe = self.nprobe
+            index._centroid_norms = self._centroid_norms
+            index._lists = list(self._lists)
+            index._list_of = dict(self._list_of)
+            index._lock = threading.Lock()
+            index.trained_size = self.trained_size
+            return index
+
+    def add(self, ids: Sequence[int], encodings: np.ndarray):
+        """Insert encodings, replacing any existing entry with the same id"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(len(ids), -1)
+
+        with self._lock:
+            self._remove_locked(ids)
+            labels = _assign(encodings, self.centroids)
+            for cell in np.unique(labels):
+                rows = labels == cell
+                cell_ids, vectors, sq_norms = self._lists[cell]
+                new_vectors = encodings[rows]
+                self._lists[cell] = (
+                    np.concatenate([cell_ids, ids[rows]]),
+                    np.vstack([vectors, new_vectors]),
+                    np.concatenate([sq_norms, np.einsum("ij,ij->i", new_vectors, new_vectors)]),
+                )
+                for student_id in ids[rows]:
+                    self._list_of[int(student_id)] = int(cell)
+
+    def remove(self, ids: Sequence[int]):
+        """Delete encodings by id; unknown ids are ignored"""
+        with self._lock:
+            self._remove_locked(np.asarray(ids, dtype=np.int64))
+
+    def _remove_locked(self, ids: np.ndarray):
+        cells = {}
+        for student_id in ids:
+            cell = self._list_of.pop(int(student_id), None)
+            if cell is not None:
+                cells.setdefault(cell, []).append(student_id)
+
+        for cell, removed in cells.items():
+            cell_ids, vectors, sq_norms = self._lists[cell]
+            keep = ~np.isin(cell_ids, removed)
+            self._lists[cell] = (cell_ids[keep], vectors[keep], sq_norms[keep])
+
+    def search(self, probe: np.ndarray, k: int = 5, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest neighbours of a probe
+
+        Returns:
+            Tuple of (ids, distances), closest first; fewer than ``k`` if the
+            probed partitions hold fewer entries
+        """
+        probe = np.asarray(probe, dtype=np.float64)
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+
+        centroid_sq = self._centroid_norms - 2.0 * self.centroids.dot(probe)
+        if nprobe < self.n_lists:
+            cells = np.argpartition(centroid_sq, nprobe - 1)[:nprobe]
+        else:
+            cells = np.arange(self.n_lists)
+
+        id_parts = []
+        distance_parts = []
+        for cell in cells:
+            cell_ids, vectors, sq_norms = self._lists[cell]
+            if len(cell_ids):
+                id_parts.append(cell_ids)
+                distance_parts.append(_squared_distances(vectors, sq_norms, probe))
+
+        if not id_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        ids = np.concatenate(id_parts)
+        sq = np.concatenate(distance_parts)
+        k = max(1, min(k, len(ids)))
+        if k < len(ids):
+            top = np.argpartition(sq, k - 1)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(sq[top])]
+        return ids[top], np.sqrt(sq[top])
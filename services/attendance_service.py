@@ -0,0 +1,143 @@
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pytz
+
+import models
+from services.attendance_sessions import AttendanceSessions, SessionChange, attendance_sessions
+from services.report_service import as_utc, day_bounds, today
+from services.rollup_service import update_rollups
+
+logger = logging.getLogger(__name__)
+
+CHECK_IN = "check-in"
+CHECK_OUT = "check-out"
+# Logged by the write-behind queue, applied to the database shortly after
+QUEUED = "queued"
+
+
+def attendance_message(action: str, name: str) -> str:
+    if action == QUEUED:
+        return f"Attendance recorded for {name}"
+    return f"Attendance {action} marked for {name}"
+
+
+def toggle_attendance(session, student_ids: Iterable[int], current_time: Optional[datetime] = None,
+                      sessions: Optional[AttendanceSessions] = None) -> Dict[int, str]:
+    """
+    Check students in, or out if they already have an open record today
+
+    A student marked within the cooldown window of their last check-in or
+    check-out is acknowledged with that action and nothing is written.
+    Cached open records are confirmed by primary key; the other students'
+    open records are fetched with one range query. The changes are added to
+    the caller's session together with the matching daily rollup updates;
+    the caller commits, so a whole group of students is marked in a single
+    transaction.
+
+    Args:
+        session: SQLAlchemy session
+        student_ids: Primary keys of the recognised students
+        current_time: Timestamp to record, defaults to now (UTC)
+        sessions: Open-session state, defaults to this process's
+
+    Returns:
+        Mapping of student id to CHECK_IN or CHECK_OUT
+    """
+    current_time = current_time or datetime.now(pytz.UTC)
+    return apply_marks(session, [(student_id, current_time) for student_id in dict.fromkeys(student_ids)], sessions)
+
+
+def apply_marks(session, marks: Sequence[Tuple[int, datetime]],
+                sessions: Optional[AttendanceSessions] = None) -> Dict[int, str]:
+    """
+    toggle_attendance() with a timestamp per student
+
+    Args:
+        session: SQLAlchemy session
+        marks: (student_id, timestamp) pairs, at most one per student
+        sessions: Open-session state, defaults to this process's
+
+    Returns:
+        Mapping of student id to CHECK_IN or CHECK_OUT
+    """
+    sessions = sessions or attendance_sessions
+    by_day: Dict[date, List[Tuple[int, datetime]]] = {}
+    for student_id, marked_at in marks:
+        by_day.setdefault(today(now=marked_at), []).append((student_id, marked_at))
+
+    actions = {}
+    for day, day_marks in sorted(by_day.items()):
+        actions.update(_apply_day(session, day, day_marks, sessions))
+    return actions
+
+
+def _apply_day(session, day: date, marks: List[Tuple[int, datetime]], sessions: AttendanceSessions) -> Dict[int, str]:
+    # Open records from the local day (ATTENDANCE_TIMEZONE) of the marks
+    sessions.roll_over(session, day)
+
+    actions = {}
+    pending = {}
+    for student_id, marked_at in marks:
+        recent = sessions.recent_action(student_id, marked_at)
+        if recent is not None:
+            actions[student_id] = recent
+        else:
+            pending[student_id] = marked_at
+    if not pending:
+        return actions
+
+    open_attendances = {}
+    cached = sessions.open_ids(pending)
+    if cached:
+        for attendance in session.query(models.Attendance).filter(models.Attendance.id.in_(cached.values())):
+            if attendance.check_out is None and cached.get(attendance.student_id) == attendance.id:
+                open_attendances[attendance.student_id] = attendance
+
+    unconfirmed = [student_id for student_id in pending if student_id not in open_attendances]
+    if unconfirmed:
+        day_start, day_end = day_bounds(day)
+        for attendance in session.query(models.Attendance).filter(
+            models.Attendance.student_id.in_(unconfirmed),
+            models.Attendance.check_in >= day_start,
+            models.Attendance.check_in < day_end,
+            models.Attendance.check_out.is_(None),
+        ).order_by(models.Attendance.id):
+            open_attendances[attendance.student_id] = attendance
+
+    check_ins = []
+    check_outs = []
+    changes = []
+    for student_id, marked_at in pending.items():
+        open_attendance = open_attendances.get(student_id)
+        if open_attendance and as_utc(marked_at) - as_utc(open_attendance.check_in) < sessions.cooldown:
+            # Checked in moments ago, possibly by another worker; or a mark
+            # replayed late that predates the check-in and cannot close it
+            changes.append(SessionChange(student_id, CHECK_IN, open_attendance.id, as_utc(open_attendance.check_in), day))
+            actions[student_id] = CHECK_IN
+        elif open_attendance:
+            open_attendance.check_out = marked_at
+            check_outs.append(open_attendance)
+            changes.append(SessionChange(student_id, CHECK_OUT, None, marked_at, day))
+            actions[student_id] = CHECK_OUT
+        else:
+            attendance = models.Attendance(
+                student_id=student_id,
+                check_in=marked_at,
+                status="present"
+            )
+            session.add(attendance)
+            check_ins.append(attendance)
+            actions[student_id] = CHECK_IN
+
+    update_rollups(session, check_ins, check_outs)
+    if check_ins:
+        # Assign ids now so the open-session map can record them at commit
+        session.flush()
+        changes.extend(
+            SessionChange(attendance.student_id, CHECK_IN, attendance.id, pending[attendance.student_id], day)
+            for attendance in check_ins
+        )
+    sessions.defer(session, changes)
+    return actions
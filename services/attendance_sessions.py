@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+from services.report_service import as_utc, day_bounds, today
+
+logger = logging.getLogger(__name__)
+
+# Repeated recognitions of a student within this many seconds of their last
+# check-in or check-out are acknowledged without touching the database; 0 disables
+COOLDOWN_SECONDS = float(os.environ.get("ATTENDANCE_COOLDOWN_SECONDS", "30"))
+
+# session.info key for changes waiting on the transaction to commit
+_PENDING_KEY = "attendance_sessions.pending"
+
+
+class SessionChange(NamedTuple):
+    student_id: int
+    action: str
+    # Attendance id still open after the change, None once checked out
+    open_attendance_id: Optional[int]
+    at: datetime
+    day: date
+
+
+class AttendanceSessions:
+    """
+    Process-local map of today's open attendance records
+
+    Holds student id -> open attendance id for the current local day,
+    loaded from the database at startup and again at day rollover, plus the
+    time and action of each student's last mark for the cooldown.
+
+    The map is a hint, not the truth: other workers mark attendance too, so
+    a cached open id is confirmed with a primary-key lookup before it is
+    checked out, and students without one are still looked up by the
+    indexed (student_id, check_in) range. Changes are applied only after
+    the transaction that made them commits.
+    """
+
+    def __init__(self, cooldown_seconds: float = COOLDOWN_SECONDS):
+        self.cooldown = timedelta(seconds=cooldown_seconds)
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._open: Dict[int, int] = {}
+        self._last: Dict[int, SessionChange] = {}
+
+    @property
+    def day(self) -> Optional[date]:
+        return self._day
+
+    def load(self, session, day: Optional[date] = None) -> int:
+        """Rebuild the map from the open records of ``day`` (default today)"""
+        day = day or today()
+        day_start, day_end = day_bounds(day)
+        rows = session.query(models.Attendance.student_id, models.Attendance.id).filter(
+            models.Attendance.check_in >= day_start,
+            models.Attendance.check_in < day_end,
+            models.Attendance.check_out.is_(None),
+        ).order_by(models.Attendance.id)
+
+        open_sessions = {student_id: attendance_id for student_id, attendance_id in rows}
+        with self._lock:
+            self._day = day
+            self._open = open_sessions
+            self._last = {}
+        logger.info(f"Loaded {len(open_sessions)} open attendance sessions for {day.isoformat()}")
+        return len(open_sessions)
+
+    def roll_over(self, session, day: date):
+        """Reload the map if ``day`` is not the day it was loaded for"""
+        if day != self._day:
+            self.load(session, day)
+
+    def recent_action(self, student_id: int, now: datetime) -> Optional[str]:
+        """The student's last action if it was within the cooldown window"""
+        last = self._last.get(student_id)
+        if last is None or not self.cooldown:
+            return None
+        if timedelta(0) <= as_utc(now) - as_utc(last.at) < self.cooldown:
+            return last.action
+        return None
+
+    def open_ids(self, student_ids: Iterable[int]) -> Dict[int, int]:
+        """Cached open attendance ids of the given students"""
+        with self._lock:
+            return {student_id: self._open[student_id] for student_id in student_ids if student_id in self._open}
+
+    def defer(self, session, changes: List[SessionChange]):
+        """Apply ``changes`` once the session's transaction commits"""
+        if changes:
+            session.info.setdefault(_PENDING_KEY, []).append((self, changes))
+
+    def apply(self, changes: Iterable[SessionChange]):
+        with self._lock:
+            for change in changes:
+                if change.day != self._day:
+                    continue
+                if change.open_attendance_id is None:
+                    self._open.pop(change.student_id, None)
+                else:
+                    self._open[change.student_id] = change.open_attendance_id
+                self._last[change.student_id] = change
+
+    def forget(self, student_ids: Iterable[int]):
+        """Drop cached state after a manual edit; the next mark goes to the database"""
+        with self._lock:
+            for student_id in student_ids:
+                self._open.pop(student_id, None)
+                self._last.pop(student_id, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed(session):
+    for sessions, changes in session.info.pop(_PENDING_KEY, ()):
+        sessions.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+attendance_sessions = AttendanceSessions()
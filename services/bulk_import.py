@@ -0,0 +1,372 @@
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy.exc import IntegrityError
+
+import models
+from services.duplicate_faces import DUPLICATE_POLICY, DUPLICATE_TOLERANCE
+from services.encoding_codec import pack_encoding
+from services.face_recognition_service import ENROLMENT_DETECTION_SCALE, _encode_face_batch, get_inference_pool
+from services.frame_quality import FrameRejected
+from services.gallery_cache import bump_gallery_version, gallery_cache
+from services.inference_pool import InferenceOverloaded, InferencePool
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for an import when no shared inference pool is running
+WORKERS = int(os.environ.get("BULK_IMPORT_WORKERS", str(os.cpu_count() or 1)))
+# Students inserted (and committed) per transaction
+BATCH_SIZE = int(os.environ.get("BULK_IMPORT_BATCH_SIZE", "200"))
+# Photos encoded per inference task
+ENCODE_CHUNK = int(os.environ.get("BULK_IMPORT_ENCODE_CHUNK", "8"))
+# Photos larger than this are rejected without being decompressed
+MAX_PHOTO_BYTES = int(os.environ.get("BULK_IMPORT_MAX_PHOTO_BYTES", str(10 * 1024 * 1024)))
+# A running job with no progress for this long was interrupted by a restart
+STALE_AFTER = timedelta(minutes=10)
+
+REQUIRED_COLUMNS = ("student_id", "name", "email")
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def parse_student_csv(data: bytes) -> List[Dict]:
+    """
+    Rows of a student CSV
+
+    Columns ``student_id``, ``name`` and ``email`` are required; an optional
+    ``photo`` column names the image in the archive, otherwise the photo is
+    looked up by student_id (e.g. ``S1001.jpg``).
+
+    Raises:
+        ValueError: Unreadable CSV or missing columns
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("CSV must be UTF-8 encoded")
+
+    reader = csv.DictReader(io.StringIO(text))
+    columns = {(name or "").strip().lower() for name in reader.fieldnames or []}
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+
+    rows = []
+    for line, record in enumerate(reader, start=2):
+        record = {(key or "").strip().lower(): (value or "").strip() for key, value in record.items()}
+        if not any(record.values()):
+            continue
+        rows.append({
+            "row": line,
+            "student_id": record.get("student_id", ""),
+            "name": record.get("name", ""),
+            "email": record.get("email", ""),
+            "photo": record.get("photo", ""),
+        })
+    if not rows:
+        raise ValueError("CSV has no student rows")
+    return rows
+
+
+def save_archive(stream) -> str:
+    """
+    Copy an uploaded photo archive to a temporary file for the job
+
+    Raises:
+        ValueError: The upload is not a zip file
+    """
+    fd, path = tempfile.mkstemp(prefix="student-import-", suffix=".zip")
+    with os.fdopen(fd, "wb") as target:
+        shutil.copyfileobj(stream, target, 1024 * 1024)
+    if not zipfile.is_zipfile(path):
+        os.remove(path)
+        raise ValueError("Photos must be uploaded as a zip archive")
+    return path
+
+
+def create_import_job(session, rows: List[Dict]) -> models.ImportJob:
+    """Persist a queued job for ``rows``; the caller commits"""
+    job = models.ImportJob(status="queued", total_rows=len(rows))
+    session.add(job)
+    session.flush()
+    return job
+
+
+def start_import(job_id: int, rows: List[Dict], archive_path: str, session_factory: Callable):
+    """
+    Run an import job on a background thread
+
+    Args:
+        job_id: ImportJob primary key
+        rows: Parsed CSV rows
+        archive_path: Zip of photos on disk; deleted when the job ends
+        session_factory: Returns a new SQLAlchemy session for the thread
+    """
+    thread = threading.Thread(
+        target=run_import, args=(job_id, rows, archive_path, session_factory),
+        name=f"import-job-{job_id}", daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def job_status(job: models.ImportJob) -> Dict:
+    """JSON-ready status of a job"""
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "processed_rows": job.processed_rows,
+        "created": job.created_count,
+        "failed": job.failed_count,
+        "progress": round(job.processed_rows / job.total_rows, 3) if job.total_rows else 1.0,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "message": job.message,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def fail_interrupted_jobs(session) -> int:
+    """Mark jobs left running by a previous process as failed; the caller commits"""
+    cutoff = datetime.now(pytz.UTC).replace(tzinfo=None) - STALE_AFTER
+    jobs = session.query(models.ImportJob).filter(
+        models.ImportJob.status.in_(("queued", "running")),
+        models.ImportJob.created_at < cutoff,
+    ).all()
+    for job in jobs:
+        last_progress = job.updated_at or job.created_at
+        if last_progress is not None and last_progress.replace(tzinfo=None) < cutoff:
+            job.status = "failed"
+            job.message = "Interrupted by a server restart"
+    return len(jobs)
+
+
+def _index_archive(archive: zipfile.ZipFile) -> Dict[str, zipfile.ZipInfo]:
+    """Photos in the archive by lower-case file name and by name without extension"""
+    index = {}
+    for info in archive.infolist():
+        name = os.path.basename(info.filename).lower()
+        if info.is_dir() or not name.endswith(PHOTO_EXTENSIONS) or name.startswith("."):
+            continue
+        index.setdefault(name, info)
+        index.setdefault(os.path.splitext(name)[0], info)
+    return index
+
+
+def _validate(session, rows: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """Split rows into (valid, failures): missing fields and duplicates in the CSV or database"""
+    valid, failures = [], []
+    seen_ids, seen_emails = set(), set()
+    for row in rows:
+        missing = [column for column in REQUIRED_COLUMNS if not row[column]]
+        if missing:
+            failures.append(_failure(row, f"Missing {', '.join(missing)}"))
+        elif "@" not in row["email"]:
+            failures.append(_failure(row, "Invalid email"))
+        elif row["student_id"] in seen_ids:
+            failures.append(_failure(row, "Duplicate student_id in CSV"))
+        elif row["email"].lower() in seen_emails:
+            failures.append(_failure(row, "Duplicate email in CSV"))
+        else:
+            seen_ids.add(row["student_id"])
+            seen_emails.add(row["email"].lower())
+            valid.append(row)
+
+    existing_ids, existing_emails = set(), set()
+    for i in range(0, len(valid), 500):
+        chunk = valid[i:i + 500]
+        for student_id, email in session.query(models.Student.student_id, models.Student.email).filter(
+            models.Student.student_id.in_([row["student_id"] for row in chunk])
+            | models.Student.email.in_([row["email"] for row in chunk])
+        ):
+            existing_ids.add(student_id)
+            existing_emails.add(email.lower())
+
+    accepted = []
+    for row in valid:
+        if row["student_id"] in existing_ids:
+            failures.append(_failure(row, "student_id already exists"))
+        elif row["email"].lower() in existing_emails:
+            failures.append(_failure(row, "Duplicate email"))
+        else:
+            accepted.append(row)
+    return accepted, failures
+
+
+def _failure(row: Dict, error: str) -> Dict:
+    return {"row": row["row"], "student_id": row["student_id"], "email": row["email"], "error": error}
+
+
+def _encode_parallel(pool: InferencePool, images: List[bytes]) -> List:
+    """
+    Encode photos in chunks spread over the pool's workers
+
+    At most one chunk per worker is in flight, leaving the pool's queue for
+    live recognition requests; if the pool is saturated the import waits
+    instead of failing.
+    """
+    results = [None] * len(images)
+    pending = deque((start, images[start:start + ENCODE_CHUNK]) for start in range(0, len(images), ENCODE_CHUNK))
+    in_flight = deque()
+
+    while pending or in_flight:
+        while pending and len(in_flight) < pool.workers:
+            start, chunk = pending[0]
+            try:
+                future = pool.submit(_encode_face_batch, chunk, ENROLMENT_DETECTION_SCALE)
+            except InferenceOverloaded as e:
+                if not in_flight:
+                    time.sleep(e.retry_after)
+                    continue
+                break
+            pending.popleft()
+            in_flight.append((start, future))
+
+        if in_flight:
+            start, future = in_flight.popleft()
+            for offset, encoding in enumerate(future.result()):
+                results[start + offset] = encoding
+    return results
+
+
+def _insert(session, rows: List[Dict], encodings: List, failures: List[Dict]) -> int:
+    """
+    Insert a batch of students with one executemany; falls back to row by
+    row if the batch hits a constraint, to find the offending rows
+    """
+    records = [{
+        "student_id": row["student_id"],
+        "name": row["name"],
+        "email": row["email"],
+        "face_encoding": pack_encoding(encoding),
+    } for row, encoding in zip(rows, encodings)]
+    if not records:
+        return 0
+
+    table = models.Student.__table__
+    try:
+        session.execute(table.insert(), records)
+        created = records
+    except IntegrityError:
+        session.rollback()
+        created = []
+        for row, record in zip(rows, records):
+            try:
+                with session.begin_nested():
+                    session.execute(table.insert(), [record])
+                created.append(record)
+            except IntegrityError:
+                failures.append(_failure(row, "student_id or email already exists"))
+
+    if created:
+        student_ids = [
+            student_id for (student_id,) in session.query(models.Student.id).filter(
+                models.Student.student_id.in_([record["student_id"] for record in created])
+            )
+        ]
+        bump_gallery_version(session, student_ids)
+    return len(created)
+
+
+def run_import(job_id: int, rows: List[Dict], archive_path: str, session_factory: Callable):
+    """
+    Validate, encode and insert the rows of an import job
+
+    Progress is committed after every batch of BATCH_SIZE rows, so the
+    students of finished batches stay enrolled even if a later batch fails.
+    """
+    session = session_factory()
+    private_pool: Optional[InferencePool] = None
+    job = None
+    try:
+        job = session.get(models.ImportJob, job_id)
+        job.status = "running"
+        session.commit()
+
+        accepted, failures = _validate(session, rows)
+        job.processed_rows = len(rows) - len(accepted)
+        job.failed_count = len(failures)
+        job.errors = json.dumps(failures)
+        session.commit()
+
+        pool = get_inference_pool()
+        if pool is None:
+            pool = private_pool = InferencePool(max(1, WORKERS), max(1, WORKERS))
+
+        with zipfile.ZipFile(archive_path) as archive:
+            photos = _index_archive(archive)
+            for i in range(0, len(accepted), BATCH_SIZE):
+                batch = accepted[i:i + BATCH_SIZE]
+
+                with_photos, images = [], []
+                for row in batch:
+                    info = photos.get(row["photo"].lower()) if row["photo"] else photos.get(row["student_id"].lower())
+                    if info is None:
+                        failures.append(_failure(row, "Photo not found in archive"))
+                    elif info.file_size > MAX_PHOTO_BYTES:
+                        failures.append(_failure(row, "Photo is too large"))
+                    else:
+                        with_photos.append(row)
+                        images.append(archive.read(info))
+
+                encodings = _encode_parallel(pool, images)
+                gallery = gallery_cache.get(session) if DUPLICATE_POLICY != "off" else None
+                faces, face_encodings = [], []
+                for row, encoding in zip(with_photos, encodings):
+                    if encoding is None:
+                        failures.append(_failure(row, "No face detected in photo"))
+                        continue
+                    if isinstance(encoding, FrameRejected):
+                        failures.append(_failure(row, f"Photo rejected ({encoding.reason}): {encoding}"))
+                        continue
+                    duplicates = gallery.within(encoding, DUPLICATE_TOLERANCE) if gallery is not None else []
+                    if duplicates and DUPLICATE_POLICY == "reject":
+                        failures.append(_failure(row, f"Face already enrolled for student id {duplicates[0][0]}"))
+                        continue
+                    if duplicates:
+                        logger.warning(f"Import job {job_id}: row {row['row']} resembles students "
+                                       f"{[student_id for student_id, _ in duplicates]}")
+                    faces.append(row)
+                    face_encodings.append(encoding)
+
+                created = _insert(session, faces, face_encodings, failures)
+                job = session.get(models.ImportJob, job_id)
+                job.created_count += created
+                job.processed_rows += len(batch)
+                job.failed_count = len(failures)
+                job.errors = json.dumps(failures)
+                session.commit()
+                logger.info(f"Import job {job_id}: {job.processed_rows}/{job.total_rows} rows processed")
+
+        job.status = "completed"
+        job.message = f"Enrolled {job.created_count} of {job.total_rows} students"
+    except Exception as e:
+        logger.error(f"Import job {job_id} failed: {str(e)}")
+        session.rollback()
+        job = session.get(models.ImportJob, job_id)
+        if job is not None:
+            job.status = "failed"
+            job.message = str(e)[:255]
+    finally:
+        if job is not None:
+            job.finished_at = datetime.now(pytz.UTC)
+            session.commit()
+        session.close()
+        if private_pool is not None:
+            private_pool.shutdown()
+        try:
+            os.remove(archive_path)
+        except OSError:
+            pass
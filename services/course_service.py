@@ -0,0 +1,138 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Union
+
+import pytz
+
+import models
+from services.report_service import get_timezone
+from services.roster_cache import bump_roster_version
+
+logger = logging.getLogger(__name__)
+
+
+def course_json(course: models.Course) -> Dict:
+    return {
+        "id": course.id,
+        "code": course.code,
+        "name": course.name,
+        "created_at": course.created_at.isoformat() if course.created_at else None,
+    }
+
+
+def class_session_json(class_session: models.ClassSession) -> Dict:
+    return {
+        "id": class_session.id,
+        "course_id": class_session.course_id,
+        "room": class_session.room,
+        "starts_at": class_session.starts_at.isoformat(),
+        "ends_at": class_session.ends_at.isoformat(),
+    }
+
+
+def parse_session_time(value: Union[str, datetime]) -> datetime:
+    """
+    Naive UTC datetime for storage from an ISO 8601 string or a datetime;
+    times without an offset are local to ATTENDANCE_TIMEZONE
+
+    Raises:
+        ValueError: Missing or badly formatted time
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError(f"Invalid time: {value}, use ISO 8601")
+    if not isinstance(value, datetime):
+        raise ValueError("starts_at and ends_at are required")
+    if value.tzinfo is None:
+        value = get_timezone().localize(value)
+    return value.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def create_course(session, code: str, name: str) -> models.Course:
+    """Add a course; the caller commits"""
+    if not code or not name:
+        raise ValueError("code and name are required")
+    if session.query(models.Course.id).filter(models.Course.code == code).first():
+        raise ValueError(f"Course {code} already exists")
+    course = models.Course(code=code, name=name)
+    session.add(course)
+    session.flush()
+    return course
+
+
+def add_class_session(session, course: models.Course, room: str, starts_at: Union[str, datetime],
+                      ends_at: Union[str, datetime]) -> models.ClassSession:
+    """
+    Schedule a session of a course in a room; the caller commits
+
+    Raises:
+        ValueError: Missing room or an empty time window
+    """
+    if not room:
+        raise ValueError("room is required")
+    starts_at, ends_at = parse_session_time(starts_at), parse_session_time(ends_at)
+    if ends_at <= starts_at:
+        raise ValueError("ends_at must be after starts_at")
+    class_session = models.ClassSession(course_id=course.id, room=room, starts_at=starts_at, ends_at=ends_at)
+    session.add(class_session)
+    session.flush()
+    bump_roster_version(session)
+    return class_session
+
+
+def remove_class_session(session, class_session: models.ClassSession):
+    """Delete one session; the caller commits"""
+    session.delete(class_session)
+    bump_roster_version(session)
+
+
+def enrolled_student_ids(session, course_id: int) -> List[int]:
+    return [row[0] for row in session.query(models.Enrolment.student_id)
+            .filter(models.Enrolment.course_id == course_id).order_by(models.Enrolment.student_id)]
+
+
+def enrol_students(session, course: models.Course, student_ids: Iterable[int]) -> List[int]:
+    """
+    Enrol students in a course, skipping those already enrolled; the caller commits
+
+    Returns:
+        The ids newly enrolled
+
+    Raises:
+        ValueError: An id does not belong to a student
+    """
+    student_ids = {int(student_id) for student_id in student_ids}
+    existing = {row[0] for row in session.query(models.Student.id).filter(models.Student.id.in_(student_ids))}
+    unknown = student_ids - existing
+    if unknown:
+        raise ValueError(f"Unknown student ids: {sorted(unknown)}")
+
+    added = sorted(student_ids - set(enrolled_student_ids(session, course.id)))
+    session.add_all(models.Enrolment(course_id=course.id, student_id=student_id) for student_id in added)
+    if added:
+        session.flush()
+        bump_roster_version(session)
+    return added
+
+
+def unenrol_student(session, course_id: int, student_id: int) -> bool:
+    """Remove one enrolment; the caller commits. False if there was none"""
+    enrolment = session.query(models.Enrolment).filter(
+        models.Enrolment.course_id == course_id,
+        models.Enrolment.student_id == student_id,
+    ).first()
+    if enrolment is None:
+        return False
+    session.delete(enrolment)
+    bump_roster_version(session)
+    return True
+
+
+def get_class_session(session, course_id: int, session_id: int) -> Optional[models.ClassSession]:
+    """A course's session, None if it does not exist or belongs to another course"""
+    return session.query(models.ClassSession).filter(
+        models.ClassSession.id == session_id,
+        models.ClassSession.course_id == course_id,
+    ).first()
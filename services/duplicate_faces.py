@@ -0,0 +1,186 @@
+"""
+Find faces enrolled under more than one student record.
+
+Enrolment endpoints call check_enrolment() before storing an encoding. The
+whole gallery can be audited offline for near-duplicate pairs:
+
+    python -m services.duplicate_faces
+    python -m services.duplicate_faces --tolerance 0.4 --csv duplicates.csv
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import models
+from services.face_gallery import FaceGallery
+from services.gallery_cache import encoding_rows, gallery_cache
+
+logger = logging.getLogger(__name__)
+
+# Encodings closer than this are treated as the same person. Stricter than
+# the recognition tolerance, since twins and siblings do enrol separately.
+DUPLICATE_TOLERANCE = float(os.environ.get("FACE_DUPLICATE_TOLERANCE", "0.45"))
+# "warn" enrols and reports the conflicts, "reject" refuses, "off" skips the check
+DUPLICATE_POLICY = os.environ.get("FACE_DUPLICATE_POLICY", "warn").lower()
+# Rows per side of a block in the offline audit; memory is O(block_size²)
+AUDIT_BLOCK_SIZE = 2048
+
+
+class DuplicateFace(Exception):
+    """Enrolment refused because the face is already enrolled for other students"""
+
+    def __init__(self, duplicates: List[Dict]):
+        self.duplicates = duplicates
+        super().__init__(
+            "Face is already enrolled for student "
+            + ", ".join(duplicate["student_number"] for duplicate in duplicates)
+        )
+
+
+def find_duplicates(session, face_encoding: np.ndarray, exclude_student_id: Optional[int] = None,
+                    tolerance: float = DUPLICATE_TOLERANCE) -> List[Dict]:
+    """
+    Enrolled students whose face is within ``tolerance`` of an encoding
+
+    One vectorized pass over every template in the cached gallery.
+
+    Args:
+        session: SQLAlchemy session
+        face_encoding: Encoding about to be enrolled
+        exclude_student_id: The student being enrolled, who may match their own face
+        tolerance: Maximum Euclidean distance
+
+    Returns:
+        Closest first: {"student_id", "student_number", "name", "distance"}
+    """
+    hits = [
+        (student_id, distance)
+        for student_id, distance in gallery_cache.get(session).within(face_encoding, tolerance)
+        if student_id != exclude_student_id
+    ]
+    if not hits:
+        return []
+
+    students = {
+        row.id: row for row in session.query(models.Student.id, models.Student.student_id, models.Student.name)
+        .filter(models.Student.id.in_([student_id for student_id, _ in hits]))
+    }
+    return [
+        {
+            "student_id": student_id,
+            "student_number": students[student_id].student_id,
+            "name": students[student_id].name,
+            "distance": round(distance, 4),
+        }
+        for student_id, distance in hits
+        if student_id in students
+    ]
+
+
+def check_enrolment(session, face_encoding: np.ndarray, student_id: Optional[int] = None,
+                    policy: str = DUPLICATE_POLICY) -> List[Dict]:
+    """
+    Apply the duplicate policy to an encoding about to be enrolled
+
+    Returns:
+        The conflicting students (empty when there are none or the policy is "off")
+
+    Raises:
+        DuplicateFace: The policy is "reject" and the face is already enrolled
+    """
+    if policy == "off":
+        return []
+    duplicates = find_duplicates(session, face_encoding, exclude_student_id=student_id)
+    if duplicates:
+        if policy == "reject":
+            raise DuplicateFace(duplicates)
+        logger.warning(f"Face enrolled for student {student_id} resembles students "
+                       f"{[duplicate['student_id'] for duplicate in duplicates]}")
+    return duplicates
+
+
+def audit_gallery(gallery: FaceGallery, tolerance: float = DUPLICATE_TOLERANCE,
+                  block_size: int = AUDIT_BLOCK_SIZE) -> List[Tuple[int, int, float]]:
+    """
+    All pairs of different students with templates within ``tolerance``
+
+    Distances are computed a block of rows against a block of rows at a time
+    (upper triangle only), so memory stays at block_size² floats however
+    large the gallery is.
+
+    Returns:
+        (student_id, other_student_id, closest distance), closest first
+    """
+    owners, encodings, sq_norms = gallery.flat_templates()
+    limit = tolerance * tolerance
+    closest: Dict[Tuple[int, int], float] = {}
+
+    for i in range(0, len(owners), block_size):
+        rows = slice(i, i + block_size)
+        for j in range(i, len(owners), block_size):
+            cols = slice(j, j + block_size)
+            sq = sq_norms[rows, None] + sq_norms[None, cols] - 2.0 * encodings[rows].dot(encodings[cols].T)
+            hits = (sq <= limit) & (owners[rows, None] != owners[None, cols])
+            if i == j:
+                hits = np.triu(hits, k=1)
+            for a, b in zip(*np.nonzero(hits)):
+                pair = tuple(sorted((int(owners[i + a]), int(owners[j + b]))))
+                distance = float(np.sqrt(max(sq[a, b], 0.0)))
+                if distance < closest.get(pair, np.inf):
+                    closest[pair] = distance
+
+    return sorted(((a, b, distance) for (a, b), distance in closest.items()), key=lambda pair: pair[2])
+
+
+def audit(session, tolerance: float = DUPLICATE_TOLERANCE, block_size: int = AUDIT_BLOCK_SIZE) -> List[Dict]:
+    """Near-duplicate pairs in the enrolled gallery, with student details"""
+    gallery = FaceGallery.from_rows(encoding_rows(session))
+    pairs = audit_gallery(gallery, tolerance, block_size)
+    logger.info(f"Audited {len(gallery)} students: {len(pairs)} near-duplicate pairs within {tolerance}")
+    if not pairs:
+        return []
+
+    involved = {student_id for a, b, _ in pairs for student_id in (a, b)}
+    students = {
+        row.id: row for row in session.query(models.Student.id, models.Student.student_id, models.Student.name)
+        .filter(models.Student.id.in_(involved))
+    }
+    return [
+        {
+            "student_id": a,
+            "student_number": students[a].student_id,
+            "name": students[a].name,
+            "other_student_id": b,
+            "other_student_number": students[b].student_id,
+            "other_name": students[b].name,
+            "distance": round(distance, 4),
+        }
+        for a, b, distance in pairs
+    ]
+
+
+if __name__ == "__main__":
+    from app import app, db
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tolerance", type=float, default=DUPLICATE_TOLERANCE)
+    parser.add_argument("--block-size", type=int, default=AUDIT_BLOCK_SIZE)
+    parser.add_argument("--csv", help="Write the pairs to this CSV file instead of stdout")
+    args = parser.parse_args()
+
+    with app.app_context():
+        results = audit(db.session, args.tolerance, args.block_size)
+
+    fields = ["student_id", "student_number", "name", "other_student_id", "other_student_number", "other_name", "distance"]
+    target = open(args.csv, "w", newline="") if args.csv else sys.stdout
+    writer = csv.DictWriter(target, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(results)
+    if args.csv:
+        target.close()
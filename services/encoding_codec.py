@@ -0,0 +1,76 @@
+import json
+import logging
+from typing import Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Binary layout: 2-byte magic, 1-byte format version, 1-byte dtype code,
+# followed by the little-endian encoding values.
+MAGIC = b"FE"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4
+
+DTYPE_CODES = {
+    b"f": np.dtype("<f4"),
+    b"d": np.dtype("<f8"),
+}
+DEFAULT_DTYPE = np.dtype("<f4")
+
+# Values in a dlib face encoding
+ENCODING_SIZE = 128
+
+
+def pack_encoding(face_encoding: Union[np.ndarray, Sequence[float]], dtype: np.dtype = DEFAULT_DTYPE) -> bytes:
+    """
+    Serialize a face encoding to the compact binary storage format
+
+    Args:
+        face_encoding: 128-d face encoding
+        dtype: Little-endian float32 (default) or float64
+
+    Returns:
+        Header followed by the raw little-endian values
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    for code, code_dtype in DTYPE_CODES.items():
+        if code_dtype == dtype:
+            break
+    else:
+        raise ValueError(f"Unsupported encoding dtype: {dtype}")
+
+    values = np.ascontiguousarray(face_encoding, dtype=dtype)
+    return MAGIC + bytes([FORMAT_VERSION]) + code + values.tobytes()
+
+
+def unpack_encoding(data: Union[bytes, bytearray, memoryview, str]) -> np.ndarray:
+    """
+    Load a stored face encoding
+
+    Binary values are returned as a read-only view over ``data`` without
+    copying. Legacy JSON text encodings are still accepted so rows written
+    before the migration keep working.
+    """
+    if isinstance(data, str):
+        return np.array(json.loads(data), dtype=np.float64)
+
+    if bytes(data[:2]) != MAGIC:
+        if bytes(data[:1]) == b"[":
+            return np.array(json.loads(bytes(data).decode("utf-8")), dtype=np.float64)
+        raise ValueError("Unrecognized face encoding format")
+
+    version = data[2]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported face encoding format version: {version}")
+
+    dtype = DTYPE_CODES.get(bytes(data[3:4]))
+    if dtype is None:
+        raise ValueError(f"Unsupported face encoding dtype code: {bytes(data[3:4])!r}")
+
+    return np.frombuffer(data, dtype=dtype, offset=HEADER_SIZE)
+
+
+def is_packed(data: Union[bytes, bytearray, memoryview, str, None]) -> bool:
+    """Whether a stored value is already in the binary format"""
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:2]) == MAGIC
@@ -0,0 +1,291 @@
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from services.encoding_codec import unpack_encoding
+
+logger = logging.getLogger(__name__)
+
+ENCODING_DIM = 128
+
+# Centroid candidates re-scored against individual templates
+RERANK_CANDIDATES = 10
+
+
+class GalleryMatch(NamedTuple):
+    """Result of matching one probe encoding against the gallery"""
+    student_id: Optional[int]  # Closest student within tolerance, None if no match
+    distance: Optional[float]  # Distance to the closest student (even if over tolerance)
+    candidates: List[Tuple[int, float]]  # Top-k (student_id, distance), closest first
+
+
+class FaceGallery:
+    """
+    All enrolled face encodings held as one contiguous matrix.
+
+    Row ``i`` of ``encodings`` belongs to the student whose primary key is
+    ``ids[i]``. Distances to a probe are computed for every row at once using
+    ``|a - b|^2 = |a|^2 + |b|^2 - 2 a.b`` with the squared norms of the
+    gallery precomputed, so a probe costs one matrix-vector product.
+
+    A student enrolled with several templates is represented in the matrix
+    by their centroid. The closest centroids are then re-scored against
+    the individual templates, and a student's distance is that of their
+    closest template.
+    """
+
+    # Optional services.ann_index.IVFIndex over the same encodings. When set,
+    # match() searches the index instead of scanning every row.
+    index = None
+
+    def __init__(self, ids: Optional[Sequence[int]] = None, encodings: Optional[np.ndarray] = None,
+                 templates: Optional[Dict[int, np.ndarray]] = None):
+        if ids is None or len(ids) == 0:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.encodings = np.empty((0, ENCODING_DIM), dtype=np.float64)
+        else:
+            self.ids = np.asarray(ids, dtype=np.int64)
+            self.encodings = np.ascontiguousarray(encodings, dtype=np.float64).reshape(len(self.ids), -1)
+        self._sq_norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        # Individual templates of students with more than one, by student id
+        self.templates: Dict[int, np.ndarray] = templates or {}
+        self._flat = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, Union[bytes, str, Sequence[float], np.ndarray]]]) -> "FaceGallery":
+        """
+        Build a gallery from (student_id, face_encoding) rows
+
+        Args:
+            rows: Pairs of student primary key and stored encoding. Rows
+                without an encoding are skipped. A student may appear
+                several times, once per template.
+        """
+        grouped: Dict[int, List[np.ndarray]] = {}
+        for student_id, face_encoding in rows:
+            if face_encoding is None or len(face_encoding) == 0:
+                continue
+            if isinstance(face_encoding, (bytes, bytearray, memoryview, str)):
+                face_encoding = unpack_encoding(face_encoding)
+            grouped.setdefault(int(student_id), []).append(np.asarray(face_encoding, dtype=np.float64))
+
+        if not grouped:
+            return cls()
+
+        ids = list(grouped)
+        encodings = np.empty((len(ids), ENCODING_DIM), dtype=np.float64)
+        templates = {}
+        for row, student_id in enumerate(ids):
+            group = grouped[student_id]
+            if len(group) == 1:
+                encodings[row] = group[0]
+            else:
+                stacked = np.vstack(group)
+                templates[student_id] = stacked
+                encodings[row] = stacked.mean(axis=0)
+        return cls(ids, encodings, templates)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def distances(self, face_encoding: np.ndarray) -> np.ndarray:
+        """Euclidean distance from a probe encoding to every gallery row"""
+        probe = np.asarray(face_encoding, dtype=np.float64)
+        sq = self._sq_norms + probe.dot(probe) - 2.0 * self.encodings.dot(probe)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def match(self, face_encoding: np.ndarray, tolerance: float = 0.6, k: int = 5) -> GalleryMatch:
+        """
+        Find the closest enrolled student to a probe encoding
+
+        Args:
+            face_encoding: 128-d probe encoding
+            tolerance: Maximum distance for a positive match
+            k: Number of candidates to return
+
+        Returns:
+            GalleryMatch with the best student (if within tolerance), its
+            distance and the top-k candidates ordered by distance
+        """
+        if len(self) == 0:
+            return GalleryMatch(None, None, [])
+
+        shortlist = max(k, RERANK_CANDIDATES) if self.templates else k
+        if self.index is not None:
+            ids, top_distances = self.index.search(face_encoding, shortlist)
+            candidates = [(int(i), float(d)) for i, d in zip(ids, top_distances)]
+        else:
+            distances = self.distances(face_encoding)
+            shortlist = max(1, min(shortlist, len(distances)))
+            if shortlist < len(distances):
+                top = np.argpartition(distances, shortlist - 1)[:shortlist]
+            else:
+                top = np.arange(len(distances))
+            top = top[np.argsort(distances[top])]
+            candidates = [(int(self.ids[i]), float(distances[i])) for i in top]
+        candidates = self._rerank(face_encoding, candidates)[:max(1, k)]
+
+        if not candidates:
+            return GalleryMatch(None, None, [])
+        best_id, best_distance = candidates[0]
+        if best_distance > tolerance:
+            return GalleryMatch(None, best_distance, candidates)
+        return GalleryMatch(best_id, best_distance, candidates)
+
+    def match_many(self, face_encodings: Sequence[np.ndarray], tolerance: float = 0.6, k: int = 5,
+                   unique: bool = True) -> List[GalleryMatch]:
+        """
+        Match several probes at once, e.g. every face in one frame
+
+        The distances for all probes come from a single matrix product.
+        With ``unique`` a student can only be matched by one probe: if two
+        faces resolve to the same student, the farther one is reported as
+        unmatched. Pass ``unique=False`` for probes from unrelated frames.
+
+        Returns:
+            One GalleryMatch per probe, in the same order
+        """
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [GalleryMatch(None, None, []) for _ in face_encodings]
+
+        if self.index is not None:
+            matches = [self.match(probe, tolerance, k) for probe in face_encodings]
+        else:
+            probes = np.asarray(face_encodings, dtype=np.float64).reshape(len(face_encodings), -1)
+            sq = (
+                self._sq_norms[None, :]
+                + np.einsum("ij,ij->i", probes, probes)[:, None]
+                - 2.0 * probes.dot(self.encodings.T)
+            )
+            np.maximum(sq, 0.0, out=sq)
+            distances = np.sqrt(sq, out=sq)
+
+            shortlist = max(k, RERANK_CANDIDATES) if self.templates else k
+            shortlist = max(1, min(shortlist, len(self)))
+            if shortlist < len(self):
+                top = np.argpartition(distances, shortlist - 1, axis=1)[:, :shortlist]
+            else:
+                top = np.tile(np.arange(len(self)), (len(probes), 1))
+
+            matches = []
+            for row, cols in enumerate(top):
+                cols = cols[np.argsort(distances[row, cols])]
+                candidates = [(int(self.ids[c]), float(distances[row, c])) for c in cols]
+                candidates = self._rerank(probes[row], candidates)[:max(1, k)]
+                best_id, best_distance = candidates[0]
+                if best_distance > tolerance:
+                    best_id = None
+                matches.append(GalleryMatch(best_id, best_distance, candidates))
+
+        if not unique:
+            return matches
+
+        # Resolve faces that matched the same student in favour of the closest
+        closest = {}
+        for i, match in enumerate(matches):
+            if match.student_id is None:
+                continue
+            j = closest.get(match.student_id)
+            if j is None or match.distance < matches[j].distance:
+                closest[match.student_id] = i
+        return [
+            match if match.student_id is None or closest[match.student_id] == i
+            else GalleryMatch(None, match.distance, match.candidates)
+            for i, match in enumerate(matches)
+        ]
+
+    def flat_templates(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Every individual template as one matrix
+
+        Returns:
+            (owner student ids, encodings, squared norms), one row per
+            template; single-template students contribute their one row
+        """
+        if self._flat is None:
+            if not self.templates:
+                self._flat = (self.ids, self.encodings, self._sq_norms)
+            else:
+                single = ~np.isin(self.ids, np.fromiter(self.templates, dtype=np.int64))
+                owners = np.concatenate(
+                    [self.ids[single]] + [np.full(len(t), student_id, dtype=np.int64) for student_id, t in self.templates.items()]
+                )
+                encodings = np.vstack([self.encodings[single]] + list(self.templates.values()))
+                self._flat = (owners, encodings, np.einsum("ij,ij->i", encodings, encodings))
+        return self._flat
+
+    def within(self, face_encoding: np.ndarray, tolerance: float) -> List[Tuple[int, float]]:
+        """
+        Every student with a template within ``tolerance`` of the probe
+
+        Unlike match(), which shortlists by centroid, this is an exhaustive
+        scan of all templates in one matrix-vector product.
+
+        Returns:
+            (student_id, closest template distance), closest first
+        """
+        if len(self) == 0:
+            return []
+        owners, encodings, sq_norms = self.flat_templates()
+        probe = np.asarray(face_encoding, dtype=np.float64)
+        sq = sq_norms + probe.dot(probe) - 2.0 * encodings.dot(probe)
+        hits = np.flatnonzero(sq <= tolerance * tolerance)
+
+        closest: Dict[int, float] = {}
+        for row in hits:
+            distance = float(np.sqrt(max(sq[row], 0.0)))
+            student_id = int(owners[row])
+            if distance < closest.get(student_id, np.inf):
+                closest[student_id] = distance
+        return sorted(closest.items(), key=lambda hit: hit[1])
+
+    def _rerank(self, probe: np.ndarray, candidates: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        """Replace centroid distances with closest-template distances and re-sort"""
+        if not self.templates:
+            return candidates
+        probe = np.asarray(probe, dtype=np.float64)
+        rescored = []
+        for student_id, distance in candidates:
+            templates = self.templates.get(student_id)
+            if templates is not None:
+                distance = float(np.sqrt(np.min(np.sum((templates - probe) ** 2, axis=1))))
+            rescored.append((student_id, distance))
+        rescored.sort(key=lambda candidate: candidate[1])
+        return rescored
+
+    def updated(self, changed_ids: Sequence[int], rows: Iterable[Tuple[int, Union[bytes, str, Sequence[float], np.ndarray]]]) -> "FaceGallery":
+        """
+        Return a new gallery with ``changed_ids`` replaced by ``rows``
+
+        Every id in ``changed_ids`` is dropped, then the encodings in
+        ``rows`` (all templates of each changed student) are appended. Students that were deleted or lost their
+        encoding are simply absent from ``rows``. The current gallery is
+        left untouched so readers holding it are unaffected.
+        """
+        changed = {int(student_id) for student_id in changed_ids}
+        keep = ~np.isin(self.ids, np.asarray(list(changed), dtype=np.int64))
+        fresh = FaceGallery.from_rows(rows)
+        ids = np.concatenate([self.ids[keep], fresh.ids])
+        if len(ids) == 0:
+            return FaceGallery()
+        templates = {student_id: t for student_id, t in self.templates.items() if student_id not in changed}
+        templates.update(fresh.templates)
+        return FaceGallery(ids, np.vstack([self.encodings[keep], fresh.encodings]), templates)
+
+    def subset(self, student_ids: Iterable[int]) -> "FaceGallery":
+        """
+        Return a new gallery holding only ``student_ids``, e.g. a class roster
+
+        Ids without an encoding in this gallery are skipped. The rows are
+        copied, so the subset stays valid when this gallery is replaced.
+        """
+        keep = np.isin(self.ids, np.fromiter(student_ids, dtype=np.int64))
+        ids = self.ids[keep]
+        if len(ids) == 0:
+            return FaceGallery()
+        templates = {student_id: self.templates[student_id] for student_id in ids.tolist() if student_id in self.templates}
+        return FaceGallery(ids, self.encodings[keep], templates)
@@ -3,29 +3,208 @@ import cv2
 import numpy as np
 import io
 import logging
+import os
+from concurrent.futures import Future
 from typing import List, Optional, Union, Tuple
 
+from services.frame_quality import MAX_FACES, FrameRejected, check_frame, quality_stats, select_faces
+from services.metrics import call_collecting, stage
+
 logger = logging.getLogger(__name__)
 
-def encode_face(image_data: bytes) -> Optional[np.ndarray]:
+# Fraction of the frame size used for HOG detection. Landmarks and encodings
+# are always computed on the full-resolution frame.
+OVERLAY_DETECTION_SCALE = float(os.environ.get("FACE_DETECTION_SCALE_OVERLAY", "0.25"))
+RECOGNITION_DETECTION_SCALE = float(os.environ.get("FACE_DETECTION_SCALE_RECOGNITION", "0.5"))
+ENROLMENT_DETECTION_SCALE = float(os.environ.get("FACE_DETECTION_SCALE_ENROLMENT", "1.0"))
+
+# Resolution JPEG frames are decoded at: OpenCV decodes straight to 1/2, 1/4
+# or 1/8 size, much cheaper than a full decode followed by a resize. 1.0
+# decodes at full resolution; boxes are always returned in original coordinates.
+OVERLAY_DECODE_SCALE = float(os.environ.get("FACE_DECODE_SCALE_OVERLAY", "0.5"))
+RECOGNITION_DECODE_SCALE = float(os.environ.get("FACE_DECODE_SCALE_RECOGNITION", "1.0"))
+
+# Margin, as a fraction of the box size, around each face of a frame handle
+# that is re-detected at the caller's detection scale before encoding: the
+# handle's boxes come from the coarse overlay detection
+HINT_PADDING = float(os.environ.get("FACE_HINT_PADDING", "0.5"))
+
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# services.inference_pool.InferencePool that runs detection and encoding in
+# worker processes; None runs them inline in the calling thread
+_inference_pool = None
+
+def use_inference_pool(pool):
+    """Route encode_face, encode_faces and detect_faces through a process pool"""
+    global _inference_pool
+    _inference_pool = pool
+
+def get_inference_pool():
+    return _inference_pool
+
+def decode_image(image_data: bytes, decode_scale: float = 1.0) -> Tuple[np.ndarray, int]:
+    """
+    Decode image bytes to a BGR array, at reduced resolution where allowed
+
+    Args:
+        image_data: Encoded image, read in place without a copy
+        decode_scale: Smallest acceptable fraction of the original size; the
+            largest of 1/2, 1/4 and 1/8 not below it is used
+
+    Returns:
+        Tuple of (BGR image, reduction factor 1, 2, 4 or 8); multiply
+        coordinates in the image by the factor for the original frame
+
+    Raises:
+        ValueError: The data is not a decodable image
+    """
+    factor = 1
+    for candidate in (8, 4, 2):
+        if decode_scale * candidate <= 1.0:
+            factor = candidate
+            break
+    img = cv2.imdecode(np.frombuffer(image_data, np.uint8), _REDUCED_DECODE_FLAGS[factor])
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img, factor
+
+def _upscale_locations(face_locations: List[Tuple[int, int, int, int]], factor: int) -> List[Tuple[int, int, int, int]]:
+    if factor == 1:
+        return face_locations
+    return [tuple(value * factor for value in location) for location in face_locations]
+
+def locate_faces(rgb_img: np.ndarray, detection_scale: float = 1.0) -> List[Tuple[int, int, int, int]]:
+    """
+    Run HOG face detection on a downscaled copy of the image
+
+    Args:
+        rgb_img: RGB image
+        detection_scale: Resize factor for detection, 1.0 detects on the
+            original image
+
+    Returns:
+        List of face locations (top, right, bottom, left) in the
+        coordinates of the original image
+    """
+    if detection_scale >= 1.0:
+        return face_recognition.face_locations(rgb_img, model="hog")
+
+    small_img = cv2.resize(rgb_img, (0, 0), fx=detection_scale, fy=detection_scale, interpolation=cv2.INTER_AREA)
+    height, width = rgb_img.shape[:2]
+    return [
+        (
+            max(0, int(round(top / detection_scale))),
+            min(width, int(round(right / detection_scale))),
+            min(height, int(round(bottom / detection_scale))),
+            max(0, int(round(left / detection_scale))),
+        )
+        for top, right, bottom, left in face_recognition.face_locations(small_img, model="hog")
+    ]
+
+def refine_locations(rgb_img: np.ndarray, face_locations: List[Tuple[int, int, int, int]],
+                     detection_scale: float = 1.0) -> List[Tuple[int, int, int, int]]:
+    """
+    Re-detect each face within a padded region around its approximate box
+
+    Boxes from a coarse detection misplace the landmarks, and so the
+    encoding; detecting again in a small crop gives the box a full
+    detection at ``detection_scale`` would have, for a fraction of the cost.
+    A face not found again keeps its original box.
+
+    Args:
+        rgb_img: RGB image
+        face_locations: Approximate face locations in the image's coordinates
+        detection_scale: Resize factor for detection in the crops
+
+    Returns:
+        List of face locations (top, right, bottom, left), one per input box
+    """
+    height, width = rgb_img.shape[:2]
+    refined = []
+    for top, right, bottom, left in face_locations:
+        pad_y = int((bottom - top) * HINT_PADDING)
+        pad_x = int((right - left) * HINT_PADDING)
+        y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+        x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+        found = locate_faces(rgb_img[y0:y1, x0:x1], detection_scale) if y1 > y0 and x1 > x0 else []
+        if not found:
+            refined.append((top, right, bottom, left))
+            continue
+        # The detection nearest the hint's centre
+        centre_y, centre_x = (top + bottom) / 2 - y0, (left + right) / 2 - x0
+        t, r, b, l = min(found, key=lambda box: ((box[0] + box[2]) / 2 - centre_y) ** 2 + ((box[1] + box[3]) / 2 - centre_x) ** 2)
+        refined.append((t + y0, r + x0, b + y0, l + x0))
+    return refined
+
+def encode_face(image_data: bytes, detection_scale: float = RECOGNITION_DETECTION_SCALE,
+                decode_scale: float = 1.0, face_locations: Optional[List[Tuple[int, int, int, int]]] = None) -> Optional[np.ndarray]:
+    """
+    Encode the first face in an image
+    
+    Runs in the inference pool when one is configured.
+    
+    Args:
+        image_data: Binary image data
+        detection_scale: Resize factor for detection
+        decode_scale: See decode_image; enrolment keeps the full resolution
+        face_locations: Faces already found in this image; only regions around them are searched
+    
+    Raises:
+        InferenceOverloaded: The inference pool queue is full
+        FrameRejected: The frame failed the quality gate
+    """
+    if face_locations:
+        faces = encode_known_faces(image_data, face_locations, decode_scale, max_faces=MAX_FACES,
+                                   detection_scale=detection_scale)
+        return faces[0][1] if faces else None
+    if _inference_pool is not None:
+        return _gated(call_collecting, _inference_pool.call, _encode_face, image_data, detection_scale, decode_scale)
+    return _gated(_encode_face, image_data, detection_scale, decode_scale)
+
+def _gated(fn, *args):
+    """Call an encode function, counting frames that passed or failed the quality gate"""
+    try:
+        result = fn(*args)
+    except FrameRejected as e:
+        quality_stats.record(e.reason)
+        raise
+    if result is not None and len(result):
+        quality_stats.record()
+    return result
+
+def _encode_face(image_data: bytes, detection_scale: float, decode_scale: float = 1.0) -> Optional[np.ndarray]:
     """Real face encoding implementation"""
     try:
-        # Convert image bytes to numpy array
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with stage("decode"):
+            img, factor = decode_image(image_data, decode_scale)
+            
+            # Convert BGR to RGB
+            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         
-        # Convert BGR to RGB
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Skip dark and blurry frames before detection
+        with stage("quality"):
+            check_frame(img)
         
         # Detect faces
-        face_locations = face_recognition.face_locations(rgb_img, model="hog")
+        with stage("detect"):
+            face_locations = locate_faces(rgb_img, min(1.0, detection_scale * factor))
         
         if not face_locations:
             logger.warning("No face detected in image")
             return None
+        
+        # Only the largest face is encoded, and only if it is large enough
+        face_locations = select_faces(face_locations, rgb_img.shape[0], MAX_FACES)[:1]
             
         # Get face encodings
-        face_encodings = face_recognition.face_encodings(rgb_img, face_locations)
+        with stage("encode"):
+            face_encodings = face_recognition.face_encodings(rgb_img, face_locations)
         
         if not face_encodings:
             logger.warning("Could not encode face")
@@ -33,50 +212,278 @@ def encode_face(image_data: bytes) -> Optional[np.ndarray]:
             
         return face_encodings[0]
         
+    except FrameRejected:
+        raise
     except Exception as e:
         logger.error(f"Error encoding face: {str(e)}")
         return None
 
+def encode_faces(image_data: bytes, detection_scale: float = RECOGNITION_DETECTION_SCALE,
+                 decode_scale: float = RECOGNITION_DECODE_SCALE,
+                 face_locations: Optional[List[Tuple[int, int, int, int]]] = None) -> List[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    """
+    Encode every face in an image
+    
+    All detected faces are encoded in a single face_encodings call. Runs in
+    the inference pool when one is configured.
+    
+    Args:
+        image_data: Binary image data
+        detection_scale: Resize factor for detection
+        decode_scale: See decode_image
+        face_locations: Faces already found in this image; only regions around them are searched
+        
+    Returns:
+        List of (face location (top, right, bottom, left), encoding) pairs,
+        empty if no face was found
+        
+    Raises:
+        InferenceOverloaded: The inference pool queue is full
+        FrameRejected: The frame failed the quality gate
+    """
+    if face_locations:
+        return encode_known_faces(image_data, face_locations, decode_scale, detection_scale=detection_scale)
+    if _inference_pool is not None:
+        return _gated(call_collecting, _inference_pool.call, _encode_faces, image_data, detection_scale, decode_scale)
+    return _gated(_encode_faces, image_data, detection_scale, decode_scale)
+
+def _encode_faces(image_data: bytes, detection_scale: float, decode_scale: float = 1.0) -> List[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    try:
+        with stage("decode"):
+            img, factor = decode_image(image_data, decode_scale)
+            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        
+        with stage("quality"):
+            check_frame(img)
+        
+        with stage("detect"):
+            face_locations = locate_faces(rgb_img, min(1.0, detection_scale * factor))
+        if not face_locations:
+            logger.warning("No face detected in image")
+            return []
+        
+        # Faces too far away to match are left out
+        face_locations = select_faces(face_locations, rgb_img.shape[0])
+        with stage("encode"):
+            face_encodings = face_recognition.face_encodings(rgb_img, face_locations)
+        return list(zip(_upscale_locations(face_locations, factor), face_encodings))
+        
+    except FrameRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Error encoding faces: {str(e)}")
+        return []
+
+def encode_known_faces(image_data: bytes, face_locations: List[Tuple[int, int, int, int]],
+                       decode_scale: float = 1.0, max_faces: Optional[int] = None,
+                       detection_scale: float = RECOGNITION_DETECTION_SCALE) -> List[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    """
+    Encode faces at approximately known locations, skipping full-frame detection
+    
+    For frames whose faces were already found, e.g. by an earlier
+    detect_faces call (see services/frame_cache.py). Each face is detected
+    again only within a padded region around its box (see
+    refine_locations). Runs in the inference pool when one is configured.
+    
+    Args:
+        image_data: Binary image data
+        face_locations: Face locations (top, right, bottom, left) in
+            original-frame coordinates
+        decode_scale: See decode_image
+        max_faces: Encode only the largest face, rejecting frames with more
+            than this many faces (see services/frame_quality.py); None
+            encodes them all
+        detection_scale: Resize factor for the re-detection
+        
+    Returns:
+        List of (face location, encoding) pairs, empty on error
+        
+    Raises:
+        InferenceOverloaded: The inference pool queue is full
+        FrameRejected: The frame failed the quality gate
+    """
+    if _inference_pool is not None:
+        return _gated(call_collecting, _inference_pool.call, _encode_known_faces, image_data, face_locations,
+                      decode_scale, max_faces, detection_scale)
+    return _gated(_encode_known_faces, image_data, face_locations, decode_scale, max_faces, detection_scale)
+
+def _encode_known_faces(image_data: bytes, face_locations: List[Tuple[int, int, int, int]],
+                        decode_scale: float = 1.0, max_faces: Optional[int] = None,
+                        detection_scale: float = RECOGNITION_DETECTION_SCALE) -> List[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    try:
+        with stage("decode"):
+            img, factor = decode_image(image_data, decode_scale)
+            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        
+        with stage("quality"):
+            check_frame(img)
+        face_locations = select_faces(face_locations, rgb_img.shape[0] * factor, max_faces)
+        if max_faces is not None:
+            face_locations = face_locations[:1]
+        
+        decoded_locations = [tuple(value // factor for value in location) for location in face_locations]
+        with stage("detect"):
+            decoded_locations = refine_locations(rgb_img, decoded_locations, min(1.0, detection_scale * factor))
+        with stage("encode"):
+            face_encodings = face_recognition.face_encodings(rgb_img, decoded_locations)
+        return list(zip(_upscale_locations(decoded_locations, factor), face_encodings))
+        
+    except FrameRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Error encoding faces: {str(e)}")
+        return []
+
+def encode_face_batch(images: List[bytes], detection_scale: float = RECOGNITION_DETECTION_SCALE,
+                      decode_scale: float = RECOGNITION_DECODE_SCALE) -> List[Optional[np.ndarray]]:
+    """
+    Encode the first face of each image in a batch
+    
+    Runs in the inference pool, as a single task, when one is configured,
+    so a batch costs one round trip to a worker instead of one per image.
+    
+    Args:
+        images: Binary image data, one per request
+        detection_scale: Resize factor for detection
+        decode_scale: See decode_image
+        
+    Returns:
+        One encoding per image, None where no face was found and the
+        FrameRejected error where the frame failed the quality gate
+        
+    Raises:
+        InferenceOverloaded: The inference pool queue is full
+    """
+    if _inference_pool is not None:
+        results = call_collecting(_inference_pool.call, _encode_face_batch, images, detection_scale, decode_scale)
+    else:
+        results = _encode_face_batch(images, detection_scale, decode_scale)
+    return _record_batch_quality(results)
+
+def encode_face_batch_async(images: List[bytes], detection_scale: float = RECOGNITION_DETECTION_SCALE,
+                            decode_scale: float = RECOGNITION_DECODE_SCALE) -> Future:
+    """
+    encode_face_batch without waiting for the result
+    
+    Returns:
+        Future of the encode_face_batch result; it is already done when
+        there is no inference pool, as the batch was encoded inline
+        
+    Raises:
+        InferenceOverloaded: The inference pool queue is full
+    """
+    if _inference_pool is not None:
+        inner = _inference_pool.submit(_encode_face_batch, images, detection_scale, decode_scale)
+    else:
+        inner = Future()
+        try:
+            inner.set_result(_encode_face_batch(images, detection_scale, decode_scale))
+        except Exception as e:
+            inner.set_exception(e)
+    
+    future = Future()
+    def done(inner_future: Future):
+        try:
+            future.set_result(_record_batch_quality(inner_future.result()))
+        except BaseException as e:
+            future.set_exception(e)
+    inner.add_done_callback(done)
+    return future
+
+def _record_batch_quality(results: List[Union[np.ndarray, FrameRejected, None]]):
+    for result in results:
+        if isinstance(result, FrameRejected):
+            quality_stats.record(result.reason)
+        elif result is not None:
+            quality_stats.record()
+    return results
+
+def _encode_face_batch(images: List[bytes], detection_scale: float, decode_scale: float = 1.0) -> List[Union[np.ndarray, FrameRejected, None]]:
+    results = [None] * len(images)
+    
+    for slot, image_data in enumerate(images):
+        try:
+            with stage("decode"):
+                img, factor = decode_image(image_data, decode_scale)
+                rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            with stage("quality"):
+                check_frame(img)
+            with stage("detect"):
+                face_locations = locate_faces(rgb_img, min(1.0, detection_scale * factor))
+            face_locations = select_faces(face_locations, rgb_img.shape[0], MAX_FACES)
+            if not face_locations:
+                continue
+            with stage("encode"):
+                face_encodings = face_recognition.face_encodings(rgb_img, face_locations[:1])
+        except FrameRejected as e:
+            results[slot] = e
+            continue
+        except Exception as e:
+            logger.error(f"Error encoding image in batch: {str(e)}")
+            continue
+        if face_encodings:
+            results[slot] = face_encodings[0]
+    
+    return results
+
 def compare_faces(face_encoding: np.ndarray, stored_encoding: Union[List[float], np.ndarray], tolerance: float = 0.6) -> bool:
     """Real face comparison implementation"""
     try:
         if isinstance(stored_encoding, list):
             stored_encoding = np.array(stored_encoding)
             
-        # Compare face encodings
-        matches = face_recognition.compare_faces([stored_encoding], face_encoding, tolerance=tolerance)
-        
-        # Get face distance
+        # Get face distance (compare_faces would compute the same distance again)
         face_distances = face_recognition.face_distance([stored_encoding], face_encoding)
         
-        return bool(matches[0]) and face_distances[0] <= tolerance
+        return bool(face_distances[0] <= tolerance)
         
     except Exception as e:
         logger.error(f"Error comparing faces: {str(e)}")
         return False
 
-def detect_faces(image_data: bytes) -> Tuple[np.ndarray, List[Tuple[int, int, int, int]]]:
+def detect_faces(image_data: bytes, detection_scale: float = OVERLAY_DETECTION_SCALE, draw: bool = True,
+                 decode_scale: float = OVERLAY_DECODE_SCALE) -> Tuple[np.ndarray, List[Tuple[int, int, int, int]]]:
     """
     Detect faces in an image and return the image with face rectangles drawn
     
+    Runs in the inference pool when one is configured.
+    
     Args:
         image_data: Binary image data
+        detection_scale: Resize factor for detection; the overlay only
+            needs rough boxes so it defaults to a small scale
+        draw: Draw the rectangles; with False the returned image is None,
+            which saves shipping it back from the inference pool
+        decode_scale: See decode_image; the image drawn on is always full size
         
     Returns:
         Tuple containing:
         - The image with rectangles drawn around faces
         - List of face locations (top, right, bottom, left)
+        
+    Raises:
+        InferenceOverloaded: The inference pool queue is full
     """
+    if _inference_pool is not None:
+        return call_collecting(_inference_pool.call, _detect_faces, image_data, detection_scale, draw, decode_scale)
+    return _detect_faces(image_data, detection_scale, draw, decode_scale)
+
+def _detect_faces(image_data: bytes, detection_scale: float, draw: bool,
+                  decode_scale: float = 1.0) -> Tuple[np.ndarray, List[Tuple[int, int, int, int]]]:
     try:
-        # Read image from binary data
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert BGR to RGB
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        with stage("decode"):
+            # Read image from binary data
+            img, factor = decode_image(image_data, 1.0 if draw else decode_scale)
+            
+            # Convert BGR to RGB
+            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         
         # Find face locations
-        face_locations = face_recognition.face_locations(rgb_img)
+        with stage("detect"):
+            face_locations = _upscale_locations(locate_faces(rgb_img, min(1.0, detection_scale * factor)), factor)
+        
+        if not draw:
+            return None, face_locations
         
         # Draw rectangles around faces
         for top, right, bottom, left in face_locations:
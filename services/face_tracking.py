@@ -0,0 +1,170 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from services.face_recognition_service import (
+    OVERLAY_DECODE_SCALE, OVERLAY_DETECTION_SCALE, decode_image, detect_faces, locate_faces,
+)
+
+logger = logging.getLogger(__name__)
+
+# Run full HOG detection at least every N frames; trackers fill the gaps
+DETECT_EVERY = int(os.environ.get("FACE_TRACK_DETECT_EVERY", "10"))
+# Frame scale used by the trackers
+TRACK_SCALE = float(os.environ.get("FACE_TRACK_SCALE", "0.5"))
+# Drop tracking sessions that have not sent a frame for this many seconds
+SESSION_IDLE_TIMEOUT = float(os.environ.get("FACE_TRACK_IDLE_TIMEOUT", "60"))
+MAX_SESSIONS = int(os.environ.get("FACE_TRACK_MAX_SESSIONS", "256"))
+
+Box = Tuple[int, int, int, int]  # top, right, bottom, left
+
+
+def _create_tracker():
+    """Cheapest available OpenCV tracker, or None without opencv-contrib"""
+    legacy = getattr(cv2, "legacy", None)
+    if legacy is not None and hasattr(legacy, "TrackerMOSSE_create"):
+        return legacy.TrackerMOSSE_create()
+    if hasattr(cv2, "TrackerKCF_create"):
+        return cv2.TrackerKCF_create()
+    return None
+
+
+class FaceTrackingSession:
+    """
+    Detect-then-track state for one client
+
+    Full detection runs on the first frame, every ``detect_every`` frames
+    after that, and whenever a tracker loses its face or drifts out of the
+    frame. In between, a cheap correlation tracker per face follows the
+    boxes on a downscaled frame.
+    """
+
+    def __init__(self, detect_every: int = DETECT_EVERY, detection_scale: float = OVERLAY_DETECTION_SCALE,
+                 track_scale: float = TRACK_SCALE):
+        self.detect_every = max(1, detect_every)
+        self.detection_scale = detection_scale
+        self.track_scale = track_scale
+        self.last_used = time.monotonic()
+        self.frames = 0
+        self.detections = 0
+        self._trackers = []
+        self._since_detection = 0
+        self._lock = threading.Lock()
+
+    def process(self, image_data: bytes) -> List[Box]:
+        """
+        Face locations (top, right, bottom, left) for one encoded frame
+
+        Detection frames go through detect_faces, and so through the
+        inference pool when one is configured.
+        """
+        # Decode no larger than the trackers need, unless FACE_DECODE_SCALE_OVERLAY asks for more
+        try:
+            img, factor = decode_image(image_data, min(1.0, max(self.track_scale, OVERLAY_DECODE_SCALE)))
+        except ValueError:
+            return []
+        return self.process_frame(img, lambda: detect_faces(image_data, self.detection_scale, draw=False)[1], factor)
+
+    def process_frame(self, img: np.ndarray, detect=None, factor: int = 1) -> List[Box]:
+        """
+        Face locations for one decoded BGR frame
+
+        Args:
+            img: BGR frame
+            detect: Optional callable returning the face locations for this
+                frame; defaults to locate_faces on ``img``
+            factor: ``img`` was decoded at 1/factor of the original size;
+                boxes are in original coordinates either way
+        """
+        with self._lock:
+            self.last_used = time.monotonic()
+            self.frames += 1
+
+            resize = self.track_scale * factor
+            small = img if resize >= 1.0 else cv2.resize(img, (0, 0), fx=resize, fy=resize, interpolation=cv2.INTER_AREA)
+            shape = (img.shape[0] * factor, img.shape[1] * factor)
+
+            if self._trackers and self._since_detection < self.detect_every:
+                boxes = self._track(small, shape)
+                if boxes is not None:
+                    self._since_detection += 1
+                    return boxes
+
+            if detect is None:
+                boxes = locate_faces(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), min(1.0, self.detection_scale * factor))
+                boxes = [tuple(value * factor for value in box) for box in boxes]
+            else:
+                boxes = detect()
+            return self._start_tracking(small, boxes)
+
+    def _start_tracking(self, small: np.ndarray, boxes: List[Box]) -> List[Box]:
+        self.detections += 1
+        self._since_detection = 0
+
+        self._trackers = []
+        for top, right, bottom, left in boxes:
+            tracker = _create_tracker()
+            if tracker is None:
+                break
+            s = self.track_scale
+            tracker.init(small, (int(left * s), int(top * s), max(1, int((right - left) * s)), max(1, int((bottom - top) * s))))
+            self._trackers.append(tracker)
+        return boxes
+
+    def _track(self, small: np.ndarray, shape) -> Optional[List[Box]]:
+        """Advance every tracker; None if any of them lost its face"""
+        height, width = shape[:2]
+        boxes = []
+        for tracker in self._trackers:
+            ok, (x, y, w, h) = tracker.update(small)
+            if not ok or w <= 0 or h <= 0:
+                return None
+            left, top = x / self.track_scale, y / self.track_scale
+            right, bottom = (x + w) / self.track_scale, (y + h) / self.track_scale
+            # A box that has slid out of the frame is not worth trusting
+            if right <= 0 or bottom <= 0 or left >= width or top >= height:
+                return None
+            boxes.append((max(0, int(top)), min(width, int(right)), min(height, int(bottom)), max(0, int(left))))
+        return boxes
+
+
+class TrackingSessions:
+    """Per-client FaceTrackingSession registry with idle eviction"""
+
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT, max_sessions: int = MAX_SESSIONS):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, FaceTrackingSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, client_id: str) -> FaceTrackingSession:
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(client_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    # Make room by dropping the least recently used client
+                    oldest = min(self._sessions, key=lambda key: self._sessions[key].last_used)
+                    del self._sessions[oldest]
+                session = self._sessions[client_id] = FaceTrackingSession()
+            return session
+
+    def discard(self, client_id: str):
+        with self._lock:
+            self._sessions.pop(client_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for client_id in [key for key, session in self._sessions.items() if session.last_used < cutoff]:
+            del self._sessions[client_id]
+
+
+tracking_sessions = TrackingSessions()
@@ -0,0 +1,91 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Frames kept per worker for a follow-up mark/register call, and for how long
+FRAME_CACHE_SIZE = int(os.environ.get("FACE_FRAME_CACHE_SIZE", "256"))
+FRAME_CACHE_TTL = float(os.environ.get("FACE_FRAME_CACHE_TTL", "10"))
+
+Box = Tuple[int, int, int, int]  # top, right, bottom, left
+
+
+class CachedFrame(NamedTuple):
+    image_data: bytes
+    # Face locations found by detection, in original-frame coordinates
+    face_locations: List[Box]
+    expires_at: float
+
+
+class FrameCache:
+    """
+    Recently detected frames, keyed by an unguessable handle
+
+    /api/detect-faces stores the frame it was sent and the faces it found;
+    a mark or register call on the same frame passes the handle instead of
+    the image and skips full-frame detection: only the regions around the
+    stored boxes are searched again before encoding. The encoded frame is kept
+    rather than the decoded one: detection may have run in an inference
+    worker, or on a reduced decode, and a JPEG is a fraction of the size.
+
+    Bounded to ``max_size`` entries, least recently used first out, and
+    each entry expires ``ttl`` seconds after it was stored. Process-local:
+    a handle is only known to the worker that issued it.
+    """
+
+    def __init__(self, max_size: int = FRAME_CACHE_SIZE, ttl: float = FRAME_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._frames: "OrderedDict[str, CachedFrame]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def put(self, image_data: bytes, face_locations: List[Box]) -> Optional[str]:
+        """Store a frame and return its handle; None when the cache is disabled"""
+        if self.max_size <= 0 or self.ttl <= 0:
+            return None
+        handle = secrets.token_urlsafe(16)
+        frame = CachedFrame(bytes(image_data), [tuple(location) for location in face_locations],
+                            time.monotonic() + self.ttl)
+        with self._lock:
+            self._frames[handle] = frame
+            while len(self._frames) > self.max_size:
+                self._frames.popitem(last=False)
+        return handle
+
+    def get(self, handle: str) -> Optional[CachedFrame]:
+        """The frame behind ``handle``, None if unknown or expired"""
+        with self._lock:
+            frame = self._frames.get(handle)
+            if frame is not None and frame.expires_at <= time.monotonic():
+                del self._frames[handle]
+                frame = None
+            if frame is None:
+                self._misses += 1
+                return None
+            self._frames.move_to_end(handle)
+            self._hits += 1
+            return frame
+
+    def discard(self, handle: Optional[str]):
+        """Drop a frame that will no longer be asked for"""
+        if handle is None:
+            return
+        with self._lock:
+            self._frames.pop(handle, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._frames),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,142 @@
+"""
+Cheap quality gate run before face landmarks and encoding.
+
+Kiosks send many frames that can never match: motion-blurred, too dark or
+washed out, or with the face too far from the camera. Exposure and
+sharpness are measured on a small grayscale copy of the decoded frame,
+before detection; face size and count are checked on the detected boxes,
+before landmarks and encoding. A frame that fails raises FrameRejected
+with a machine-readable reason the client can turn into a prompt.
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# FACE_QUALITY_GATE=0 encodes every frame, as before the gate existed
+QUALITY_GATE_ENABLED = os.environ.get("FACE_QUALITY_GATE", "1") == "1"
+# Width of the grayscale copy exposure and sharpness are measured on, so
+# that the blur score does not depend on the camera resolution
+SAMPLE_WIDTH = int(os.environ.get("FACE_QUALITY_SAMPLE_WIDTH", "160"))
+# Variance of the Laplacian of that copy; motion blur and defocus lower it
+MIN_SHARPNESS = float(os.environ.get("FACE_QUALITY_MIN_SHARPNESS", "30"))
+# Mean gray level, 0-255
+MIN_BRIGHTNESS = float(os.environ.get("FACE_QUALITY_MIN_BRIGHTNESS", "40"))
+MAX_BRIGHTNESS = float(os.environ.get("FACE_QUALITY_MAX_BRIGHTNESS", "220"))
+# Smallest face height as a fraction of the frame height; smaller faces are
+# ignored, and a frame with no face that size is rejected
+MIN_FACE_FRACTION = float(os.environ.get("FACE_QUALITY_MIN_FACE", "0.1"))
+# Faces of that size allowed in a single-face frame (mark, register)
+MAX_FACES = int(os.environ.get("FACE_QUALITY_MAX_FACES", "1"))
+
+# Rejection reasons
+TOO_DARK = "too_dark"
+TOO_BRIGHT = "too_bright"
+TOO_BLURRY = "too_blurry"
+FACE_TOO_SMALL = "face_too_small"
+TOO_MANY_FACES = "too_many_faces"
+
+Box = Tuple[int, int, int, int]  # top, right, bottom, left
+
+
+class FrameRejected(Exception):
+    """The frame failed the quality gate; maps to 422 with ``reason``"""
+
+    def __init__(self, reason: str, message: str, value: Optional[float] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.value = value
+
+    def __reduce__(self):
+        # Raised in inference pool workers; keep the reason across the pickle
+        return FrameRejected, (self.reason, str(self), self.value)
+
+    def as_json(self) -> Dict:
+        return {"success": False, "reason": self.reason, "message": str(self)}
+
+
+def check_frame(img: np.ndarray):
+    """
+    Reject a frame that is too dark, too bright or too blurry
+
+    Args:
+        img: Decoded BGR frame, at any decode scale
+
+    Raises:
+        FrameRejected: TOO_DARK, TOO_BRIGHT or TOO_BLURRY
+    """
+    if not QUALITY_GATE_ENABLED:
+        return
+    height, width = img.shape[:2]
+    if width > SAMPLE_WIDTH:
+        img = cv2.resize(img, (SAMPLE_WIDTH, max(1, round(height * SAMPLE_WIDTH / width))), interpolation=cv2.INTER_AREA)
+    sample = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    brightness = float(sample.mean())
+    if brightness < MIN_BRIGHTNESS:
+        raise FrameRejected(TOO_DARK, "Image is too dark, move to better light", brightness)
+    if brightness > MAX_BRIGHTNESS:
+        raise FrameRejected(TOO_BRIGHT, "Image is overexposed, avoid bright light behind or on the camera", brightness)
+
+    sharpness = float(cv2.Laplacian(sample, cv2.CV_64F).var())
+    if sharpness < MIN_SHARPNESS:
+        raise FrameRejected(TOO_BLURRY, "Image is blurry, hold still and try again", sharpness)
+
+
+def select_faces(face_locations: List[Box], frame_height: int, max_faces: Optional[int] = None) -> List[Box]:
+    """
+    The faces large enough to encode, largest first
+
+    Args:
+        face_locations: Detected faces, in the coordinates of a frame
+            ``frame_height`` pixels high
+        max_faces: Reject frames with more faces than this; None for group frames
+
+    Raises:
+        FrameRejected: FACE_TOO_SMALL if faces were found but none is large
+            enough, TOO_MANY_FACES if more than ``max_faces`` are
+    """
+    if not QUALITY_GATE_ENABLED or not face_locations:
+        return face_locations
+    min_height = MIN_FACE_FRACTION * frame_height
+    faces = sorted(
+        (location for location in face_locations if location[2] - location[0] >= min_height),
+        key=lambda location: location[0] - location[2],
+    )
+    if not faces:
+        raise FrameRejected(FACE_TOO_SMALL, "Face is too far away, move closer to the camera",
+                            max(location[2] - location[0] for location in face_locations) / frame_height)
+    if max_faces is not None and len(faces) > max_faces:
+        raise FrameRejected(TOO_MANY_FACES, "More than one face in view, one person at a time", len(faces))
+    return faces
+
+
+class QualityStats:
+    """Frames accepted and rejected by the gate in this process; thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._accepted = 0
+        self._rejected: Dict[str, int] = {}
+
+    def record(self, reason: Optional[str] = None):
+        """Count one frame: accepted when ``reason`` is None"""
+        with self._lock:
+            if reason is None:
+                self._accepted += 1
+            else:
+                self._rejected[reason] = self._rejected.get(reason, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": QUALITY_GATE_ENABLED,
+                "accepted": self._accepted,
+                "rejected": sum(self._rejected.values()),
+                "rejected_by_reason": dict(self._rejected),
+            }
+
+
+quality_stats = QualityStats()
@@ -0,0 +1,137 @@
+import json
+import logging
+import struct
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from services.frame_cache import frame_cache
+
+logger = logging.getLogger(__name__)
+
+# Binary frame message: 4-byte big-endian sequence number followed by the JPEG
+SEQ_HEADER = struct.Struct(">I")
+
+# Close the stream if the client sends nothing for this many seconds
+IDLE_TIMEOUT = 30.0
+
+
+def parse_frame_message(message: bytes) -> Tuple[int, bytes]:
+    """Split a binary frame message into its sequence number and image bytes"""
+    if len(message) <= SEQ_HEADER.size:
+        raise ValueError("Frame message too short")
+    (seq,) = SEQ_HEADER.unpack_from(message)
+    return seq, message[SEQ_HEADER.size:]
+
+
+class LatestFrame:
+    """
+    Single-slot mailbox between the socket reader and the detector
+
+    A new frame replaces any frame that has not been picked up yet, so the
+    detector always works on the most recent frame and never builds a
+    backlog.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame: Optional[Tuple[int, bytes]] = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame: Tuple[int, bytes]):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._cond.notify()
+
+    def take(self, timeout: Optional[float] = None) -> Optional[Tuple[int, bytes]]:
+        """Wait for the next frame; None on close or timeout"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self.closed, timeout)
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def serve_detection_stream(ws, detect: Callable[[bytes], List[Tuple[int, int, int, int]]]):
+    """
+    Run a face-detection stream over an open WebSocket
+
+    The client sends binary frame messages and waits for an acknowledgement
+    before sending the next one, so at most one frame is in flight. A reader
+    thread still drops stale frames if a client sends faster than that.
+    Each processed frame is answered with a JSON text message:
+    ``{"seq": n, "faces": [[top, right, bottom, left], ...], "dropped": d}``,
+    plus ``"retry_after"`` seconds when the server is too busy to detect.
+    A frame with faces also gets a ``"frame_handle"`` (see
+    services/frame_cache.py), so the kiosk can mark or register that frame
+    without it being decoded and detected again. Only the stream's two
+    latest handles are kept: one for the frame on screen and one for a
+    mark that may still be on its way.
+
+    Args:
+        ws: WebSocket with blocking ``receive(timeout)``, ``send`` and ``close``
+        detect: Function returning face locations for an encoded image
+    """
+    mailbox = LatestFrame()
+
+    def read_frames():
+        try:
+            while True:
+                message = ws.receive(timeout=IDLE_TIMEOUT)
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    # Text messages are reserved for control, nothing to do yet
+                    continue
+                try:
+                    mailbox.put(parse_frame_message(message))
+                except ValueError as e:
+                    logger.warning(f"Ignoring bad frame message: {str(e)}")
+        except Exception as e:
+            logger.debug(f"Detection stream reader stopped: {str(e)}")
+        finally:
+            mailbox.close()
+
+    reader = threading.Thread(target=read_frames, name="detect-stream-reader", daemon=True)
+    reader.start()
+
+    handles: List[str] = []
+
+    try:
+        while True:
+            frame = mailbox.take(timeout=IDLE_TIMEOUT)
+            if frame is None:
+                break
+            seq, image_data = frame
+            ack = {"seq": seq, "faces": [], "dropped": mailbox.dropped}
+            try:
+                faces = detect(image_data)
+                ack["faces"] = [list(location) for location in faces]
+                handle = frame_cache.put(image_data, faces) if faces else None
+                if handle is not None:
+                    ack["frame_handle"] = handle
+                    handles.append(handle)
+                    if len(handles) > 2:
+                        frame_cache.discard(handles.pop(0))
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None:
+                    # Overloaded: tell the client to hold off before the next frame
+                    ack["retry_after"] = retry_after
+                else:
+                    logger.error(f"Error detecting faces: {str(e)}")
+            ws.send(json.dumps(ack))
+    except Exception as e:
+        logger.debug(f"Detection stream closed: {str(e)}")
+    finally:
+        mailbox.close()
+        try:
+            ws.close()
+        except Exception:
+            pass
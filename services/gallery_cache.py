@@ -0,0 +1,208 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from services.ann_index import IVFIndex
+from services.face_gallery import FaceGallery
+from services.metrics import GALLERY_SIZE
+
+logger = logging.getLogger(__name__)
+
+GALLERY_STATE_ID = 1
+
+# Minimum seconds between version checks; 0 checks on every request
+VERSION_CHECK_INTERVAL = float(os.environ.get("GALLERY_VERSION_CHECK_INTERVAL", "0"))
+
+# gallery_changes rows are kept for this many versions; a worker further
+# behind than half of it reloads the whole gallery instead
+CHANGE_RETENTION = int(os.environ.get("GALLERY_CHANGE_RETENTION", "1000"))
+# Prune gallery_changes on every this many bumps
+PRUNE_EVERY = 100
+
+# Approximate nearest-neighbour search for very large galleries (off by default)
+ANN_ENABLED = os.environ.get("FACE_ANN_ENABLED", "0") == "1"
+ANN_MIN_GALLERY = int(os.environ.get("FACE_ANN_MIN_GALLERY", "20000"))
+ANN_LISTS = int(os.environ.get("FACE_ANN_LISTS", "0"))  # 0 picks sqrt(N)
+ANN_NPROBE = int(os.environ.get("FACE_ANN_NPROBE", "8"))
+
+
+def seed_version_row(session, model, row_id: int):
+    """
+    Insert the version row of ``model`` if it is missing, e.g. in a table
+    created before rows were seeded with it; run once at startup
+    """
+    if session.get(model, row_id) is not None:
+        return
+    try:
+        session.add(model(id=row_id, version=0))
+        session.commit()
+    except IntegrityError:
+        # Another worker seeded it first
+        session.rollback()
+
+
+def seed_gallery_state(session):
+    seed_version_row(session, models.GalleryState, GALLERY_STATE_ID)
+
+
+def bump_gallery_version(session, student_ids: Iterable[int]) -> int:
+    """
+    Record an enrolment mutation in the caller's transaction
+
+    Must be called before the commit of any change that adds, replaces or
+    removes a face encoding. The ``UPDATE`` takes a row lock on the single
+    gallery_state row, so concurrent mutations commit in version order and
+    a worker that has seen version N has seen every change up to N.
+
+    Returns:
+        The new gallery version
+
+    Raises:
+        RuntimeError: The gallery_state row was never seeded
+    """
+    result = session.execute(
+        update(models.GalleryState)
+        .where(models.GalleryState.id == GALLERY_STATE_ID)
+        .values(version=models.GalleryState.version + 1)
+    )
+    if result.rowcount == 0:
+        raise RuntimeError("gallery_state has no version row; start the app once to seed it")
+
+    version = session.execute(
+        select(models.GalleryState.version).where(models.GalleryState.id == GALLERY_STATE_ID)
+    ).scalar_one()
+    session.add_all(models.GalleryChange(version=version, student_id=student_id) for student_id in student_ids)
+    if version % PRUNE_EVERY == 0:
+        session.query(models.GalleryChange).filter(
+            models.GalleryChange.version <= version - CHANGE_RETENTION
+        ).delete(synchronize_session=False)
+    return version
+
+
+def encoding_rows(session, student_ids: Optional[List[int]] = None):
+    """
+    (student_id, encoding) rows for the gallery: each student's primary
+    face_encoding followed by their additional templates
+    """
+    students = session.query(models.Student.id, models.Student.face_encoding).filter(
+        models.Student.face_encoding.isnot(None)
+    )
+    templates = session.query(models.FaceTemplate.student_id, models.FaceTemplate.encoding)
+    if student_ids is not None:
+        students = students.filter(models.Student.id.in_(student_ids))
+        templates = templates.filter(models.FaceTemplate.student_id.in_(student_ids))
+    return itertools.chain(students, templates)
+
+
+def current_gallery_version(session) -> int:
+    """Read the committed gallery version (a primary-key lookup)"""
+    version = session.execute(
+        select(models.GalleryState.version).where(models.GalleryState.id == GALLERY_STATE_ID)
+    ).scalar()
+    return version or 0
+
+
+class GalleryCache:
+    """
+    Process-local FaceGallery kept in step with the database
+
+    Each worker loads the full gallery once, then on every ``get`` compares
+    its version with gallery_state and reloads only the students recorded
+    in gallery_changes since then, or everything if it is more than
+    CHANGE_RETENTION / 2 versions behind. Galleries are immutable snapshots, so a
+    request keeps using the one it got even if a refresh swaps in another.
+    """
+
+    def __init__(self, check_interval: float = VERSION_CHECK_INTERVAL, use_ann: bool = ANN_ENABLED):
+        self.check_interval = check_interval
+        self.use_ann = use_ann
+        self._lock = threading.Lock()
+        self._gallery = FaceGallery()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._version
+
+    def warm(self, session) -> FaceGallery:
+        """Load the whole gallery, e.g. at worker startup"""
+        with self._lock:
+            self._full_load(session, current_gallery_version(session))
+            return self._gallery
+
+    def get(self, session) -> FaceGallery:
+        """Return the current gallery, refreshing it if another worker changed it"""
+        if self._version is not None and self.check_interval > 0:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return self._gallery
+
+        version = current_gallery_version(session)
+        self._checked_at = time.monotonic()
+        if version == self._version:
+            return self._gallery
+
+        with self._lock:
+            if self._version is None or version - self._version > CHANGE_RETENTION // 2:
+                # Too far behind: the changes it missed may have been pruned
+                self._full_load(session, version)
+            elif version != self._version:
+                self._incremental_load(session, version)
+            return self._gallery
+
+    def invalidate(self):
+        """Force a full reload on the next ``get``"""
+        with self._lock:
+            self._version = None
+
+    def _full_load(self, session, version: int):
+        self._gallery = FaceGallery.from_rows(encoding_rows(session))
+        self._version = version
+        self._build_index()
+        GALLERY_SIZE.set(len(self._gallery))
+        logger.info(f"Loaded face gallery v{version} with {len(self._gallery)} students, "
+                    f"{len(self._gallery.templates)} with several templates")
+
+    def _incremental_load(self, session, version: int):
+        changed_ids = [
+            row[0] for row in session.query(models.GalleryChange.student_id)
+            .filter(
+                models.GalleryChange.version > self._version,
+                models.GalleryChange.version <= version,
+            )
+            .distinct()
+        ]
+        rows = list(encoding_rows(session, changed_ids)) if changed_ids else []
+        index = self._gallery.index
+        self._gallery = self._gallery.updated(changed_ids, rows)
+        if index is not None and len(self._gallery) <= 2 * index.trained_size:
+            # Keep the trained partitions and apply the change to a copy of
+            # them; older snapshots still search the original
+            index = index.copy()
+            index.remove(changed_ids)
+            fresh = FaceGallery.from_rows(rows)
+            index.add(fresh.ids, fresh.encodings)
+            self._gallery.index = index
+        else:
+            # First time over the threshold, or grown enough to retrain
+            self._build_index()
+        GALLERY_SIZE.set(len(self._gallery))
+        logger.debug(f"Refreshed face gallery v{self._version} -> v{version}, {len(changed_ids)} students changed")
+        self._version = version
+
+    def _build_index(self):
+        if not self.use_ann or len(self._gallery) < ANN_MIN_GALLERY:
+            return
+        self._gallery.index = IVFIndex.build(
+            self._gallery.ids, self._gallery.encodings, n_lists=ANN_LISTS, nprobe=ANN_NPROBE
+        )
+
+
+gallery_cache = GalleryCache()
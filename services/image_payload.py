@@ -0,0 +1,92 @@
+import base64
+import os
+from typing import List, Mapping, NamedTuple, Optional, Tuple
+
+from services.frame_cache import frame_cache
+
+# Largest image accepted in a request body
+MAX_IMAGE_BYTES = int(os.environ.get("FACE_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+
+# Raw bodies accepted as an image, besides any image/* type
+RAW_CONTENT_TYPES = ("application/octet-stream",)
+
+# Multipart field holding the image
+IMAGE_FIELD = "image"
+
+# Field (JSON, form or query string) naming a frame returned by /api/detect-faces
+FRAME_HANDLE_FIELD = "frame_handle"
+
+
+class ImagePayloadError(ValueError):
+    """The request carries no usable image; maps to 400 (413 when too large, 410 for an expired frame handle)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ImagePayload(NamedTuple):
+    image_data: bytes
+    # Other request fields: the JSON object, the multipart form fields, or
+    # the query parameters of a raw upload
+    fields: Mapping
+    # Face locations already found in this frame, when it came from a frame handle
+    face_locations: Optional[List[Tuple[int, int, int, int]]] = None
+
+
+def media_type(content_type: Optional[str]) -> str:
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def is_raw_image(content_type: Optional[str]) -> bool:
+    kind = media_type(content_type)
+    return kind.startswith("image/") or kind in RAW_CONTENT_TYPES
+
+
+def is_multipart(content_type: Optional[str]) -> bool:
+    return media_type(content_type) == "multipart/form-data"
+
+
+def decode_data_uri(image_data: Optional[str]) -> bytes:
+    """
+    Bytes of a base64 ``data:`` URI as built by ``canvas.toDataURL``, or of
+    bare base64
+
+    Raises:
+        ImagePayloadError: Missing or malformed image
+    """
+    if not image_data:
+        raise ImagePayloadError("No image in request")
+    _, comma, encoded = image_data.partition(",")
+    try:
+        return base64.b64decode(encoded if comma else image_data)
+    except ValueError:
+        raise ImagePayloadError("image_data is not valid base64")
+
+
+def checked(image_data: bytes) -> bytes:
+    """``image_data`` if it is a plausible upload"""
+    if not image_data:
+        raise ImagePayloadError("No image in request")
+    if len(image_data) > MAX_IMAGE_BYTES:
+        raise ImagePayloadError(f"Image larger than {MAX_IMAGE_BYTES} bytes", status_code=413)
+    return image_data
+
+
+def resolve_payload(image_data: Optional[bytes], fields: Mapping, frame_handle: Optional[str] = None) -> ImagePayload:
+    """
+    The request's image, or the cached frame behind ``frame_handle``
+
+    A known handle wins over an image sent alongside it; an unknown or
+    expired one falls back to that image.
+
+    Raises:
+        ImagePayloadError: No image, and no usable handle (410 if the handle expired)
+    """
+    if frame_handle:
+        frame = frame_cache.get(frame_handle)
+        if frame is not None:
+            return ImagePayload(frame.image_data, fields, frame.face_locations)
+        if not image_data:
+            raise ImagePayloadError("Frame handle is unknown or expired, send the image again", status_code=410)
+    return ImagePayload(checked(image_data), fields)
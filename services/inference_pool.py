@@ -0,0 +1,185 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for face detection/encoding; 0 runs inference inline. Unset,
+# the machine's cores are shared among the web server's workers
+POOL_SIZE_SETTING = os.environ.get("FACE_INFERENCE_WORKERS")
+# Requests allowed to wait for a free worker before new ones are rejected;
+# unset, twice the pool size
+QUEUE_SIZE_SETTING = os.environ.get("FACE_INFERENCE_QUEUE")
+# Seconds a rejected client is told to wait before retrying
+RETRY_AFTER = int(os.environ.get("FACE_INFERENCE_RETRY_AFTER", "1"))
+
+
+def default_pool_size(web_workers: Optional[int] = None) -> int:
+    """
+    FACE_INFERENCE_WORKERS, or the CPU count divided among ``web_workers``
+    (WEB_CONCURRENCY if not given), since every web worker starts a pool
+    """
+    if POOL_SIZE_SETTING is not None:
+        return int(POOL_SIZE_SETTING)
+    if not web_workers:
+        from services.startup import configured_web_workers
+        web_workers = configured_web_workers()
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+def default_queue_size(workers: int) -> int:
+    return int(QUEUE_SIZE_SETTING) if QUEUE_SIZE_SETTING is not None else 2 * max(workers, 1)
+
+
+POOL_SIZE = default_pool_size()
+QUEUE_SIZE = default_queue_size(POOL_SIZE)
+
+
+class InferenceOverloaded(Exception):
+    """Raised when the inference queue is full; maps to 503 + Retry-After"""
+
+    def __init__(self, retry_after: int = RETRY_AFTER):
+        super().__init__("Face recognition is busy, please retry shortly")
+        self.retry_after = retry_after
+
+
+def _init_worker():
+    # Importing face_recognition loads the dlib detector, landmark and
+    # encoder models; do it once per worker rather than on the first task.
+    import face_recognition  # noqa: F401
+
+
+def _timed_call(fn: Callable, args, kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class InferencePool:
+    """
+    Process pool for CPU-bound dlib work with a bounded submission queue
+
+    At most ``workers + queue_size`` tasks are accepted at once; beyond that
+    ``submit`` raises InferenceOverloaded immediately instead of letting
+    requests pile up behind a saturated pool.
+    """
+
+    def __init__(self, workers: int = POOL_SIZE, queue_size: int = QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run ``fn(*args, **kwargs)`` in a worker process
+
+        ``fn`` and its arguments must be picklable, i.e. module-level
+        functions and plain data.
+
+        Raises:
+            InferenceOverloaded: The queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise InferenceOverloaded()
+
+        with self._lock:
+            self._in_flight += 1
+            self._submitted += 1
+
+        result = Future()
+        try:
+            inner = self._executor.submit(_timed_call, fn, args, kwargs)
+        except Exception:
+            self._finish(0.0, failed=True)
+            raise
+
+        def done(inner_future: Future):
+            try:
+                value, elapsed = inner_future.result()
+            except BaseException as e:
+                self._finish(0.0, failed=True)
+                result.set_exception(e)
+            else:
+                self._finish(elapsed)
+                result.set_result(value)
+
+        inner.add_done_callback(done)
+        return result
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Submit and wait for the result"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _finish(self, elapsed: float, failed: bool = False):
+        with self._lock:
+            self._in_flight -= 1
+            self._busy_seconds += elapsed
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+        self._slots.release()
+
+    def stats(self) -> Dict:
+        """Queue depth and worker utilisation"""
+        with self._lock:
+            uptime = time.monotonic() - self._started_at
+            busy_workers = min(self._in_flight, self.workers)
+            return {
+                "enabled": True,
+                "workers": self.workers,
+                "queue_capacity": self.queue_size,
+                "in_flight": self._in_flight,
+                "queue_depth": self._in_flight - busy_workers,
+                "busy_workers": busy_workers,
+                "utilisation": self._busy_seconds / (self.workers * uptime) if uptime > 0 else 0.0,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_inference_pool(workers: Optional[int] = None, queue_size: Optional[int] = None,
+                          web_workers: Optional[int] = None) -> Optional[InferencePool]:
+    """
+    Pool configured from the environment, or None to run inference inline
+
+    Args:
+        workers: Pool processes, see default_pool_size
+        queue_size: Tasks that may wait, see default_queue_size
+        web_workers: Worker processes of the web server, each with a pool
+    """
+    if workers is None:
+        workers = default_pool_size(web_workers)
+    if queue_size is None:
+        queue_size = default_queue_size(workers)
+    if workers <= 0:
+        return None
+    if multiprocessing.parent_process() is not None:
+        # Already inside a pool worker (spawn re-imports the main module)
+        return None
+    logger.info(f"Starting face inference pool with {workers} workers, queue size {queue_size}")
+    return InferencePool(workers, queue_size)
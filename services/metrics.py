@@ -0,0 +1,264 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Per-stage timings, Server-Timing headers and /metrics (off by default)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DISTANCE_BUCKETS = (0.2, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.8, 1.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Prometheus histogram with a fixed label set; thread-safe"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labelvalues: list(values) for labelvalues, values in self._series.items()}
+        for labelvalues, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, collect: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> List[str]:
+        value = self.collect() if self.collect is not None else self.value
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+REQUEST_SECONDS = Histogram(
+    "attendance_request_duration_seconds", "Request latency by endpoint", LATENCY_BUCKETS, ("endpoint",)
+)
+STAGE_SECONDS = Histogram(
+    "attendance_stage_duration_seconds", "Time spent in each processing stage of a request", LATENCY_BUCKETS, ("stage",)
+)
+DB_QUERIES = Histogram(
+    "attendance_db_queries_per_request", "SQL statements executed per request", QUERY_BUCKETS, ("endpoint",)
+)
+MATCH_DISTANCE = Histogram(
+    "face_match_distance", "Distance from each probe to its nearest gallery student", DISTANCE_BUCKETS
+)
+GALLERY_SIZE = Gauge("face_gallery_students", "Students in this worker's face gallery")
+
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, DB_QUERIES, MATCH_DISTANCE, GALLERY_SIZE]
+
+
+class RequestTimings:
+    """Stage durations and SQL statement count of one request"""
+
+    __slots__ = ("started", "stages", "queries", "query_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        """Value of a Server-Timing header, durations in ms"""
+        entries = [f"{stage};dur={seconds * 1000.0:.1f}" for stage, seconds in self.stages.items()]
+        if self.queries:
+            entries.append(f'db;desc="{self.queries} queries";dur={self.query_seconds * 1000.0:.1f}')
+        entries.append(f"total;dur={total * 1000.0:.1f}")
+        return ", ".join(entries)
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+class _Stage:
+    __slots__ = ("name", "timings", "started")
+
+    def __init__(self, name: str, timings: RequestTimings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """
+    Context manager timing one stage of the current request
+
+    Outside a request, or with METRICS_ENABLED off, returns a shared no-op
+    context manager, so instrumented code pays one function call.
+    """
+    if not METRICS_ENABLED:
+        return _NO_STAGE
+    timings = _current.get()
+    if timings is None:
+        return _NO_STAGE
+    return _Stage(name, timings)
+
+
+def observe_match_distance(distance: Optional[float]):
+    if METRICS_ENABLED and distance is not None:
+        MATCH_DISTANCE.observe(distance)
+
+
+def begin_request() -> Optional[contextvars.Token]:
+    """Start collecting timings for the request handled in this context"""
+    if not METRICS_ENABLED:
+        return None
+    return _current.set(RequestTimings())
+
+
+def end_request(token: Optional[contextvars.Token], endpoint: str) -> Optional[str]:
+    """
+    Record the request's metrics and stop collecting
+
+    Returns:
+        The Server-Timing header value, None when metrics are disabled
+    """
+    if token is None:
+        return None
+    timings = _current.get()
+    _current.reset(token)
+    total = time.perf_counter() - timings.started
+    REQUEST_SECONDS.observe(total, endpoint)
+    DB_QUERIES.observe(timings.queries, endpoint)
+    for name, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, name)
+    if timings.queries:
+        STAGE_SECONDS.observe(timings.query_seconds, "db")
+    return timings.server_timing(total)
+
+
+def current_server_timing() -> Optional[str]:
+    """
+    Server-Timing value of the request so far, for servers that send the
+    headers before the handler's context ends (the ASGI middleware)
+    """
+    timings = _current.get()
+    if timings is None:
+        return None
+    return timings.server_timing(time.perf_counter() - timings.started)
+
+
+def _run_collecting(fn: Callable, args, kwargs):
+    """Worker-side half of call_collecting(): run ``fn`` with a fresh collector"""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _current.reset(token)
+    return result, timings.stages, time.perf_counter() - timings.started
+
+
+def call_collecting(call: Callable, fn: Callable, *args, **kwargs):
+    """
+    ``call(fn, *args, **kwargs)`` where ``call`` runs ``fn`` elsewhere (e.g.
+    InferencePool.call in a worker process), bringing the stage timings
+    recorded there back into the current request, plus the time spent
+    waiting for a worker as "inference_wait"
+    """
+    timings = _current.get() if METRICS_ENABLED else None
+    if timings is None:
+        return call(fn, *args, **kwargs)
+    started = time.perf_counter()
+    result, stages, worker_seconds = call(_run_collecting, fn, args, kwargs)
+    for name, seconds in stages.items():
+        timings.add(name, seconds)
+    timings.add("inference_wait", max(0.0, time.perf_counter() - started - worker_seconds))
+    return result
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    if timings is not None:
+        timings.queries += 1
+        started = getattr(context, "_metrics_started", None)
+        if started is not None:
+            timings.query_seconds += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    """Count and time the SQL statements of each request; no listener is added when disabled"""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
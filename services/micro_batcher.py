@@ -0,0 +1,182 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.face_gallery import FaceGallery, GalleryMatch
+from services.face_recognition_service import RECOGNITION_DETECTION_SCALE, encode_face_batch_async, get_inference_pool
+from services.frame_quality import FrameRejected
+
+logger = logging.getLogger(__name__)
+
+# Opt-in batching of concurrent recognition requests
+ENABLED = os.environ.get("FACE_MICROBATCH_ENABLED", "0") == "1"
+# Longest a request waits for others to join its batch
+MAX_WAIT_MS = float(os.environ.get("FACE_MICROBATCH_WAIT_MS", "5"))
+MAX_BATCH = int(os.environ.get("FACE_MICROBATCH_MAX_SIZE", "8"))
+
+
+class _Request:
+    __slots__ = ("image_data", "gallery", "tolerance", "future", "enqueued_at")
+
+    def __init__(self, image_data: bytes, gallery: FaceGallery, tolerance: float):
+        self.image_data = image_data
+        self.gallery = gallery
+        self.tolerance = tolerance
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class RecognitionBatcher:
+    """
+    Collects recognition requests from concurrent threads into batches
+
+    A background thread takes the first waiting request, then keeps
+    collecting for up to ``max_wait_ms`` or until ``max_batch`` requests are
+    in hand. The batch is submitted to the inference pool as one
+    encode_face_batch task and the thread goes back to collecting, with up
+    to one batch in flight per pool worker. When a batch's encodings come
+    back, its probes are matched with one FaceGallery.match_many per gallery
+    snapshot (or per roster-scoped gallery, which roster_cache shares
+    between the requests of one class session). Each caller gets back its
+    own (encoding, match).
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS,
+                 detection_scale: float = RECOGNITION_DETECTION_SCALE):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.detection_scale = detection_scale
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.concurrency: Optional[int] = None
+        # Batches in flight; sized to the inference pool when the thread starts
+        self._in_flight: Optional[threading.BoundedSemaphore] = None
+        # Matches finished batches off the pool's result thread
+        self._matcher: Optional[ThreadPoolExecutor] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Dict[int, int] = {}
+        self._batches = 0
+        self._requests = 0
+        self._wait_seconds = 0.0
+
+    def recognize(self, image_data: bytes, gallery: FaceGallery, tolerance: float = 0.6) -> Tuple[Optional[np.ndarray], Optional[GalleryMatch]]:
+        """
+        Encode and match one image as part of the next batch (blocking)
+
+        Returns:
+            (face encoding, match), or (None, None) if no face was found
+
+        Raises:
+            InferenceOverloaded: The inference pool rejected the batch
+            FrameRejected: This image failed the quality gate
+        """
+        self._ensure_started()
+        request = _Request(image_data, gallery, tolerance)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                pool = get_inference_pool()
+                concurrency = pool.workers if pool is not None else 1
+                if self._in_flight is None:
+                    self.concurrency = concurrency
+                    self._in_flight = threading.BoundedSemaphore(concurrency)
+                    self._matcher = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="recognition-matcher")
+                self._thread = threading.Thread(target=self._run, name="recognition-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Wait for a free worker, collecting no further batch meanwhile
+            self._in_flight.acquire()
+            self._record(batch, time.perf_counter())
+            try:
+                future = encode_face_batch_async([request.image_data for request in batch], self.detection_scale)
+            except Exception as e:
+                self._in_flight.release()
+                self._fail(batch, e)
+                continue
+            future.add_done_callback(lambda future, batch=batch: self._matcher.submit(self._finish, batch, future))
+
+    def _finish(self, batch: List[_Request], future: Future):
+        self._in_flight.release()
+        try:
+            self._match(batch, future.result())
+        except Exception as e:
+            self._fail(batch, e)
+
+    def _fail(self, batch: List[_Request], error: Exception):
+        for request in batch:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _match(self, batch: List[_Request], encodings: List[Optional[np.ndarray]]):
+        # Requests normally share one gallery snapshot; group them just in case
+        groups: Dict[Tuple[int, float], List[int]] = {}
+        for i, (request, encoding) in enumerate(zip(batch, encodings)):
+            if isinstance(encoding, FrameRejected):
+                request.future.set_exception(encoding)
+            elif encoding is None:
+                request.future.set_result((None, None))
+            else:
+                groups.setdefault((id(request.gallery), request.tolerance), []).append(i)
+
+        for members in groups.values():
+            first = batch[members[0]]
+            matches = first.gallery.match_many(
+                [encodings[i] for i in members], tolerance=first.tolerance, unique=False
+            )
+            for i, match in zip(members, matches):
+                batch[i].future.set_result((encodings[i], match))
+
+    def _record(self, batch: List[_Request], started: float):
+        with self._stats_lock:
+            size = len(batch)
+            self._batches += 1
+            self._requests += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._wait_seconds += sum(started - request.enqueued_at for request in batch)
+
+    def stats(self) -> Dict:
+        """Achieved batch sizes and queueing delay"""
+        with self._stats_lock:
+            return {
+                "enabled": True,
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "max_in_flight": self.concurrency,
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "mean_wait_ms": 1000.0 * self._wait_seconds / self._requests if self._requests else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "pending": self._queue.qsize(),
+            }
+
+
+recognition_batcher = RecognitionBatcher() if ENABLED else None
@@ -0,0 +1,179 @@
+import base64
+import binascii
+import json
+import logging
+from datetime import date, datetime
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Date, DateTime, and_, or_
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Rows fetched per round trip when streaming
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(order: str, values: Sequence) -> str:
+    """Opaque cursor holding the sort key of the last row of a page"""
+    payload = {
+        "o": order,
+        "k": [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values],
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, order: str, columns: Sequence) -> List:
+    """
+    Sort key stored in a cursor
+
+    Raises:
+        ValueError: Malformed cursor, or one issued for a different ordering
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = payload["k"]
+        cursor_order = payload["o"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+    if cursor_order != order or len(values) != len(columns):
+        raise ValueError("Cursor does not match the requested order")
+
+    key = []
+    for column, value in zip(columns, values):
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        key.append(value)
+    return key
+
+
+def parse_limit(limit) -> int:
+    """Page size from a request parameter, clamped to MAX_PAGE_SIZE"""
+    if limit in (None, ""):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _after(columns: Sequence, key: Sequence, descending: bool):
+    """Rows strictly after ``key`` in (columns...) order, without row-value syntax"""
+    clauses = []
+    for i, column in enumerate(columns):
+        ties = [columns[j] == key[j] for j in range(i)]
+        step = column < key[i] if descending else column > key[i]
+        clauses.append(and_(*ties, step))
+    return or_(*clauses)
+
+
+def sort_columns(order: str, allowed: Dict[str, Sequence]) -> Tuple[Sequence, bool]:
+    """
+    Sort columns for an ``order`` parameter such as ``"id"`` or ``"-check_in"``
+
+    A leading ``-`` sorts descending. ``allowed`` maps order names to their
+    columns, ending with a unique column.
+
+    Raises:
+        ValueError: Unknown order name
+    """
+    name = order.lstrip("-")
+    if name not in allowed:
+        raise ValueError(f"order must be one of: {', '.join(sorted(allowed))}")
+    return allowed[name], order.startswith("-")
+
+
+def keyset_page(query, order: str, columns: Sequence, cursor: Optional[str], limit: int,
+                descending: bool = False) -> Tuple[List, Optional[str]]:
+    """
+    One page of ``query`` in keyset order
+
+    Seeks past the cursor with a WHERE on the sort columns instead of an
+    OFFSET, so every page costs the same however deep it is. The last
+    column must be unique (normally the primary key).
+
+    Args:
+        query: Filtered query for one mapped entity, not yet ordered
+        order: Name of the ordering, stored in the cursor
+        columns: Sort columns (mapped attributes of that entity)
+        cursor: Cursor from the previous page, None for the first page
+        limit: Page size
+        descending: Largest first
+
+    Returns:
+        (rows, next cursor or None on the last page)
+    """
+    rows = _seek(query, order, columns, cursor, limit, descending).all()
+    return _page(rows, order, columns, limit)
+
+
+async def keyset_page_async(db, statement, order: str, columns: Sequence, cursor: Optional[str], limit: int,
+                            descending: bool = False) -> Tuple[List, Optional[str]]:
+    """keyset_page for an AsyncSession and a ``select()`` of one mapped entity"""
+    rows = (await db.scalars(_seek(statement, order, columns, cursor, limit, descending))).all()
+    return _page(rows, order, columns, limit)
+
+
+def _seek(query, order: str, columns: Sequence, cursor: Optional[str], limit: int, descending: bool):
+    """``query`` (a Query or a Select) past the cursor, ordered, one row over the page size"""
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, order, columns), descending))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    return query.limit(limit + 1)
+
+
+def _page(rows: List, order: str, columns: Sequence, limit: int) -> Tuple[List, Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(order, [getattr(rows[-1], column.key) for column in columns])
+
+
+def stream_json_array(query, serialize: Callable, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[str]:
+    """
+    Yield a JSON array of ``serialize(row)`` in chunks
+
+    Rows are fetched ``batch_size`` at a time with yield_per, so memory use
+    does not grow with the size of the result.
+    """
+    yield "["
+    first = True
+    chunk = []
+    for row in query.yield_per(batch_size):
+        chunk.append(json.dumps(serialize(row), default=str))
+        if len(chunk) >= batch_size:
+            yield ("" if first else ",") + ",".join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ("" if first else ",") + ",".join(chunk)
+    yield "]"
+
+
+async def stream_json_array_async(statement, serialize: Callable,
+                                  batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[str]:
+    """
+    stream_json_array for the ASGI app, reading ``statement`` through a
+    server-side cursor
+
+    The generator opens a session of its own and closes it when it
+    finishes: FastAPI closes the request's session from get_async_db
+    before a streamed body is sent.
+    """
+    from database import AsyncSessionLocal, get_async_engine
+
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield "["
+        first = True
+        result = await db.stream_scalars(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield ("" if first else ",") + ",".join(json.dumps(serialize(row), default=str) for row in rows)
+            first = False
+        yield "]"
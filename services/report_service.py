@@ -0,0 +1,168 @@
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import and_
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Time zone that defines a "day" for reports and check-in/check-out pairing.
+# Timestamps are stored in UTC.
+REPORT_TIMEZONE = os.environ.get("ATTENDANCE_TIMEZONE", "UTC")
+
+# Longest range a single report may cover
+MAX_REPORT_DAYS = 366
+
+
+def get_timezone(tz_name: Optional[str] = None):
+    """
+    pytz time zone by name, defaulting to ATTENDANCE_TIMEZONE
+
+    Raises:
+        ValueError: Unknown time zone name
+    """
+    tz_name = tz_name or REPORT_TIMEZONE
+    try:
+        return pytz.timezone(tz_name)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown time zone: {tz_name}")
+
+
+def day_bounds(start_day: date, end_day: Optional[date] = None, tz_name: Optional[str] = None) -> Tuple[datetime, datetime]:
+    """
+    Half-open UTC range ``[start, end)`` covering local days start_day..end_day
+
+    The bounds are naive UTC datetimes, matching how check-in times are
+    stored, so the comparison runs directly against the indexed column.
+    """
+    tz = get_timezone(tz_name)
+    end_day = end_day or start_day
+    start = tz.localize(datetime.combine(start_day, time.min)).astimezone(pytz.UTC)
+    end = tz.localize(datetime.combine(end_day + timedelta(days=1), time.min)).astimezone(pytz.UTC)
+    return start.replace(tzinfo=None), end.replace(tzinfo=None)
+
+
+def parse_date_range(date_str: Optional[str] = None, start_str: Optional[str] = None,
+                     end_str: Optional[str] = None) -> Tuple[date, date]:
+    """
+    Report range from request parameters
+
+    Either ``date`` for a single day, or ``start_date`` with an optional
+    ``end_date``, all formatted YYYY-MM-DD.
+
+    Raises:
+        ValueError: Missing or badly formatted dates
+    """
+    start_str = start_str or date_str
+    if not start_str:
+        raise ValueError("Date parameter is required")
+    try:
+        start_day = datetime.strptime(start_str, "%Y-%m-%d").date()
+        end_day = datetime.strptime(end_str, "%Y-%m-%d").date() if end_str else start_day
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD")
+    return start_day, end_day
+
+
+def today(tz_name: Optional[str] = None, now: Optional[datetime] = None) -> date:
+    """Current local day in the report time zone"""
+    now = now or datetime.now(pytz.UTC)
+    return as_utc(now).astimezone(get_timezone(tz_name)).date()
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Treat naive stored timestamps as UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=pytz.UTC)
+    return value.astimezone(pytz.UTC)
+
+
+def daily_report(
+    session,
+    start_day: date,
+    end_day: Optional[date] = None,
+    tz_name: Optional[str] = None,
+    student_id: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Attendance status of every student for each day in a range
+
+    Runs a single ``students LEFT JOIN attendances`` query restricted to the
+    range by a half-open timestamp predicate on ``check_in``, which the
+    (student_id, check_in) index can serve. When a student has several
+    records on a day, the earliest check-in is reported.
+
+    Args:
+        session: SQLAlchemy session
+        start_day: First local day of the report
+        end_day: Last local day (inclusive), defaults to start_day
+        tz_name: Time zone the days are in, defaults to ATTENDANCE_TIMEZONE
+        student_id: Restrict the report to one student
+
+    Returns:
+        One entry per student per day, ordered by day then student
+    """
+    end_day = end_day or start_day
+    if end_day < start_day:
+        raise ValueError("end_date must not be before start_date")
+    if (end_day - start_day).days >= MAX_REPORT_DAYS:
+        raise ValueError(f"Reports are limited to {MAX_REPORT_DAYS} days")
+
+    tz = get_timezone(tz_name)
+    range_start, range_end = day_bounds(start_day, end_day, tz_name)
+
+    query = (
+        session.query(
+            models.Student.id,
+            models.Student.name,
+            models.Student.email,
+            models.Attendance.status,
+            models.Attendance.check_in,
+            models.Attendance.check_out,
+        )
+        .outerjoin(
+            models.Attendance,
+            and_(
+                models.Attendance.student_id == models.Student.id,
+                models.Attendance.check_in >= range_start,
+                models.Attendance.check_in < range_end,
+            ),
+        )
+        .order_by(models.Student.id, models.Attendance.check_in)
+    )
+    if student_id is not None:
+        query = query.filter(models.Student.id == student_id)
+
+    students = {}
+    records = {}
+    for sid, name, email, status, check_in, check_out in query:
+        students.setdefault(sid, (name, email))
+        if check_in is None:
+            continue
+        check_in = as_utc(check_in)
+        local_day = check_in.astimezone(tz).date()
+        # Rows are ordered by check_in, so the first one per day wins
+        records.setdefault((sid, local_day), (status, check_in, as_utc(check_out)))
+
+    report = []
+    day = start_day
+    while day <= end_day:
+        for sid, (name, email) in students.items():
+            record = records.get((sid, day))
+            report.append({
+                "date": day.isoformat(),
+                "student_id": sid,
+                "name": name,
+                "email": email,
+                "status": record[0] if record else "absent",
+                "check_in": record[1].isoformat() if record else None,
+                "check_out": record[2].isoformat() if record and record[2] else None,
+            })
+        day += timedelta(days=1)
+    return report
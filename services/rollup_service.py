@@ -0,0 +1,248 @@
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, distinct, func
+from sqlalchemy.exc import IntegrityError
+
+import models
+from services.report_service import MAX_REPORT_DAYS, as_utc, day_bounds, get_timezone
+
+logger = logging.getLogger(__name__)
+
+
+def local_day(timestamp: datetime) -> date:
+    """Local day (ATTENDANCE_TIMEZONE) an attendance timestamp falls on"""
+    return as_utc(timestamp).astimezone(get_timezone()).date()
+
+
+def minutes_between(check_in: Optional[datetime], check_out: Optional[datetime]) -> int:
+    """Whole minutes of one check-in/check-out pair, 0 while it is open"""
+    if check_in is None or check_out is None:
+        return 0
+    return max(0, int((as_utc(check_out) - as_utc(check_in)).total_seconds() // 60))
+
+
+def _summarise(records: List[Tuple[datetime, Optional[datetime], str]]) -> Dict:
+    """Rollup columns for one student-day from its (check_in, check_out, status) records"""
+    records = sorted(records, key=lambda record: as_utc(record[0]))
+    check_outs = [as_utc(check_out) for _, check_out, _ in records if check_out is not None]
+    return {
+        "first_check_in": as_utc(records[0][0]),
+        "last_check_out": max(check_outs) if check_outs else None,
+        "minutes_present": sum(minutes_between(check_in, check_out) for check_in, check_out, _ in records),
+        "status": records[0][2],
+    }
+
+
+def _insert_rollup(session, rollup: models.AttendanceDaily) -> models.AttendanceDaily:
+    """
+    Insert a new rollup row, or return the row a concurrent first mark of the
+    same student-day committed first
+
+    The insert runs in a savepoint, so a conflict on
+    uq_attendance_daily_student_day undoes only this row and not the caller's
+    transaction. The winner's row is read with a locking read, which sees the
+    committed row and holds it until the caller commits.
+    """
+    try:
+        with session.begin_nested():
+            session.add(rollup)
+        return rollup
+    except IntegrityError:
+        return session.query(models.AttendanceDaily).filter_by(
+            student_id=rollup.student_id, day=rollup.day
+        ).with_for_update().one()
+
+
+def update_rollups(session, check_ins: Iterable[models.Attendance] = (), check_outs: Iterable[models.Attendance] = ()):
+    """
+    Fold newly opened and newly closed attendance records into the rollup
+
+    Existing rollup rows are fetched with one query and the changes are added
+    to the caller's session, so they commit in the same transaction as the
+    attendance records. A check-out counts towards the day of its check-in.
+    The first mark of a day inserts its row through a savepoint, so two
+    workers racing to create the same row both succeed.
+
+    Args:
+        session: SQLAlchemy session
+        check_ins: Attendance records that were just created
+        check_outs: Attendance records whose check_out was just set
+    """
+    check_ins = list(check_ins)
+    check_outs = list(check_outs)
+    keys = {(attendance.student_id, local_day(attendance.check_in)) for attendance in check_ins + check_outs}
+    if not keys:
+        return
+
+    rollups = {
+        (rollup.student_id, rollup.day): rollup
+        for rollup in session.query(models.AttendanceDaily).filter(
+            models.AttendanceDaily.student_id.in_({student_id for student_id, _ in keys}),
+            models.AttendanceDaily.day.in_({day for _, day in keys}),
+        )
+    }
+
+    # Flush the caller's records first, so only a rollup insert can fail in the savepoints below
+    session.flush()
+
+    for attendance in check_ins:
+        key = (attendance.student_id, local_day(attendance.check_in))
+        check_in = as_utc(attendance.check_in)
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = _insert_rollup(session, models.AttendanceDaily(
+                student_id=key[0],
+                day=key[1],
+                first_check_in=check_in,
+                minutes_present=0,
+                status=attendance.status or "present",
+            ))
+        if rollup.first_check_in is None or check_in < as_utc(rollup.first_check_in):
+            rollup.first_check_in = check_in
+
+    for attendance in check_outs:
+        key = (attendance.student_id, local_day(attendance.check_in))
+        rollup = rollups.get(key)
+        if rollup is None:
+            # No rollup yet (e.g. history not backfilled); build it from the raw rows
+            refresh_rollup(session, *key)
+            continue
+        check_out = as_utc(attendance.check_out)
+        if rollup.last_check_out is None or check_out > as_utc(rollup.last_check_out):
+            rollup.last_check_out = check_out
+        rollup.minutes_present = (rollup.minutes_present or 0) + minutes_between(attendance.check_in, check_out)
+
+
+def refresh_rollup(session, student_id: int, day: date):
+    """
+    Recompute one student-day from the raw attendance records
+
+    Used after edits and deletions, which cannot be folded in incrementally.
+    The caller commits.
+    """
+    day_start, day_end = day_bounds(day)
+    session.flush()
+    records = session.query(
+        models.Attendance.check_in, models.Attendance.check_out, models.Attendance.status
+    ).filter(
+        models.Attendance.student_id == student_id,
+        models.Attendance.check_in >= day_start,
+        models.Attendance.check_in < day_end,
+    ).all()
+
+    rollup = session.query(models.AttendanceDaily).filter_by(student_id=student_id, day=day).first()
+    if not records:
+        if rollup is not None:
+            session.delete(rollup)
+        return
+
+    values = _summarise(records)
+    if rollup is None:
+        session.add(models.AttendanceDaily(student_id=student_id, day=day, **values))
+    else:
+        for name, value in values.items():
+            setattr(rollup, name, value)
+
+
+def rebuild_rollups(session, start_day: Optional[date] = None, end_day: Optional[date] = None,
+                    students_per_batch: int = 200) -> int:
+    """
+    Backfill the rollup from attendance history
+
+    Deletes the rollup rows in the range and rebuilds them from the
+    attendance records, a batch of students at a time, with one bulk insert
+    per batch. Without a range the whole table is rebuilt. The caller
+    commits.
+
+    Returns:
+        Number of rollup rows written
+    """
+    rollups = session.query(models.AttendanceDaily)
+    records = session.query(
+        models.Attendance.student_id, models.Attendance.check_in, models.Attendance.check_out, models.Attendance.status
+    ).filter(models.Attendance.check_in.isnot(None))
+
+    if start_day is not None:
+        rollups = rollups.filter(models.AttendanceDaily.day >= start_day)
+        records = records.filter(models.Attendance.check_in >= day_bounds(start_day)[0])
+    if end_day is not None:
+        rollups = rollups.filter(models.AttendanceDaily.day <= end_day)
+        records = records.filter(models.Attendance.check_in < day_bounds(end_day)[1])
+
+    rollups.delete(synchronize_session=False)
+
+    student_ids = [student_id for (student_id,) in session.query(models.Student.id).order_by(models.Student.id)]
+    written = 0
+    for i in range(0, len(student_ids), students_per_batch):
+        chunk = student_ids[i:i + students_per_batch]
+        groups: Dict[Tuple[int, date], List] = {}
+        for student_id, check_in, check_out, status in records.filter(models.Attendance.student_id.in_(chunk)):
+            groups.setdefault((student_id, local_day(check_in)), []).append((check_in, check_out, status))
+        if groups:
+            session.execute(models.AttendanceDaily.__table__.insert(), [
+                {"student_id": student_id, "day": day, **_summarise(group)}
+                for (student_id, day), group in groups.items()
+            ])
+            written += len(groups)
+
+    logger.info(f"Rebuilt {written} attendance rollup rows")
+    return written
+
+
+def attendance_summary(session, start_day: date, end_day: Optional[date] = None,
+                       student_id: Optional[int] = None) -> Dict:
+    """
+    Per-student attendance totals and percentages over a range of days
+
+    Reads only the rollup table, with one grouped query. Class days are the
+    days in the range on which anyone attended, so weekends and holidays do
+    not count as absences.
+    """
+    end_day = end_day or start_day
+    if end_day < start_day:
+        raise ValueError("end_date must not be before start_date")
+    if (end_day - start_day).days >= MAX_REPORT_DAYS:
+        raise ValueError(f"Reports are limited to {MAX_REPORT_DAYS} days")
+
+    rollup = models.AttendanceDaily
+    in_range = and_(rollup.day >= start_day, rollup.day <= end_day)
+
+    class_days = session.query(func.count(distinct(rollup.day))).filter(in_range).scalar() or 0
+
+    query = (
+        session.query(
+            models.Student.id,
+            models.Student.name,
+            models.Student.email,
+            func.count(rollup.id),
+            func.coalesce(func.sum(case((rollup.status == "late", 1), else_=0)), 0),
+            func.coalesce(func.sum(rollup.minutes_present), 0),
+        )
+        .outerjoin(rollup, and_(rollup.student_id == models.Student.id, in_range))
+        .group_by(models.Student.id, models.Student.name, models.Student.email)
+        .order_by(models.Student.id)
+    )
+    if student_id is not None:
+        query = query.filter(models.Student.id == student_id)
+
+    students = []
+    for sid, name, email, days_present, days_late, minutes_present in query:
+        students.append({
+            "student_id": sid,
+            "name": name,
+            "email": email,
+            "days_present": days_present,
+            "days_late": int(days_late),
+            "days_absent": max(0, class_days - days_present),
+            "minutes_present": int(minutes_present),
+            "attendance_rate": round(100.0 * days_present / class_days, 1) if class_days else None,
+        })
+
+    return {
+        "start_date": start_day.isoformat(),
+        "end_date": end_day.isoformat(),
+        "class_days": class_days,
+        "students": students,
+    }
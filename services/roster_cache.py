@@ -0,0 +1,263 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pytz
+from sqlalchemy import select, update
+
+import models
+from services.face_gallery import FaceGallery, GalleryMatch
+from services.gallery_cache import VERSION_CHECK_INTERVAL, seed_version_row
+from services.report_service import as_utc, day_bounds, today
+
+logger = logging.getLogger(__name__)
+
+ROSTER_STATE_ID = 1
+
+# Minutes before its start that a class session counts as active at its room,
+# for students arriving early
+EARLY_MINUTES = float(os.environ.get("ROSTER_EARLY_MINUTES", "15"))
+
+
+def seed_roster_state(session):
+    seed_version_row(session, models.RosterState, ROSTER_STATE_ID)
+
+
+def bump_roster_version(session) -> int:
+    """
+    Record a course, session or enrolment change in the caller's transaction
+
+    Like bump_gallery_version, the ``UPDATE`` row lock orders concurrent
+    changes, and every worker rebuilds its rosters on the next mark.
+
+    Returns:
+        The new roster version
+
+    Raises:
+        RuntimeError: The roster_state row was never seeded
+    """
+    result = session.execute(
+        update(models.RosterState)
+        .where(models.RosterState.id == ROSTER_STATE_ID)
+        .values(version=models.RosterState.version + 1)
+    )
+    if result.rowcount == 0:
+        raise RuntimeError("roster_state has no version row; start the app once to seed it")
+
+    return session.execute(
+        select(models.RosterState.version).where(models.RosterState.id == ROSTER_STATE_ID)
+    ).scalar_one()
+
+
+def current_roster_version(session) -> int:
+    """Read the committed roster version (a primary-key lookup)"""
+    version = session.execute(
+        select(models.RosterState.version).where(models.RosterState.id == ROSTER_STATE_ID)
+    ).scalar()
+    return version or 0
+
+
+def _utc_naive(value: datetime) -> datetime:
+    return as_utc(value).replace(tzinfo=None)
+
+
+class ScheduledSession(NamedTuple):
+    session_id: int
+    course_id: int
+    room: str
+    starts_at: datetime  # Naive UTC
+    ends_at: datetime
+
+
+class ScopedGallery:
+    """
+    A class roster matched first, with the global gallery behind it
+
+    Has the match/match_many interface of FaceGallery, so the mark
+    endpoints and the micro-batcher use it in place of the global gallery.
+    A probe within tolerance of a roster student is matched after scanning
+    only the roster; the global gallery is scanned only on a roster miss.
+    """
+
+    def __init__(self, roster: FaceGallery, gallery: FaceGallery, course_id: int, owner: "RosterCache"):
+        self.roster = roster
+        self.gallery = gallery
+        self.course_id = course_id
+        self._owner = owner
+
+    def __len__(self) -> int:
+        return len(self.gallery)
+
+    def match(self, face_encoding: np.ndarray, tolerance: float = 0.6, k: int = 5) -> GalleryMatch:
+        match = self.roster.match(face_encoding, tolerance=tolerance, k=k)
+        if match.student_id is not None:
+            self._owner.record(roster_hits=1)
+            return match
+        match = self.gallery.match(face_encoding, tolerance=tolerance, k=k)
+        self._owner.record(fallback_hits=int(match.student_id is not None), misses=int(match.student_id is None))
+        return match
+
+    def match_many(self, face_encodings: Sequence[np.ndarray], tolerance: float = 0.6, k: int = 5,
+                   unique: bool = True) -> List[GalleryMatch]:
+        """
+        Match against the roster, then the roster misses against the global
+        gallery; with ``unique`` a student matched by a roster probe is not
+        matched again by a fallback one
+        """
+        matches = self.roster.match_many(face_encodings, tolerance=tolerance, k=k, unique=unique)
+        misses = [i for i, match in enumerate(matches) if match.student_id is None]
+        roster_hits = len(matches) - len(misses)
+        if misses:
+            taken = {match.student_id for match in matches if match.student_id is not None}
+            fallback = self.gallery.match_many([face_encodings[i] for i in misses], tolerance=tolerance, k=k, unique=unique)
+            for i, match in zip(misses, fallback):
+                if unique and match.student_id in taken:
+                    match = GalleryMatch(None, match.distance, match.candidates)
+                matches[i] = match
+        fallback_hits = sum(matches[i].student_id is not None for i in misses)
+        self._owner.record(roster_hits=roster_hits, fallback_hits=fallback_hits, misses=len(misses) - fallback_hits)
+        return matches
+
+
+class RosterCache:
+    """
+    Process-local class schedule and roster galleries
+
+    Holds today's class sessions by room and the enrolled students of each
+    course, reloaded when roster_state changes or the local day rolls over.
+    A course's roster gallery is sliced from the global gallery snapshot
+    (no encodings are read) and rebuilt when either the enrolments or the
+    snapshot change, so consecutive marks at a kiosk share one ScopedGallery.
+    """
+
+    def __init__(self, check_interval: float = VERSION_CHECK_INTERVAL, early_minutes: float = EARLY_MINUTES):
+        self.check_interval = check_interval
+        self.early = timedelta(minutes=early_minutes)
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._day: Optional[date] = None
+        self._checked_at = 0.0
+        self._schedule: Dict[str, List[ScheduledSession]] = {}
+        self._members: Dict[int, np.ndarray] = {}
+        self._scoped: Dict[int, ScopedGallery] = {}
+        self._stats_lock = threading.Lock()
+        self._counts = {"roster_hits": 0, "fallback_hits": 0, "misses": 0}
+
+    def get(self, session, gallery: FaceGallery, room: Optional[str], at: Optional[datetime] = None):
+        """
+        The gallery to match a probe from ``room`` against
+
+        Returns:
+            A ScopedGallery for the roster of the session active in
+            ``room``, or ``gallery`` itself when no room is given, no
+            session is active there or none of its students is enrolled
+            with a face
+        """
+        if not room:
+            return gallery
+        at = _utc_naive(at or datetime.now(pytz.UTC))
+        self._refresh(session, at)
+
+        active = self.active_session(room, at)
+        if active is None:
+            return gallery
+        scoped = self._scoped.get(active.course_id)
+        if scoped is not None and scoped.gallery is gallery:
+            return scoped
+
+        with self._lock:
+            members = self._members.get(active.course_id)
+            if members is None:
+                members = np.fromiter(
+                    session.scalars(select(models.Enrolment.student_id).where(models.Enrolment.course_id == active.course_id)),
+                    dtype=np.int64,
+                )
+                self._members[active.course_id] = members
+            roster = gallery.subset(members)
+            if len(roster) == 0:
+                return gallery
+            scoped = ScopedGallery(roster, gallery, active.course_id, self)
+            self._scoped[active.course_id] = scoped
+            logger.debug(f"Built roster gallery of course {active.course_id} with {len(roster)} of {len(gallery)} students")
+            return scoped
+
+    def active_session(self, room: str, at: datetime) -> Optional[ScheduledSession]:
+        """
+        The session under way in ``room`` at naive UTC ``at``, or failing
+        that the next one starting within the early window
+        """
+        sessions = self._schedule.get(room, ())
+        started = [s for s in sessions if s.starts_at <= at < s.ends_at]
+        if started:
+            return max(started, key=lambda s: s.starts_at)
+        upcoming = [s for s in sessions if s.starts_at - self.early <= at < s.starts_at]
+        return min(upcoming, key=lambda s: s.starts_at) if upcoming else None
+
+    def warm(self, session):
+        """Load today's schedule, e.g. at worker startup"""
+        with self._lock:
+            self._load(session, current_roster_version(session), today())
+
+    def invalidate(self):
+        """Force a reload on the next ``get``"""
+        with self._lock:
+            self._version = None
+
+    def record(self, roster_hits: int = 0, fallback_hits: int = 0, misses: int = 0):
+        with self._stats_lock:
+            self._counts["roster_hits"] += roster_hits
+            self._counts["fallback_hits"] += fallback_hits
+            self._counts["misses"] += misses
+
+    def stats(self) -> Dict:
+        """Probes matched on a roster, on the global fallback, or not at all"""
+        with self._stats_lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            "version": self._version,
+            "sessions_today": sum(len(sessions) for sessions in self._schedule.values()),
+            "rosters": {course_id: len(scoped.roster) for course_id, scoped in list(self._scoped.items())},
+        }
+
+    def _refresh(self, session, at: datetime):
+        day = today(now=as_utc(at))
+        if self._version is not None and day == self._day and self.check_interval > 0:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+
+        version = current_roster_version(session)
+        self._checked_at = time.monotonic()
+        if version == self._version and day == self._day:
+            return
+
+        with self._lock:
+            if version != self._version or day != self._day:
+                self._load(session, version, day)
+
+    def _load(self, session, version: int, day: date):
+        start, end = day_bounds(day)
+        rows = session.execute(
+            select(models.ClassSession.id, models.ClassSession.course_id, models.ClassSession.room,
+                   models.ClassSession.starts_at, models.ClassSession.ends_at)
+            .where(models.ClassSession.starts_at < end + self.early, models.ClassSession.ends_at > start)
+        )
+        schedule: Dict[str, List[ScheduledSession]] = {}
+        for session_id, course_id, room, starts_at, ends_at in rows:
+            schedule.setdefault(room, []).append(
+                ScheduledSession(session_id, course_id, room, _utc_naive(starts_at), _utc_naive(ends_at))
+            )
+        self._schedule = schedule
+        self._members = {}
+        self._scoped = {}
+        self._version = version
+        self._day = day
+        logger.info(f"Loaded class schedule v{version} for {day} with "
+                    f"{sum(len(sessions) for sessions in schedule.values())} sessions in {len(schedule)} rooms")
+
+
+roster_cache = RosterCache()
@@ -0,0 +1,55 @@
+"""
+Per-worker state loaded when a server process starts.
+
+Shared by the Flask app (main.start_services) and the FastAPI lifespan in
+asgi.py. Called once from the server's startup hook rather than on import,
+so a process that merely imports the app, such as a spawned inference pool
+worker, loads nothing.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def configured_web_workers() -> int:
+    """Web workers per WEB_CONCURRENCY, the default of both gunicorn and uvicorn"""
+    try:
+        return max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+    except ValueError:
+        return 1
+
+
+def load_worker_state(session):
+    """Seed the version rows and warm the per-worker caches"""
+    from services.attendance_sessions import attendance_sessions
+    from services.bulk_import import fail_interrupted_jobs
+    from services.gallery_cache import gallery_cache, seed_gallery_state
+    from services.roster_cache import roster_cache, seed_roster_state
+
+    # Version rows of tables created before they were seeded with them
+    seed_gallery_state(session)
+    seed_roster_state(session)
+
+    # Warm the face gallery so the first recognition is fast
+    try:
+        gallery_cache.warm(session)
+    except Exception as e:
+        logger.warning(f"Could not warm face gallery, it will load on first use: {str(e)}")
+        session.rollback()
+    try:
+        roster_cache.warm(session)
+    except Exception as e:
+        logger.warning(f"Could not load the class schedule, it will load on first use: {str(e)}")
+        session.rollback()
+    try:
+        attendance_sessions.load(session)
+        session.commit()
+    except Exception as e:
+        logger.warning(f"Could not load open attendance sessions, they will load on first use: {str(e)}")
+        session.rollback()
+    try:
+        if fail_interrupted_jobs(session):
+            session.commit()
+    except Exception as e:
+        logger.warning(f"Could not check for interrupted import jobs: {str(e)}")
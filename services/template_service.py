@@ -0,0 +1,64 @@
+import logging
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+import models
+from services.encoding_codec import pack_encoding
+from services.gallery_cache import bump_gallery_version
+
+logger = logging.getLogger(__name__)
+
+# Encodings a student may hold, counting the primary face_encoding
+MAX_TEMPLATES = int(os.environ.get("FACE_MAX_TEMPLATES", "10"))
+
+
+def template_json(template: models.FaceTemplate) -> Dict:
+    return {
+        "id": template.id,
+        "student_id": template.student_id,
+        "label": template.label,
+        "created_at": template.created_at.isoformat() if template.created_at else None,
+        "updated_at": template.updated_at.isoformat() if template.updated_at else None,
+    }
+
+
+def get_template(session, student_id: int, template_id: int) -> Optional[models.FaceTemplate]:
+    """A student's template, None if it does not exist or belongs to someone else"""
+    return session.query(models.FaceTemplate).filter(
+        models.FaceTemplate.id == template_id,
+        models.FaceTemplate.student_id == student_id,
+    ).first()
+
+
+def add_template(session, student: models.Student, encoding: np.ndarray, label: Optional[str] = None) -> models.FaceTemplate:
+    """
+    Add one template to a student; the caller commits
+
+    Raises:
+        ValueError: The student already has MAX_TEMPLATES encodings
+    """
+    count = session.query(models.FaceTemplate).filter(models.FaceTemplate.student_id == student.id).count()
+    if count + (1 if student.face_encoding is not None else 0) >= MAX_TEMPLATES:
+        raise ValueError(f"A student can have at most {MAX_TEMPLATES} face templates")
+
+    template = models.FaceTemplate(student_id=student.id, encoding=pack_encoding(encoding), label=label)
+    session.add(template)
+    session.flush()
+    bump_gallery_version(session, [student.id])
+    return template
+
+
+def replace_template(session, template: models.FaceTemplate, encoding: np.ndarray, label: Optional[str] = None):
+    """Swap the encoding of one template, keeping the others; the caller commits"""
+    template.encoding = pack_encoding(encoding)
+    if label is not None:
+        template.label = label
+    bump_gallery_version(session, [template.student_id])
+
+
+def remove_template(session, template: models.FaceTemplate):
+    """Delete one template; the caller commits"""
+    session.delete(template)
+    bump_gallery_version(session, [template.student_id])
@@ -0,0 +1,507 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import pytz
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import models
+from services.attendance_service import QUEUED, apply_marks, toggle_attendance
+from services.attendance_sessions import attendance_sessions
+from services.metrics import stage
+from services.report_service import as_utc
+from services.startup import configured_web_workers
+
+logger = logging.getLogger(__name__)
+
+# Durable write-behind for attendance marks (off by default)
+WRITE_BEHIND_ENABLED = os.environ.get("ATTENDANCE_WRITE_BEHIND", "0") == "1"
+# Directory of append-only event log segments, one per process
+LOG_DIR = os.environ.get("ATTENDANCE_EVENT_LOG_DIR", os.path.join("instance", "attendance_events"))
+# Seconds between flushes; a full batch flushes at once
+FLUSH_INTERVAL = float(os.environ.get("ATTENDANCE_FLUSH_INTERVAL", "0.2"))
+# Events applied per transaction
+FLUSH_BATCH = int(os.environ.get("ATTENDANCE_FLUSH_BATCH", "500"))
+# A fully applied segment larger than this is replaced by a fresh one
+SEGMENT_MAX_BYTES = int(os.environ.get("ATTENDANCE_EVENT_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+# Longest wait between retries while the database is unavailable
+MAX_RETRY_DELAY = 30.0
+# Seconds a starting process waits for the log directory's owner lock, e.g.
+# while the worker it replaces in a graceful restart applies its last events
+OWNER_LOCK_WAIT = float(os.environ.get("ATTENDANCE_WRITER_LOCK_WAIT", "30"))
+
+SEGMENT_SUFFIX = ".log"
+OWNER_LOCK_NAME = "writer.lock"
+
+
+class AttendanceEvent(NamedTuple):
+    seq: int
+    student_id: int
+    at: datetime
+
+
+def _try_lock(file) -> bool:
+    """Take an exclusive, non-blocking lock on an open segment"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _lock_owner(directory: str, wait: float = OWNER_LOCK_WAIT):
+    """
+    Take the owner lock of a log directory, held for the life of a writer
+
+    Returns:
+        The open lock file
+
+    Raises:
+        RuntimeError: Another live process kept the lock for ``wait`` seconds
+    """
+    os.makedirs(directory, exist_ok=True)
+    owner = open(os.path.join(directory, OWNER_LOCK_NAME), "ab")
+    attempts = max(1, int(wait / 0.5) + 1)
+    for attempt in range(attempts):
+        if _try_lock(owner):
+            return owner
+        if attempt + 1 < attempts:
+            threading.Event().wait(0.5)
+    owner.close()
+    raise RuntimeError(
+        f"Attendance write-behind is already running in another process on {directory}; "
+        "run a single web worker with ATTENDANCE_WRITE_BEHIND=1"
+    )
+
+
+def read_segment(path: str) -> List[AttendanceEvent]:
+    """
+    Events of a segment in append order
+
+    Reading stops at the first incomplete or corrupt line, which can only
+    be the tail of a write that was never acknowledged.
+    """
+    events = []
+    with open(path, "rb") as segment:
+        for line in segment:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("incomplete line")
+                record = json.loads(line)
+                events.append(AttendanceEvent(record["seq"], record["student_id"], datetime.fromisoformat(record["at"])))
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Ignoring torn tail of attendance event log {path} after {len(events)} events")
+                break
+    return events
+
+
+class EventLog:
+    """
+    One append-only segment file, locked by the process that writes it
+
+    Appends are written straight away; sync() makes them durable with one
+    fsync for every append made since the last one, so concurrent requests
+    share the cost of a disk flush.
+    """
+
+    def __init__(self, directory: str = LOG_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+        self.path = os.path.join(directory, self.name)
+        self._file = open(self.path, "ab")
+        if not _try_lock(self._file):
+            raise RuntimeError(f"Could not lock attendance event log {self.path}")
+        self._sync_lock = threading.Lock()
+        self._seq = 0
+        self._written = 0
+        self._synced = 0
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return self._written
+
+    def write(self, student_id: int, at: datetime) -> AttendanceEvent:
+        """Append one event; the caller serialises writes and calls sync() before acknowledging"""
+        self._seq += 1
+        event = AttendanceEvent(self._seq, student_id, at)
+        self._file.write(json.dumps({"seq": event.seq, "student_id": student_id, "at": at.isoformat()}).encode() + b"\n")
+        self._file.flush()
+        self._written = self._file.tell()
+        return event
+
+    def sync(self):
+        """Make every event written so far durable"""
+        target = self._written
+        with self._sync_lock:
+            if self._closed or self._synced >= target:
+                return
+            written = self._written
+            os.fsync(self._file.fileno())
+            self._synced = written
+
+    def close(self, delete: bool = False):
+        with self._sync_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if not delete:
+                os.fsync(self._file.fileno())
+            self._file.close()
+        if delete:
+            os.remove(self.path)
+
+
+def _apply_events(session, events: List[Tuple[str, AttendanceEvent]]):
+    """
+    Apply a batch of (segment, event) pairs and advance the checkpoint of
+    each segment in it, in one transaction
+
+    A student's events are applied in batch order: the batch is split into
+    rounds holding at most one event per student, the k-th round holding
+    everyone's k-th event. If a round hits a constraint (e.g. the student
+    was deleted), the events are retried one at a time and the failing
+    ones are logged and skipped.
+    """
+    rounds: List[List] = []
+    seen: Dict[int, int] = {}
+    for _, event in events:
+        index = seen.get(event.student_id, 0)
+        seen[event.student_id] = index + 1
+        if index == len(rounds):
+            rounds.append([])
+        rounds[index].append((event.student_id, event.at))
+
+    failed = set()
+    try:
+        for marks in rounds:
+            apply_marks(session, marks)
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        for segment, event in events:
+            try:
+                with session.begin_nested():
+                    apply_marks(session, [(event.student_id, event.at)])
+            except IntegrityError as e:
+                logger.error(f"Skipping attendance event {segment}#{event.seq} for student {event.student_id}: {str(e)}")
+                failed.add(event.student_id)
+
+    applied_seqs = {}
+    for segment, event in events:
+        applied_seqs[segment] = event.seq
+    for segment, applied_seq in applied_seqs.items():
+        checkpoint = session.get(models.EventLogCheckpoint, segment)
+        if checkpoint is None:
+            session.add(models.EventLogCheckpoint(segment=segment, applied_seq=applied_seq))
+        else:
+            checkpoint.applied_seq = applied_seq
+    session.commit()
+    if failed:
+        # Their deferred session changes may belong to rolled-back savepoints
+        attendance_sessions.forget(failed)
+
+
+def _delete_checkpoints(session, segments: List[str]):
+    """Drop the checkpoints of segments whose files are gone"""
+    session.query(models.EventLogCheckpoint).filter(
+        models.EventLogCheckpoint.segment.in_(segments)
+    ).delete(synchronize_session=False)
+    session.commit()
+
+
+class AttendanceWriter:
+    """
+    Write-behind queue for attendance marks
+
+    submit() appends the marks to this process's event log, waits for the
+    fsync and returns; a background thread applies queued events to the
+    database in batches of FLUSH_BATCH, one transaction per batch, recording
+    the last applied sequence number in event_log_checkpoints in the same
+    transaction. On startup, recover() replays the segments left behind by
+    processes that stopped before their events were applied.
+
+    A student's marks are applied in order only if they all go through one
+    writer, so a writer holds the owner lock of its log directory and the
+    app must run a single web worker while write-behind is enabled.
+    """
+
+    def __init__(self, session_factory: Callable, directory: str = LOG_DIR,
+                 flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH):
+        self.session_factory = session_factory
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._owner = _lock_owner(directory)
+        self._log = EventLog(directory)
+        self._queue: deque = deque()
+        self._last_submitted: Dict[int, datetime] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, student_ids: Iterable[int], current_time: Optional[datetime] = None) -> Dict[int, str]:
+        """
+        Durably queue a mark for each student
+
+        Recognitions within the cooldown of a student's last queued or
+        applied mark are acknowledged without being logged.
+
+        Returns:
+            Mapping of student id to QUEUED
+        """
+        current_time = current_time or datetime.now(pytz.UTC)
+        student_ids = list(dict.fromkeys(student_ids))
+        cooldown = attendance_sessions.cooldown
+
+        with self._lock:
+            log = self._log
+            for student_id in student_ids:
+                last = self._last_submitted.get(student_id)
+                if last is not None and timedelta(0) <= as_utc(current_time) - last < cooldown:
+                    continue
+                if attendance_sessions.recent_action(student_id, current_time) is not None:
+                    continue
+                self._last_submitted[student_id] = as_utc(current_time)
+                self._queue.append(log.write(student_id, current_time))
+            queued = len(self._queue)
+
+        log.sync()
+        if queued >= self.batch_size:
+            self._wake.set()
+        return {student_id: QUEUED for student_id in student_ids}
+
+    def flush(self) -> int:
+        """Apply queued events to the database; returns the number applied"""
+        applied = 0
+        with self._flush_lock:
+            while self._queue:
+                batch = [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+                session = self.session_factory()
+                try:
+                    _apply_events(session, [(self._log.name, event) for event in batch])
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+                for _ in batch:
+                    self._queue.popleft()
+                applied += len(batch)
+            self._rotate()
+        return applied
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the flusher, apply what is queued and close the log"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Could not apply {self.pending} queued attendance events, they will be replayed: {str(e)}")
+        with self._lock:
+            self._log.close(delete=not self._queue)
+        self._owner.close()
+
+    def recover(self) -> int:
+        """
+        Replay the unapplied events of segments no running process holds
+
+        Each process logs to its own segment, so a student's events can be
+        spread over several. Pending events of all segments are merged by
+        event time, each segment staying in log order, and applied as one
+        stream so that no later mark is applied before an earlier one.
+        """
+        segments = []
+        try:
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(SEGMENT_SUFFIX) or name == self._log.name:
+                    continue
+                segment = open(path, "ab")
+                if not _try_lock(segment):
+                    segment.close()
+                    continue  # Still being written by a live process
+                segments.append((name, path, segment))
+
+            replayed = self._replay([(name, path) for name, path, _ in segments]) if segments else 0
+            for name, path, segment in segments:
+                if fcntl is None:
+                    segment.close()  # Windows cannot delete an open file
+                os.remove(path)
+        finally:
+            for _, _, segment in segments:
+                segment.close()
+
+        if segments:
+            self._forget([name for name, _, _ in segments])
+        return replayed
+
+    def _replay(self, segments: List[Tuple[str, str]]) -> int:
+        session = self.session_factory()
+        try:
+            pending = []
+            for name, path in segments:
+                checkpoint = session.get(models.EventLogCheckpoint, name)
+                applied_seq = checkpoint.applied_seq if checkpoint else 0
+                pending.append([(name, event) for event in read_segment(path) if event.seq > applied_seq])
+            # A merge keeps every segment in log order, so each checkpoint
+            # still covers a prefix of its segment
+            events = list(heapq.merge(*pending, key=lambda item: as_utc(item[1].at)))
+            for i in range(0, len(events), self.batch_size):
+                _apply_events(session, events[i:i + self.batch_size])
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        if events:
+            logger.info(f"Replayed {len(events)} attendance events from {len(segments)} segments")
+        return len(events)
+
+    def _forget(self, segments: List[str]):
+        session = self.session_factory()
+        try:
+            _delete_checkpoints(session, segments)
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"Could not remove checkpoints of deleted event log segments: {str(e)}")
+        finally:
+            session.close()
+
+    def _rotate(self):
+        """Start a new segment once the current one is fully applied and large"""
+        with self._lock:
+            if self._queue or self._log.size < SEGMENT_MAX_BYTES:
+                return
+            old, self._log = self._log, EventLog(self.directory)
+            old.close(delete=True)
+            # Marks older than the cooldown no longer suppress anything
+            cutoff = datetime.now(pytz.UTC) - attendance_sessions.cooldown
+            self._last_submitted = {
+                student_id: at for student_id, at in self._last_submitted.items() if at >= cutoff
+            }
+        self._forget([old.name])
+
+    def _run(self):
+        delay = self.flush_interval
+        while not self._stopped.is_set():
+            self._wake.wait(delay)
+            self._wake.clear()
+            try:
+                self.flush()
+                delay = self.flush_interval
+            except Exception as e:
+                delay = min(max(delay * 2, 1.0), MAX_RETRY_DELAY)
+                logger.error(f"Attendance write-behind flush failed, {self.pending} events queued, "
+                             f"retrying in {delay:.0f}s: {str(e)}")
+
+
+_writer: Optional[AttendanceWriter] = None
+
+
+def start_write_behind(session_factory: Callable, web_workers: Optional[int] = None) -> Optional[AttendanceWriter]:
+    """
+    Replay unapplied events and start the flusher if ATTENDANCE_WRITE_BEHIND=1
+
+    Args:
+        session_factory: Creates the sessions events are applied in
+        web_workers: Worker processes of the web server, WEB_CONCURRENCY
+            if not given
+
+    Raises:
+        RuntimeError: More than one web worker is configured, or another
+            process already runs write-behind on the log directory. Each
+            worker would apply its own log, and a check-out logged by one
+            could be applied before an earlier check-in logged by another
+    """
+    global _writer
+    if not WRITE_BEHIND_ENABLED or _writer is not None:
+        return _writer
+    web_workers = web_workers or configured_web_workers()
+    if web_workers > 1:
+        raise RuntimeError(
+            f"ATTENDANCE_WRITE_BEHIND=1 needs a single web worker, {web_workers} are configured: "
+            "a student's marks logged by different workers could be applied out of order"
+        )
+    writer = AttendanceWriter(session_factory)
+    writer.recover()
+    writer.start()
+    _writer = writer
+    logger.info(f"Attendance write-behind enabled, logging to {writer.directory}")
+    return writer
+
+
+def stop_write_behind():
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def get_attendance_writer() -> Optional[AttendanceWriter]:
+    return _writer
+
+
+def record_attendance(session, student_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    Mark recognised students: queued in the event log when write-behind is
+    enabled, otherwise toggled and committed in the caller's session
+
+    Returns:
+        Mapping of student id to CHECK_IN, CHECK_OUT or QUEUED
+    """
+    if _writer is not None:
+        with stage("enqueue"):
+            return _writer.submit(student_ids)
+    with stage("mark"):
+        actions = toggle_attendance(session, student_ids)
+    with stage("commit"):
+        session.commit()
+    return actions
+
+
+async def record_attendance_async(db, student_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    record_attendance for an AsyncSession; the event log's fsync runs in a
+    thread so it does not stall the event loop
+    """
+    student_ids = list(student_ids)
+    if _writer is not None:
+        with stage("enqueue"):
+            return await asyncio.to_thread(_writer.submit, student_ids)
+    with stage("mark"):
+        actions = await db.run_sync(toggle_attendance, student_ids)
+    with stage("commit"):
+        await db.commit()
+    return actions
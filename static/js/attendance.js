@@ -13,6 +13,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const attendanceTime = document.getElementById('attendanceTime');
     const resetBtn = document.getElementById('resetBtn');
     
+    // A kiosk opened as /mark-attendance?room=B204 matches the roster of the
+    // class under way in that room first
+    const room = new URLSearchParams(window.location.search).get('room');
+    const markUrl = room ? `/api/attendance/mark?${new URLSearchParams({ room })}` : '/api/attendance/mark';
+    
     // Initialize webcam
     let webcam = null;
     
@@ -26,11 +31,66 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Stream frames to the server and draw the face boxes it sends back; its
+    // acknowledgements also carry the frame handle a mark can use
+    let detectionStream = null;
+    
+    if (webcam) {
+        const detectionCanvas = document.createElement('canvas');
+        detectionCanvas.style.position = 'absolute';
+        detectionCanvas.style.top = '0';
+        detectionCanvas.style.left = '0';
+        detectionCanvas.style.width = '100%';
+        detectionCanvas.style.height = '100%';
+        videoElement.parentElement.appendChild(detectionCanvas);
+        const ctx = detectionCanvas.getContext('2d');
+        
+        detectionStream = new FaceDetectionStream(webcam, faces => {
+            // Match the overlay resolution to the video frames the boxes refer to
+            if (videoElement.videoWidth && detectionCanvas.width !== videoElement.videoWidth) {
+                detectionCanvas.width = videoElement.videoWidth;
+                detectionCanvas.height = videoElement.videoHeight;
+            }
+            ctx.clearRect(0, 0, detectionCanvas.width, detectionCanvas.height);
+            ctx.strokeStyle = '#00ff00';
+            ctx.lineWidth = 2;
+            faces.forEach(face => {
+                const [top, right, bottom, left] = face;
+                ctx.strokeRect(left, top, right - left, bottom - top);
+            });
+        }, { track: true });
+        
+        window.addEventListener('beforeunload', detectionStream.stop);
+    }
+    
+    // The mark request for the current frame. The frame the overlay last found
+    // a face in goes up with its frame_handle, so the server neither decodes nor
+    // detects it again; the image is sent too, for a server worker other than
+    // the one holding the handle. Otherwise a new capture is sent.
+    function captureMarkRequest() {
+        const frame = detectionStream ? detectionStream.latestFrame() : null;
+        if (frame) {
+            const formData = new FormData();
+            formData.append('image', frame.image, 'face.jpg');
+            formData.append('frame_handle', frame.handle);
+            if (room) formData.append('room', room);
+            return Promise.resolve({ method: 'POST', body: formData });
+        }
+        return webcam.takePictureBlob().then(capturedImage => capturedImage && {
+            method: 'POST',
+            headers: {
+                'Content-Type': capturedImage.type || 'image/jpeg'
+            },
+            body: capturedImage
+        });
+    }
+    
     // Start webcam when page loads
     if (webcam) {
         webcam.start()
             .then(() => {
                 console.log('Webcam started successfully');
+                detectionStream.start();
             })
             .catch(err => {
                 console.error('Error starting webcam:', err);
@@ -61,68 +121,60 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             // Take picture
-            const capturedImage = webcam.takePicture();
-            
-            if (capturedImage) {
-                // Send image to API for face recognition
-                fetch('/api/attendance/mark', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        image_data: capturedImage
-                    })
-                })
-                .then(response => response.json())
-                .then(result => {
-                    // Display result
-                    if (result.success) {
-                        // Successful face recognition
-                        if (statusMessage) {
-                            statusMessage.textContent = 'Face recognized successfully!';
-                            statusMessage.classList.remove('alert-info', 'alert-danger');
-                            statusMessage.classList.add('alert-success');
-                        }
+            captureMarkRequest().then(markRequest => {
+                if (markRequest) {
+                    // Send the JPEG bytes for face recognition
+                    fetch(markUrl, markRequest)
+                    .then(response => response.json())
+                    .then(result => {
+                        // Display result
+                        if (result.success) {
+                            // Successful face recognition
+                            if (statusMessage) {
+                                statusMessage.textContent = 'Face recognized successfully!';
+                                statusMessage.classList.remove('alert-info', 'alert-danger');
+                                statusMessage.classList.add('alert-success');
+                            }
                         
-                        // Show result details
-                        if (resultContainer) resultContainer.classList.remove('d-none');
-                        if (studentName) studentName.textContent = result.name;
-                        if (attendanceStatus) attendanceStatus.textContent = result.message;
-                        if (attendanceTime) {
-                            const now = new Date();
-                            attendanceTime.textContent = now.toLocaleTimeString();
-                        }
+                            // Show result details
+                            if (resultContainer) resultContainer.classList.remove('d-none');
+                            if (studentName) studentName.textContent = result.name;
+                            if (attendanceStatus) attendanceStatus.textContent = result.message;
+                            if (attendanceTime) {
+                                const now = new Date();
+                                attendanceTime.textContent = now.toLocaleTimeString();
+                            }
                         
-                        // Temporarily stop webcam
-                        webcam.stop();
-                    } else {
-                        // Failed face recognition
+                            // Temporarily stop webcam
+                            webcam.stop();
+                        } else {
+                            // Failed face recognition
+                            if (statusMessage) {
+                                statusMessage.textContent = 'Error: ' + result.message;
+                                statusMessage.classList.remove('alert-info', 'alert-success');
+                                statusMessage.classList.add('alert-danger');
+                            }
+                        }
+                    })
+                    .catch(error => {
+                        console.error('Error:', error);
                         if (statusMessage) {
-                            statusMessage.textContent = 'Error: ' + result.message;
+                            statusMessage.textContent = 'Error: ' + (error.message || 'Unknown error occurred');
                             statusMessage.classList.remove('alert-info', 'alert-success');
                             statusMessage.classList.add('alert-danger');
                         }
-                    }
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    if (statusMessage) {
-                        statusMessage.textContent = 'Error: ' + (error.message || 'Unknown error occurred');
-                        statusMessage.classList.remove('alert-info', 'alert-success');
-                        statusMessage.classList.add('alert-danger');
-                    }
-                })
-                .finally(() => {
-                    // Reset button state
+                    })
+                    .finally(() => {
+                        // Reset button state
+                        captureBtn.disabled = false;
+                        captureBtn.textContent = 'Capture Face';
+                    });
+                } else {
+                    alert('Failed to capture image. Please try again.');
                     captureBtn.disabled = false;
                     captureBtn.textContent = 'Capture Face';
-                });
-            } else {
-                alert('Failed to capture image. Please try again.');
-                captureBtn.disabled = false;
-                captureBtn.textContent = 'Capture Face';
-            }
+                }
+            });
         });
     }
     
@@ -144,6 +196,12 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Attendance log paging state
+    const PAGE_SIZE = 50;
+    let nextCursor = null;
+    let rowCount = 0;
+    let loadGeneration = 0;
+    
     // Load attendance logs if we're on the attendance log page
     const attendanceTable = document.getElementById('attendanceTable');
     const dateFilter = document.getElementById('dateFilter');
@@ -173,48 +231,59 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    // Function to load attendance data
-    function loadAttendanceData(date) {
+    // Function to load attendance data, one page at a time
+    function loadAttendanceData(date, append = false) {
         const tableBody = attendanceTable.querySelector('tbody');
         const studentFilter = document.getElementById('studentFilter');
         const statusFilter = document.getElementById('statusFilter');
         
-        // Show loading state
-        tableBody.innerHTML = '<tr><td colspan="6" class="text-center">Loading...</td></tr>';
+        if (!append) {
+            // New filters: start again from the first page
+            nextCursor = null;
+            rowCount = 0;
+            loadGeneration += 1;
+            tableBody.innerHTML = '<tr><td colspan="6" class="text-center">Loading...</td></tr>';
+        }
+        const generation = loadGeneration;
+        
+        const params = new URLSearchParams({ order: '-check_in', limit: PAGE_SIZE });
+        if (date) params.set('date', date);
+        if (studentFilter && studentFilter.value) params.set('student_id', studentFilter.value);
+        if (statusFilter && statusFilter.value) params.set('status', statusFilter.value);
+        if (append && nextCursor) params.set('cursor', nextCursor);
         
-        // Fetch attendance data from API
-        fetch(`/api/attendance/report/daily?date=${date}`)
+        renderPager(true);
+        
+        // Fetch one page of attendance records from the API
+        fetch(`/api/attendance/?${params.toString()}`)
             .then(response => {
                 if (!response.ok) {
                     throw new Error('Failed to load attendance data');
                 }
                 return response.json();
             })
-            .then(data => {
-                // Clear loading state
-                tableBody.innerHTML = '';
-                
-                // Apply filters
-                let filteredData = data;
-                
-                // Apply student filter if selected
-                if (studentFilter && studentFilter.value) {
-                    filteredData = filteredData.filter(record => record.student_id == studentFilter.value);
+            .then(page => {
+                // Ignore pages for filters that have since changed
+                if (generation !== loadGeneration) {
+                    return;
                 }
                 
-                // Apply status filter if selected
-                if (statusFilter && statusFilter.value) {
-                    filteredData = filteredData.filter(record => record.status === statusFilter.value);
+                if (!append) {
+                    // Clear loading state
+                    tableBody.innerHTML = '';
                 }
+                nextCursor = page.next_cursor;
                 
-                if (filteredData.length === 0) {
+                if (rowCount === 0 && page.items.length === 0) {
                     tableBody.innerHTML = '<tr><td colspan="6" class="text-center">No attendance records found for the selected filters</td></tr>';
+                    renderPager(false);
                     return;
                 }
                 
                 // Populate table
-                filteredData.forEach((record, index) => {
+                page.items.forEach(record => {
                     const row = document.createElement('tr');
+                    rowCount += 1;
                     
                     // Format time
                     const checkInTime = record.check_in ? new Date(record.check_in).toLocaleTimeString() : 'N/A';
@@ -230,9 +299,9 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
                     
                     row.innerHTML = `
-                        <td>${index + 1}</td>
-                        <td>${record.name}</td>
-                        <td>${record.student_id}</td>
+                        <td>${rowCount}</td>
+                        <td>${record.student.name}</td>
+                        <td>${record.student.student_id}</td>
                         <td>${record.status}</td>
                         <td>${checkInTime}</td>
                         <td>${checkOutTime}</td>
@@ -240,13 +309,37 @@ document.addEventListener('DOMContentLoaded', function() {
                     
                     tableBody.appendChild(row);
                 });
+                
+                renderPager(false);
             })
             .catch(error => {
                 console.error('Error:', error);
                 tableBody.innerHTML = `<tr><td colspan="6" class="text-center text-danger">Error: ${error.message}</td></tr>`;
+                renderPager(false);
             });
     }
     
+    // "Load more" button while there are further pages
+    function renderPager(loading) {
+        const pagination = document.getElementById('pagination');
+        if (!pagination) {
+            return;
+        }
+        pagination.innerHTML = '';
+        if (!loading && !nextCursor) {
+            return;
+        }
+        
+        const item = document.createElement('li');
+        item.className = 'page-item' + (loading ? ' disabled' : '');
+        const button = document.createElement('button');
+        button.className = 'page-link';
+        button.textContent = loading ? 'Loading...' : 'Load more';
+        button.addEventListener('click', () => loadAttendanceData(dateFilter.value, true));
+        item.appendChild(button);
+        pagination.appendChild(item);
+    }
+    
         // Clean up on page unload
     window.addEventListener('beforeunload', function() {
         if (webcam) {
@@ -36,45 +36,28 @@ document.addEventListener('DOMContentLoaded', function() {
         videoElement.parentElement.appendChild(detectionCanvas);
         const ctx = detectionCanvas.getContext('2d');
 
-        // Face detection loop
-        async function detectFaces() {
-            if (webcam && webcam.isStreaming) {
-                const image = webcam.takePicture();
-                if (image) {
-                    try {
-                        const response = await fetch('/api/detect-faces', {
-                            method: 'POST',
-                            headers: {
-                                'Content-Type': 'application/json'
-                            },
-                            body: JSON.stringify({ image_data: image })
-                        });
-                        
-                        const data = await response.json();
-                        if (data.success && data.faces) {
-                            // Clear previous drawings
-                            ctx.clearRect(0, 0, detectionCanvas.width, detectionCanvas.height);
-                            
-                            // Draw rectangles
-                            ctx.strokeStyle = '#00ff00';
-                            ctx.lineWidth = 2;
-                            data.faces.forEach(face => {
-                                const [top, right, bottom, left] = face;
-                                const x = left;
-                                const y = top;
-                                const width = right - left;
-                                const height = bottom - top;
-                                ctx.strokeRect(x, y, width, height);
-                            });
-                        }
-                    } catch (error) {
-                        console.error('Face detection error:', error);
-                    }
-                }
+        // Stream frames to the server and draw the face boxes it sends back
+        const detectionStream = new FaceDetectionStream(webcam, faces => {
+            // Match the overlay resolution to the video frames the boxes refer to
+            if (videoElement.videoWidth && detectionCanvas.width !== videoElement.videoWidth) {
+                detectionCanvas.width = videoElement.videoWidth;
+                detectionCanvas.height = videoElement.videoHeight;
             }
-            // Continue detection loop
-            requestAnimationFrame(detectFaces);
-        }
+            
+            // Clear previous drawings
+            ctx.clearRect(0, 0, detectionCanvas.width, detectionCanvas.height);
+            
+            // Draw rectangles
+            ctx.strokeStyle = '#00ff00';
+            ctx.lineWidth = 2;
+            faces.forEach(face => {
+                const [top, right, bottom, left] = face;
+                ctx.strokeRect(left, top, right - left, bottom - top);
+            });
+        }, { track: true });
+        
+        // Stop streaming when leaving the page
+        window.addEventListener('beforeunload', detectionStream.stop);
 
         // Start detection loop when webcam starts
         webcam.start()
@@ -83,8 +66,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (captureContainer) {
                     captureContainer.classList.remove('d-none');
                 }
-                // Start face detection loop
-                detectFaces();
+                // Start face detection stream
+                detectionStream.start();
             })
             .catch(err => {
                 console.error('Error starting webcam:', err);
@@ -95,7 +78,9 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    // JPEG Blob of the captured face, uploaded as is
     let capturedImage = null;
+    let previewUrl = null;
     
     // Start webcam when page loads
     if (webcam) {
@@ -124,21 +109,25 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             // Take picture
-            capturedImage = webcam.takePicture();
-            
-            if (capturedImage) {
-                // Show preview
-                if (previewImg) {
-                    previewImg.src = capturedImage;
-                    if (captureContainer) captureContainer.classList.add('d-none');
-                    if (previewContainer) previewContainer.classList.remove('d-none');
-                }
+            webcam.takePictureBlob().then(blob => {
+                capturedImage = blob;
                 
-                // Temporarily stop webcam to save resources
-                webcam.stop();
-            } else {
-                alert('Failed to capture image. Please try again.');
-            }
+                if (capturedImage) {
+                    // Show preview
+                    if (previewImg) {
+                        if (previewUrl) URL.revokeObjectURL(previewUrl);
+                        previewUrl = URL.createObjectURL(capturedImage);
+                        previewImg.src = previewUrl;
+                        if (captureContainer) captureContainer.classList.add('d-none');
+                        if (previewContainer) previewContainer.classList.remove('d-none');
+                    }
+                    
+                    // Temporarily stop webcam to save resources
+                    webcam.stop();
+                } else {
+                    alert('Failed to capture image. Please try again.');
+                }
+            });
         });
     }
     
@@ -229,29 +218,21 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(student => {
-                // Now register face for the student
-                const faceData = {
-                    image_data: capturedImage
-                };
-                
-                // Create form data for the face registration
+                // Now register face for the student: the JPEG goes up as a
+                // multipart file, without base64
                 const formData = new FormData();
                 formData.append('student_id', student.id);
+                formData.append('image', capturedImage, 'face.jpg');
                 
                 // Send face data to API
                 return fetch('/api/students/register-face', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        image_data: capturedImage,
-                        student_id: student.id
-                    })
+                    body: formData
                 });
             })
             .then(response => {
-                if (!response.ok) {
+                // 422: the photo failed the quality check, its message says how to retake it
+                if (!response.ok && response.status !== 422) {
                     throw new Error('Error registering face');
                 }
                 return response.json();
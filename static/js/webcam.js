@@ -20,6 +20,7 @@ class Webcam {
         this.start = this.start.bind(this);
         this.stop = this.stop.bind(this);
         this.takePicture = this.takePicture.bind(this);
+        this.takePictureBlob = this.takePictureBlob.bind(this);
         this.dataURItoBlob = this.dataURItoBlob.bind(this);
     }
     
@@ -110,6 +111,33 @@ class Webcam {
         return null;
     }
     
+    /**
+     * Take a picture from the webcam as binary image data
+     * @param {number} quality - Encoder quality, defaults to the imageQuality option
+     * @returns {Promise<Blob>} - Resolves with the encoded image, or null if not streaming
+     */
+    takePictureBlob(quality) {
+        if (!this.isStreaming) {
+            console.error('Webcam is not streaming');
+            return Promise.resolve(null);
+        }
+        
+        const width = this.video.videoWidth;
+        const height = this.video.videoHeight;
+        
+        if (!width || !height) {
+            return Promise.resolve(null);
+        }
+        
+        this.canvas.width = width;
+        this.canvas.height = height;
+        this.context.drawImage(this.video, 0, 0, width, height);
+        
+        return new Promise((resolve) => {
+            this.canvas.toBlob(resolve, this.options.imageFormat, quality || this.options.imageQuality);
+        });
+    }
+    
     /**
      * Convert a data URI to a Blob object
      * @param {string} dataURI - Base64 encoded image data URI
@@ -135,3 +163,161 @@ class Webcam {
         return new Blob([ab], { type: mimeString });
     }
 }
+
+/**
+ * Streams webcam frames to the server over a WebSocket and receives face boxes
+ *
+ * Only one frame is in flight at a time: the next frame is captured after the
+ * server acknowledges the previous one, so a slow server slows the stream down
+ * instead of building a backlog. With the track option the server runs full
+ * detection only every few frames and follows the faces in between.
+ *
+ * Acknowledgements of frames with faces carry a frame_handle; latestFrame()
+ * returns the last such frame with its handle, for a mark or register call
+ * that should not have the frame decoded and detected again.
+ */
+class FaceDetectionStream {
+    constructor(webcam, onFaces, options = {}) {
+        this.webcam = webcam;
+        this.onFaces = onFaces;
+        this.options = {
+            url: options.url || '/ws/detect-faces',
+            track: options.track || false,
+            imageQuality: options.imageQuality || 0.7,
+            reconnectDelay: options.reconnectDelay || 2000,
+            // Handles expire on the server after FACE_FRAME_CACHE_TTL (10 s)
+            handleMaxAge: options.handleMaxAge || 5000
+        };
+        this.socket = null;
+        this.seq = 0;
+        this.pendingImage = null;
+        this.latest = null;
+        this.running = false;
+        this.reconnectTimer = null;
+        
+        this.start = this.start.bind(this);
+        this.stop = this.stop.bind(this);
+        this.sendFrame = this.sendFrame.bind(this);
+    }
+    
+    /**
+     * Open the stream and start sending frames
+     */
+    start() {
+        if (this.running) {
+            return;
+        }
+        this.running = true;
+        
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const query = this.options.track ? '?mode=track' : '';
+        const socket = new WebSocket(`${protocol}//${window.location.host}${this.options.url}${query}`);
+        socket.binaryType = 'arraybuffer';
+        this.socket = socket;
+        
+        socket.onopen = () => this.sendFrame();
+        
+        socket.onmessage = (event) => {
+            let retryAfter = 0;
+            try {
+                const ack = JSON.parse(event.data);
+                retryAfter = ack.retry_after || 0;
+                if (ack.seq === this.seq) {
+                    this.latest = ack.frame_handle
+                        ? { image: this.pendingImage, handle: ack.frame_handle, at: Date.now() }
+                        : null;
+                }
+                if (!retryAfter) {
+                    this.onFaces(ack.faces || [], ack);
+                }
+            } catch (error) {
+                console.error('Face detection stream error:', error);
+            }
+            // Pace on the acknowledgement: capture the next frame now,
+            // or after the requested pause if the server is busy
+            if (retryAfter) {
+                setTimeout(this.sendFrame, retryAfter * 1000);
+            } else {
+                requestAnimationFrame(this.sendFrame);
+            }
+        };
+        
+        socket.onclose = () => {
+            this.socket = null;
+            if (this.running) {
+                // Reconnect after a short pause
+                this.running = false;
+                this.reconnectTimer = setTimeout(this.start, this.options.reconnectDelay);
+            }
+        };
+        
+        socket.onerror = (error) => {
+            console.error('Face detection stream error:', error);
+        };
+    }
+    
+    /**
+     * The last frame the server found faces in, with its frame_handle
+     * @returns {{image: Blob, handle: string}|null} - null if there is none recent enough
+     */
+    latestFrame() {
+        const latest = this.latest;
+        if (!latest || Date.now() - latest.at > this.options.handleMaxAge) {
+            return null;
+        }
+        return latest;
+    }
+    
+    /**
+     * Close the stream
+     */
+    stop() {
+        this.running = false;
+        clearTimeout(this.reconnectTimer);
+        if (this.socket) {
+            this.socket.close();
+            this.socket = null;
+        }
+    }
+    
+    /**
+     * Capture the current frame and send it as one binary message
+     */
+    sendFrame() {
+        const socket = this.socket;
+        if (!this.running || !socket || socket.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        
+        // Nothing to send while the camera is paused, look again shortly
+        if (!this.webcam.isStreaming) {
+            setTimeout(this.sendFrame, 250);
+            return;
+        }
+        
+        let image = null;
+        this.webcam.takePictureBlob(this.options.imageQuality)
+            .then(blob => {
+                image = blob;
+                return blob ? blob.arrayBuffer() : null;
+            })
+            .then(buffer => {
+                if (!buffer || socket.readyState !== WebSocket.OPEN) {
+                    setTimeout(this.sendFrame, 250);
+                    return;
+                }
+                
+                // 4-byte big-endian sequence number followed by the JPEG bytes
+                this.seq = (this.seq + 1) >>> 0;
+                this.pendingImage = image;
+                const message = new Uint8Array(4 + buffer.byteLength);
+                new DataView(message.buffer).setUint32(0, this.seq);
+                message.set(new Uint8Array(buffer), 4);
+                socket.send(message);
+            })
+            .catch(error => {
+                console.error('Face detection stream error:', error);
+                setTimeout(this.sendFrame, 250);
+            });
+    }
+}